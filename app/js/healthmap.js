@@ -40,6 +40,15 @@ let countryFeaturesByDay = {};
 let provinceFeaturesByDay = {};
 let atomicFeaturesByDay = {};
 
+// Per-country and per-province series of counts, as computed by the
+// pipeline.
+let countryAggregates = {'dates': [], 'series': {}};
+let provinceAggregates = {'dates': [], 'series': {}};
+
+// File names of the daily slices before the latest one, by date. They
+// include a hash of their content, so they can be cached for good.
+let sliceFileNames = {};
+
 let timeControl = document.getElementById('slider');
 
 function onMapZoomChanged() {
@@ -118,36 +127,41 @@ function oneDayBefore(dateString) {
           zfill(date.getDate(), 2)].join('-');
 }
 
+/**
+ * Returns an object mapping names to the 'total' and 'new' counts for the
+ * given date, out of a set of aggregated series.
+ */
+function aggregatesAtDate(aggregates, date) {
+  let result = {};
+  const i = aggregates['dates'].indexOf(date);
+  if (i < 0) {
+    return result;
+  }
+  let series = aggregates['series'];
+  for (let name in series) {
+    const total = series[name]['total'][i];
+    const newCases = series[name]['new'][i];
+    // Only keep places that have cases so far.
+    if (total || newCases) {
+      result[name] = {'total': total, 'new': newCases};
+    }
+  }
+  return result;
+}
+
 function processDailySlice(dateString, jsonData) {
   let currentDate = jsonData['date'];
   let features = jsonData['features'];
 
-  // Cases grouped by country and province.
-  let provinceFeatures = {};
-  let countryFeatures = {};
-
   // "Re-hydrate" the features into objects ingestable by the map.
   for (let i = 0; i < features.length; i++) {
-    let feature = formatFeatureForMap(features[i]);
-
-    // If we don't know where this is, discard.
-    if (!locationInfo[feature['properties']['geoid']]) {
-      continue;
-    }
-    // City, province, country.
-    let location = locationInfo[feature['properties']['geoid']].split(',');
-    if (!provinceFeatures[location[1]]) {
-      provinceFeatures[location[1]] = {'total': 0, 'new': 0};
-    }
-    provinceFeatures[location[1]]['total'] += feature['properties']['total'];
-    provinceFeatures[location[1]]['new'] += feature['properties']['new'];
-    if (!countryFeatures[location[2]]) {
-      countryFeatures[location[2]] = {'total': 0, 'new': 0};
-    }
-    countryFeatures[location[2]]['total'] += feature['properties']['total'];
-    countryFeatures[location[2]]['new'] += feature['properties']['new'];
+    formatFeatureForMap(features[i]);
   }
 
+  // Cases grouped by country and province.
+  let provinceFeatures = aggregatesAtDate(provinceAggregates, currentDate);
+  let countryFeatures = aggregatesAtDate(countryAggregates, currentDate);
+
   dates.unshift(currentDate);
 
   countryFeaturesByDay[currentDate] = countryFeatures;
@@ -168,9 +182,14 @@ function processDailySlice(dateString, jsonData) {
 function fetchDailySlice(dateString) {
   dateString = dateString || 'latest';
 
-  let url = 'dailies/' + dateString.replace(/-/g, '.') + '.json';
-  if (dateString == 'latest') {
-    url += '?nocache=' + timestamp;
+  let url = 'dailies/latest.json?nocache=' + timestamp;
+  if (dateString != 'latest') {
+    if (!sliceFileNames[dateString]) {
+      // We're done downloading data.
+      onAllDailySlicesFetched();
+      return;
+    }
+    url = 'dailies/' + sliceFileNames[dateString];
   }
   fetch(url)
       .then(function(response) {
@@ -225,41 +244,9 @@ function formatFeatureForMap(feature) {
   return feature;
 }
 
-function fetchWhoData() {
-  const params = {
-    'where': '1=1',
-    'geometryType': 'esriGeometryEnvelope',
-    'spatialRel': 'esriSpatialRelIntersects',
-    'units': 'esriSRUnit_Meter',
-    'returnGeodetic': 'true',
-    'outFields': 'cum_conf%2C+ADM0_NAME',
-    'returnGeometry': 'false',
-    'returnCentroid': 'true',
-    'featureEncoding': 'esriDefault',
-    'multipatchOption': 'xyFootprint',
-    'applyVCSProjection': 'false',
-    'returnIdsOnly': 'false',
-    'returnUniqueIdsOnly': 'false',
-    'returnCountOnly': 'false',
-    'returnExtentOnly': 'false',
-    'returnQueryGeometry': 'false',
-    'returnDistinctValues': 'false',
-    'cacheHint': 'false',
-    'returnZ': 'false',
-    'returnM': 'false',
-    'returnExceededLimitFeatures': 'true',
-    'f': 'pjson'
-  }
-  const token = '5T5nSi527N4F7luB';
-  let paramArray = [];
-  for (let p in params) {
-    paramArray.push(p + '=' + params[p]);
-  }
-  const url = 'https://services.arcgis.com/' +
-      token + '/' +
-      'ArcGIS/rest/services/COVID_19_CasesByCountry(pl)_VIEW/' +
-      'FeatureServer/0/query?' +
-      paramArray.join('&');
+// Load per-country totals, as generated by the pipeline.
+function fetchCountryTotals() {
+  const url = 'countryTotals.json?nocache=' + timestamp;
 
   return fetch(url)
     .then(function(response) { return response.json(); })
@@ -317,6 +304,28 @@ function fetchLocationData() {
     });
 }
 
+// Load the names of the daily slice files.
+function fetchSliceManifest() {
+  return fetch('dailies/manifest.json?nocache=' + timestamp)
+    .then(function(response) { return response.json(); })
+    .then(function(jsonData) {
+      sliceFileNames = jsonData['slices'];
+    });
+}
+
+// Load the per-country and per-province series.
+function fetchAggregates() {
+  const fetchSeries = function(name) {
+    return fetch('dailies/aggregates/' + name + '.json?nocache=' + timestamp)
+      .then(function(response) { return response.json(); });
+  };
+  return Promise.all([fetchSeries('countries'), fetchSeries('provinces')])
+    .then(function(jsonData) {
+      countryAggregates = jsonData[0];
+      provinceAggregates = jsonData[1];
+    });
+}
+
 function fetchCountryNames() {
   return fetch('countries.data')
     .then(function(response) { return response.text(); })
@@ -615,7 +624,9 @@ function initMap() {
       fetchLatestCounts(),
       fetchCountryNames(),
       fetchLocationData(),
-      fetchWhoData()
+      fetchAggregates(),
+      fetchSliceManifest(),
+      fetchCountryTotals()
     ]).then(onBasicDataFetched);
 
     showLegend();
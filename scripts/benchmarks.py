@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks for the slower steps of the pipeline, run on synthetic data.
+
+Usage: python3 scripts/benchmarks.py [benchmark ...] [--rows N]
+'''
+
+import argparse
+import functions
+import multiprocessing
+import generate_full_data
+import ingest
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import time
+
+SHEET_COLUMNS = ['ID', 'latitude', 'longitude', 'city', 'province', 'country',
+                 'age', 'sex', 'symptoms', 'source', 'date_confirmation',
+                 'geo_resolution']
+
+PLACES = [
+    ('52.52', '13.405', 'berlin', 'Berlin', 'Germany'),
+    ('48.8566', '2.3522', ' Paris', 'ile-de-france', 'France'),
+    ('35.6762', '139.6503', 'Tokyo ', 'Tokyo', 'Japan'),
+    ('-33.8688', '151.2093', 'sydney', 'new\xa0south wales', 'Australia'),
+    ('19.4326', '-99.1332', 'Ciudad De Mexico', 'Mexico City', 'Mexico'),
+    ('#REF!', '2.1734', 'Barcelona', 'Catalonia', 'Spain'),
+    ('N/A', 'N/A', '', '', 'Italy'),
+]
+
+
+def synthetic_sheet(rows, seed=0, locations=0):
+    '''
+    Returns a DataFrame that looks like a sheet export: strings everywhere,
+    a few invalid coordinates, date ranges and inconsistent names.
+    With 'locations', valid coordinates are spread over that many points.
+    '''
+    rng = np.random.RandomState(seed)
+    places = [PLACES[i] for i in rng.randint(0, len(PLACES), rows)]
+    if locations:
+        points = [('%.4f' % lat, '%.4f' % lng) for lat, lng in
+                  zip(rng.uniform(-60, 60, locations), rng.uniform(-180, 180, locations))]
+        for i, j in enumerate(rng.randint(0, locations, rows)):
+            if places[i][0] not in ['#REF!', 'N/A']:
+                places[i] = points[j] + places[i][2:]
+    days = rng.randint(1, 29, rows)
+    months = rng.randint(1, 5, rows)
+    dates = ['%02d.%02d.2020' % (d, m) for d, m in zip(days, months)]
+    for i in np.flatnonzero(rng.rand(rows) < 0.05):
+        dates[i] = '01.01.2020 - ' + dates[i]
+    for i in np.flatnonzero(rng.rand(rows) < 0.02):
+        dates[i] = ''
+
+    data = pd.DataFrame({
+        'ID': [str(i) for i in range(rows)],
+        'latitude': [p[0] for p in places],
+        'longitude': [p[1] for p in places],
+        'city': [p[2] for p in places],
+        'province': [p[3] for p in places],
+        'country': [p[4] for p in places],
+        'age': '',
+        'sex': '',
+        'symptoms': '',
+        'source': 'synthetic',
+        'date_confirmation': dates,
+        'geo_resolution': 'point',
+    })
+    return data[SHEET_COLUMNS]
+
+
+def best_time(func, *args, repeat=3):
+    '''
+    Returns the best wall time over a few runs, and the last result.
+    '''
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        result = func(*args)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def legacy_clean_data(data, colnames):
+    '''
+    The original row-by-row implementation of functions.clean_data, kept
+    here for comparison.
+    '''
+    df = data.copy()
+    df.rename({x: x.strip() for x in df.columns}, inplace=True, axis=1)
+
+    lat, lon = df.latitude, df.longitude
+    invalid_lat = lat.str.contains('#REF') | lat.str.contains('N/A') | lat.isnull() | (lat == '')
+    invalid_lon = lon.str.contains('#REF') | lon.str.contains('N/A') | lon.isnull() | (lon == '')
+    df = df[~(invalid_lat | invalid_lon)]
+
+    df['date_confirmation'] = df['date_confirmation'].str.strip()
+    dc = df.date_confirmation.fillna('')
+    dc = dc.apply(lambda x: x.split('-')[1].strip() if '-' in x else x.strip())
+    valid_date = (dc != '') & ~(dc.isnull()) & dc.str.match(r'.*\d{2}\.\d{2}\.\d{4}.*')
+    df = df[valid_date]
+    df['date_confirmation'] = df['date_confirmation'].str.strip()
+
+    for c in ['city', 'province', 'country']:
+        df[c] = df[c].str.strip()
+        df[c] = df[c].str.title()
+        df[c] = df[c].str.replace('\xa0', ' ')
+
+    return df[colnames]
+
+
+def bench_clean_data(rows):
+    data = synthetic_sheet(rows)
+    legacy_time, expected = best_time(legacy_clean_data, data, SHEET_COLUMNS)
+    new_time, result = best_time(functions.clean_data, data, SHEET_COLUMNS)
+
+    # Location names are categorical in the new version.
+    same = expected.reset_index(drop=True).equals(
+        result.astype(object).reset_index(drop=True))
+    print("clean_data, " + str(rows) + " rows:")
+    print("  legacy:     %.3fs" % legacy_time)
+    print("  vectorized: %.3fs (%.1fx)" % (new_time, legacy_time / new_time))
+    print("  identical output: " + str(same))
+
+
+def legacy_animation_formating(infile):
+    '''
+    The original per-date, per-coordinate implementation of
+    functions.animation_formating, kept here for comparison.
+    '''
+    with open(infile, 'r') as F:
+        data = json.load(F)
+
+    data = pd.DataFrame(data['data'])
+    data = data[['latitude', 'longitude', 'date_confirmation']]
+    data = data[data.latitude != '#REF!']
+    data = data[data.longitude != '#REF!']
+    data = data[data.date_confirmation != '#REF!']
+
+    data['date'] = pd.to_datetime(data.date_confirmation, errors='coerce', format='%d.%m.%Y')
+    data['coord'] = data.apply(lambda s: str('{}|{}'.format(s['latitude'], s['longitude'])), axis=1)
+    data.dropna(inplace=True)
+    data.sort_values(by='date', inplace=True)
+
+    sums = {}
+    results = {}
+    for date in data.date.unique():
+        datestr = pd.to_datetime(date).strftime('%Y-%m-%d')
+        if datestr not in results.keys():
+            results[datestr] = []
+
+        subset = data[data.date == date]
+        for coord in subset.coord.unique():
+            N_cases = len(subset[subset.coord == coord])
+            sums[coord] = sums.get(coord, 0) + N_cases
+
+            lat, long = coord.split('|')
+            results[datestr].append({'caseCount': sums[coord],
+                                     'latitude': lat,
+                                     'longitude': long})
+            if sums[coord] < 10:
+                pin = 'pin4.svg'
+            elif sums[coord] >= 10 and sums[coord] < 25:
+                pin = 'pin3.svg'
+            elif sums[coord] >= 25 and sums[coord] < 50:
+                pin = 'pin2.svg'
+            else:
+                pin = 'pin1.svg'
+            results[datestr][-1]['pin'] = pin
+
+    return [{d: results[d]} for d in results.keys()]
+
+
+def synthetic_full_data(rows, locations=2000):
+    '''
+    Writes a full-data.json style file from a synthetic sheet, and returns
+    its path.
+    '''
+    data = functions.clean_data(synthetic_sheet(rows, locations=locations), SHEET_COLUMNS)
+    path = os.path.join(tempfile.mkdtemp(), 'full-data.json')
+    functions.savedata({'data': data.astype(object).to_dict(orient='records')}, path)
+    return path
+
+
+def bench_animation_formating(rows):
+    infile = synthetic_full_data(rows)
+    legacy_time, expected = best_time(legacy_animation_formating, infile)
+    new_time, result = best_time(functions.animation_formating, infile)
+    shutil.rmtree(os.path.dirname(infile))
+
+    # The legacy sort isn't stable, so locations within a date may come in a
+    # different order.
+    def by_date(blocks):
+        return {d: sorted(entries, key=lambda e: (e['latitude'], e['longitude']))
+                for block in blocks for d, entries in block.items()}
+    same = by_date(expected) == by_date(result)
+    print("animation_formating, " + str(rows) + " rows:")
+    print("  legacy:     %.3fs" % legacy_time)
+    print("  vectorized: %.3fs (%.1fx)" % (new_time, legacy_time / new_time))
+    print("  identical output: " + str(same))
+
+
+def legacy_convert_to_geojson(infile, outfile):
+    '''
+    The original iterrows() implementation of functions.convert_to_geojson,
+    kept here for comparison.
+    '''
+    with open(infile, 'r') as F:
+        data = json.load(F)
+    df = pd.DataFrame(data['data'])
+
+    geojson_data = []
+    for i, row in df.iterrows():
+        geojson_data.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [float(row['longitude']), float(row['latitude'])]
+            },
+            'properties': {
+                'age': row['age'],
+                'sex': row['sex'],
+                'city': row['city'],
+                'province': row['province'],
+                'country': row['country'],
+                'date': row['date_confirmation'],
+                'source': row['source'],
+                'symptoms': row['symptoms'],
+                'cases': row['cases'],
+                'geo_resolution': row['geo_resolution']
+            }
+        })
+
+    with open(outfile, 'w') as F:
+        json.dump({'type': 'FeatureCollection', 'features': geojson_data}, F)
+
+
+def bench_convert_to_geojson(rows):
+    data = functions.clean_data(synthetic_sheet(rows, locations=2000), SHEET_COLUMNS)
+    data['cases'] = 1
+    temp_dir = tempfile.mkdtemp()
+    infile = os.path.join(temp_dir, 'aggregated.json')
+    functions.savedata({'data': data.astype(object).to_dict(orient='records')}, infile)
+
+    legacy_out = os.path.join(temp_dir, 'legacy.geojson')
+    new_out = os.path.join(temp_dir, 'new.geojson')
+    legacy_time, _ = best_time(legacy_convert_to_geojson, infile, legacy_out)
+    new_time, count = best_time(functions.convert_to_geojson, infile, new_out)
+    with open(legacy_out) as f:
+        expected = json.load(f)
+    with open(new_out) as f:
+        same = json.load(f) == expected
+    shutil.rmtree(temp_dir)
+
+    print("convert_to_geojson, " + str(count) + " features:")
+    print("  legacy:    %.3fs (%d features/s)" % (legacy_time, count / legacy_time))
+    print("  streaming: %.3fs (%d features/s)" % (new_time, count / new_time))
+    print("  identical output: " + str(same))
+
+
+def bench_ingest(rows):
+    temp_dir = tempfile.mkdtemp()
+    path = lambda name: os.path.join(temp_dir, name)
+    data = synthetic_sheet(rows, locations=rows // 20)
+    changes = max(1, rows // 1000)
+    extra = synthetic_sheet(changes, seed=1, locations=changes)
+    extra['ID'] = [str(rows + i) for i in range(len(extra))]
+
+    print("prepare_latest_data, " + str(rows) + " rows:")
+    # A typical day only appends rows, but some days existing ones get fixed.
+    for name, update in [('appended', pd.concat([data, extra])),
+                         ('modified', pd.concat([data.iloc[changes:], extra]))]:
+        data.to_csv(path('latestdata.csv'), index=False)
+        ingest.ingest_latest_data(path('latestdata.csv'), path('state.pickle'),
+                                  True, path('ingest.data'))
+        update.to_csv(path('latestdata.csv'), index=False)
+        full_time, expected = best_time(generate_full_data.prepare_latest_data,
+            path('latestdata.csv'), True, path('full.data'))
+        # Only the first run gets to apply the update.
+        t0 = time.time()
+        result = ingest.ingest_latest_data(path('latestdata.csv'),
+            path('state.pickle'), True, path('ingest.data'))
+        ingest_time = time.time() - t0
+        os.remove(path('state.pickle'))
+
+        print("  " + str(changes) + " rows " + name + ":")
+        print("    full:        %.3fs" % full_time)
+        print("    incremental: %.3fs (%.1fx)" % (ingest_time, full_time / ingest_time))
+        print("    identical output: " + str(expected.equals(result)))
+    shutil.rmtree(temp_dir)
+
+
+def bench_parallel_read(rows):
+    temp_dir = tempfile.mkdtemp()
+    path = lambda name: os.path.join(temp_dir, name)
+    synthetic_sheet(rows, locations=rows // 20).to_csv(path('latestdata.csv'),
+                                                      index=False)
+    serial_time, expected = best_time(generate_full_data.prepare_latest_data,
+        path('latestdata.csv'), True, path('serial.data'))
+
+    print("prepare_latest_data, " + str(rows) + " rows:")
+    print("  serial:        %.3fs" % serial_time)
+    processes = 1
+    while True:
+        parallel_time, result = best_time(
+            generate_full_data.prepare_latest_data_parallel,
+            path('latestdata.csv'), processes, True, path('parallel.data'))
+        with open(path('serial.data')) as f, open(path('parallel.data')) as g:
+            same = expected.equals(result) and f.read() == g.read()
+        print("  %2d processes: %.3fs (%.1fx), identical output: %s" % (
+              processes, parallel_time, serial_time / parallel_time, same))
+        if processes >= multiprocessing.cpu_count():
+            break
+        processes = min(processes * 2, multiprocessing.cpu_count())
+    shutil.rmtree(temp_dir)
+
+
+BENCHMARKS = {
+    'animation_formating': bench_animation_formating,
+    'convert_to_geojson': bench_convert_to_geojson,
+    'clean_data': bench_clean_data,
+    'ingest': bench_ingest,
+    'parallel_read': bench_parallel_read,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run pipeline benchmarks')
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+                        help='benchmarks to run: ' + ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('-r', '--rows', type=int, default=200000,
+                        help='number of synthetic rows')
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            print("I don't know about benchmark '" + name + "'")
+            sys.exit(1)
+        BENCHMARKS[name](args.rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Caches the outputs of build commands (like JS compilation or Sass), keyed on
+the content of their inputs and on the command itself. When nothing changed
+since a previous build, its outputs are copied back instead of running the
+command again.
+
+Builds run as child processes, so that they can go on in the background
+while we do something else (like generating data).
+'''
+
+import json
+import os
+import shutil
+import subprocess
+
+import stages
+
+MANIFEST_FILE = "manifest.json"
+
+
+class CachedBuild(object):
+    '''
+    A command that writes 'outputs' (paths) from 'inputs' (paths or glob
+    patterns). Outputs that the command doesn't always write are only cached
+    when they are there.
+    '''
+
+    def __init__(self, name, command, inputs, outputs, cache_dir, quiet=False):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.cache_dir = cache_dir
+        self.quiet = quiet
+        self.process = None
+        self.failed = False
+        self.key = None
+
+    def entry_dir(self):
+        return os.path.join(self.cache_dir, self.name, self.key)
+
+    def start(self):
+        '''
+        Restores the outputs from the cache if we have them, or starts the
+        command otherwise.
+        '''
+        self.key = stages.Stage(self.name, None, inputs=self.inputs,
+                                params={"command": self.command}).key()
+        if self.restore():
+            if not self.quiet:
+                print("Sources for '" + self.name + "' didn't change, using "
+                      "cached build")
+            return
+        if not self.quiet:
+            print("Building '" + self.name + "'...")
+        try:
+            self.process = subprocess.Popen(
+                self.command, stderr=subprocess.DEVNULL if self.quiet else None)
+        except OSError:
+            self.failed = True
+
+    def wait(self):
+        '''
+        Waits for the command (if it was started) and caches its outputs.
+        Returns whether the build succeeded.
+        '''
+        if self.process is None:
+            return not self.failed
+        success = self.process.wait() == 0 and os.path.exists(self.outputs[0])
+        self.process = None
+        if success:
+            self.store()
+        return success
+
+    def restore(self):
+        manifest_path = os.path.join(self.entry_dir(), MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+            f.close()
+        for i, path in enumerate(manifest["outputs"]):
+            shutil.copyfile(os.path.join(self.entry_dir(), str(i)), path)
+        return True
+
+    def store(self):
+        # Fill a temporary directory first, so that an interrupted build
+        # can't leave an incomplete entry behind.
+        temp_dir = self.entry_dir() + ".tmp"
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+        outputs = [path for path in self.outputs if os.path.exists(path)]
+        for i, path in enumerate(outputs):
+            shutil.copyfile(path, os.path.join(temp_dir, str(i)))
+        with open(os.path.join(temp_dir, MANIFEST_FILE), "w") as f:
+            json.dump({"outputs": outputs}, f)
+            f.close()
+        if os.path.exists(self.entry_dir()):
+            shutil.rmtree(self.entry_dir())
+        os.replace(temp_dir, self.entry_dir())
@@ -0,0 +1,243 @@
+'''
+Consistency checks for generated daily slices.
+
+All slices are loaded into date x geoid arrays of new and total cases in one
+pass, and checked at once:
+- no day is missing between the first and the last one,
+- no location appears twice on the same day,
+- totals never decrease,
+- totals are the cumulative sum of new cases,
+- every location is known to the location info file.
+
+Works on a dailies directory (per-country series in 'aggregates' and zoom
+levels in sub-directories are left out) or on a GeoJSON file of daily
+features like 'data/dailies.geojson'.
+'''
+
+import argparse
+import functions
+import generate_full_data
+import json
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+# How many offending dates or locations to list for each problem.
+MAX_EXAMPLES = 5
+
+parser = argparse.ArgumentParser(
+    description='Check that daily slices are consistent')
+
+parser.add_argument('path', type=str, nargs='?', default='app/dailies',
+        help='dailies directory, or GeoJSON file of daily features')
+
+parser.add_argument('-l', '--location_info', type=str, default=None,
+        help='location info file that should know about every location '
+        '(defaults to app/location_info.data for a dailies directory)')
+
+parser.add_argument('-p', '--processes', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of processes to parse slices with')
+
+parser.add_argument('-q', '--quiet', action='store_true',
+        help='only report problems')
+
+
+class Dailies(object):
+    '''
+    Daily slices as date x geoid arrays.
+    Attributes:
+    :dates: -> list, dates (YYYY-MM-DD) in order.
+    :geoids: -> pd.Index, locations.
+    :new: -> np.ndarray, new cases.
+    :total: -> np.ndarray, total cases.
+    :counts: -> np.ndarray, how many features each cell comes from.
+    :problems: -> list, what went wrong while loading them.
+    '''
+
+    def __init__(self, dates, geoids, new, total, counts, problems=None):
+        self.dates = dates
+        self.geoids = geoids
+        self.new = new
+        self.total = total
+        self.counts = counts
+        self.problems = problems or []
+
+
+def to_arrays(dates, geoids, new, total, carry_totals=False, problems=None):
+    '''
+    Builds Dailies out of one (date, geoid, new, total) record per feature.
+    With 'carry_totals', a location's total carries over to the days it has
+    no feature for, otherwise it is 0 on those days.
+    '''
+    date_codes, unique_dates = pd.factorize(pd.Index(dates), sort=True)
+    geoid_codes, unique_geoids = pd.factorize(pd.Index(geoids), sort=True)
+    shape = (len(unique_dates), len(unique_geoids))
+    cells = date_codes * shape[1] + geoid_codes
+    size = shape[0] * shape[1]
+
+    def cell_sums(weights):
+        return np.bincount(cells, weights=np.asarray(weights, dtype=np.float64),
+                           minlength=size).astype(np.int64).reshape(shape)
+    counts = np.bincount(cells, minlength=size).reshape(shape)
+    new = cell_sums(new)
+    total = cell_sums(total)
+    if carry_totals and shape[0]:
+        rows = np.where(counts > 0, np.arange(shape[0])[:, None], 0)
+        rows = np.maximum.accumulate(rows, axis=0)
+        total = total[rows, np.arange(shape[1])]
+    return Dailies(list(unique_dates), unique_geoids, new, total, counts,
+                   problems)
+
+def slice_files(dailies_dir):
+    '''
+    Returns the slice files of a dailies directory: the ones its manifest
+    lists and 'latest.json', or all JSON files if there is no manifest. Also
+    returns the files that the manifest lists but that aren't there.
+    '''
+    manifest_path = os.path.join(dailies_dir, generate_full_data.MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        names = list(generate_full_data.read_manifest(dailies_dir).values())
+        names.append(generate_full_data.LATEST_SLICE_FILE)
+    else:
+        names = sorted(name for name in os.listdir(dailies_dir)
+                       if name.endswith('.json'))
+    paths = [os.path.join(dailies_dir, name) for name in names]
+    return ([p for p in paths if os.path.isfile(p)],
+            [p for p in paths if not os.path.isfile(p)])
+
+def read_slice(path):
+    '''
+    Returns the date of a slice file, along with the geoids and the new and
+    total counts of its features.
+    '''
+    with open(path) as f:
+        s = json.load(f)
+        f.close()
+    properties = [feature['properties'] for feature in s['features']]
+    return (s['date'], [p['geoid'] for p in properties],
+            np.array([p.get('new', 0) for p in properties], dtype=np.int64),
+            np.array([p['total'] for p in properties], dtype=np.int64))
+
+def load_dailies(dailies_dir, processes=1):
+    '''
+    Loads the slices of a dailies directory, parsing them with 'processes'
+    worker processes.
+    '''
+    paths, missing = slice_files(dailies_dir)
+    problems = ["The manifest lists " + str(len(missing)) + " missing "
+                "files, e.g. " + ", ".join(missing[:MAX_EXAMPLES])] if missing else []
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            slices = pool.map(read_slice, paths)
+    else:
+        slices = [read_slice(path) for path in paths]
+
+    # Slices without any location still count as a day.
+    slices += [(date, [''], np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+               for date, geoids, _, _ in slices if not geoids]
+    dates = np.repeat([date for date, _, _, _ in slices],
+                      [len(geoids) for _, geoids, _, _ in slices])
+    geoids = [g for _, geoids, _, _ in slices for g in geoids]
+    new = np.concatenate([new for _, _, new, _ in slices] or [[]])
+    total = np.concatenate([total for _, _, _, total in slices] or [[]])
+    return to_arrays(dates, geoids, new, total, problems=problems)
+
+def load_geojson(path):
+    '''
+    Loads a GeoJSON file of daily features, where each feature only appears
+    on days with new cases.
+    '''
+    with open(path) as f:
+        features = json.load(f)['features']
+        f.close()
+    properties = [feature['properties'] for feature in features]
+    coordinates = [feature['geometry']['coordinates'] for feature in features]
+    return to_arrays([p['date'] for p in properties],
+                     [str(c[1]) + '|' + str(c[0]) for c in coordinates],
+                     [p.get('new', 0) for p in properties],
+                     [p['total'] for p in properties], carry_totals=True)
+
+def cell_examples(dailies, mask):
+    cells = np.argwhere(mask)[:MAX_EXAMPLES]
+    return ", ".join("'" + dailies.geoids[g] + "' on " + dailies.dates[d]
+                     for d, g in cells)
+
+def check(dailies, location_info=None):
+    '''
+    Returns a list of problems with the given Dailies, empty if there are
+    none. Locations are checked against 'location_info' when given.
+    '''
+    problems = list(dailies.problems)
+    if not dailies.dates:
+        return problems + ["There are no daily slices"]
+
+    # The placeholder for slices without any location.
+    real = (dailies.geoids != '')
+
+    days = pd.date_range(dailies.dates[0], dailies.dates[-1]).strftime('%Y-%m-%d')
+    missing = days.difference(dailies.dates)
+    if len(missing):
+        problems.append(str(len(missing)) + " days are missing, e.g. " +
+                        ", ".join(missing[:MAX_EXAMPLES]))
+
+    duplicated = (dailies.counts > 1) & real
+    if duplicated.any():
+        problems.append(str(int(duplicated.sum())) + " locations appear more "
+                        "than once on the same day, e.g. " +
+                        cell_examples(dailies, duplicated))
+
+    decreasing = np.zeros(dailies.total.shape, dtype=bool)
+    decreasing[1:] = np.diff(dailies.total, axis=0) < 0
+    if decreasing.any():
+        problems.append(str(int(decreasing.sum())) + " totals are lower than "
+                        "on the day before, e.g. " +
+                        cell_examples(dailies, decreasing))
+
+    mismatched = dailies.total != np.cumsum(dailies.new, axis=0)
+    if mismatched.any():
+        problems.append(str(int(mismatched.sum())) + " totals aren't the sum of "
+                        "new cases so far, e.g. " +
+                        cell_examples(dailies, mismatched))
+
+    if location_info is not None:
+        unknown = [g for g in dailies.geoids[real] if g not in location_info]
+        if unknown:
+            problems.append(str(len(unknown)) + " locations aren't in the "
+                            "location info, e.g. " +
+                            ", ".join(unknown[:MAX_EXAMPLES]))
+    return problems
+
+def check_dailies(path, location_info_file=None, quiet=False, processes=1):
+    '''
+    Checks a dailies directory or GeoJSON file, and reports problems.
+    Returns whether there were none.
+    '''
+    if not quiet:
+        print("Checking daily slices in '" + path + "'...")
+    if os.path.isdir(path):
+        dailies = load_dailies(path, processes)
+    else:
+        dailies = load_geojson(path)
+    location_info = None
+    if location_info_file:
+        location_info = functions.read_location_info(location_info_file)
+    problems = check(dailies, location_info)
+    for problem in problems:
+        print(problem)
+    if not problems and not quiet:
+        print("Checked " + str(len(dailies.dates)) + " days and " +
+              str(len(dailies.geoids)) + " locations, all good.")
+    return not problems
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    location_info_file = args.location_info
+    if location_info_file is None and os.path.isdir(args.path):
+        location_info_file = generate_full_data.LOCATION_INFO_FILE
+    if not check_dailies(args.path, location_info_file, quiet=args.quiet,
+                        processes=args.processes):
+        sys.exit(1)
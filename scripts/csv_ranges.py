@@ -0,0 +1,66 @@
+'''
+Splits CSV files into byte ranges that can be parsed independently, e.g. by
+several worker processes.
+
+Ranges end at line boundaries, and never in the middle of a quoted field:
+quotes (including doubled, escaped ones) come in pairs, so a newline is only
+a record boundary if an even number of quotes precede it.
+'''
+
+import io
+import mmap
+import os
+import pandas as pd
+
+
+def read_header(path):
+    '''
+    Returns the header line of a CSV file (with its newline), assuming column
+    names don't contain newlines.
+    '''
+    with open(path, 'rb') as f:
+        return f.readline()
+
+
+def split_ranges(path, parts):
+    '''
+    Returns up to 'parts' (start, end) byte ranges covering the records of a
+    CSV file, after its header line.
+    '''
+    size = os.path.getsize(path)
+    start = len(read_header(path))
+    if start >= size:
+        return []
+
+    boundaries = [start]
+    with open(path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        quotes = 0
+        position = start
+        for i in range(1, parts):
+            target = max(start + (size - start) * i // parts, position + 1)
+            newline = content.find(b'\n', target)
+            while newline >= 0:
+                quotes += content[position:newline].count(b'"')
+                position = newline
+                if quotes % 2 == 0:
+                    break
+                newline = content.find(b'\n', newline + 1)
+            if newline < 0:
+                break
+            if newline + 1 < size:
+                boundaries.append(newline + 1)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_range(path, start, end, **kwargs):
+    '''
+    Parses the records of a CSV file between the given byte offsets, using
+    the file's header line. Keyword arguments go to pd.read_csv.
+    '''
+    header = read_header(path)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+    return pd.read_csv(io.BytesIO(header + content), **kwargs)
@@ -0,0 +1,739 @@
+#!/usr/bin/env python3
+
+'''
+Keeps the daily slices up to date from a long-running process.
+
+The merged date x geoid matrix of new cases stays in memory between
+refreshes, along with the line list rows it was built from, the matrices of
+every kind of slice (zoom levels, weeks and months) and the location index.
+Every few minutes we poll the sources (URLs, or local files). Line list rows
+that were added, modified or removed are ingested into a matrix of changes,
+and so is the difference with the previous JHU data. The changes are
+applied to the matrices in memory, and only the slices, tiles and
+per-country series of dates whose counts changed are written again. Health
+and timing stats are served as JSON on a local port (/health, /stats) for
+monitoring.
+
+Outputs are the same as those of generate_full_data.py with the same
+options, except that dates and locations that lose all of their cases stay
+around (with zeros) until the daemon is restarted.
+'''
+
+import argparse
+import functions
+import generate_full_data
+import hashlib
+import ingest
+import json
+import location_index
+import numpy as np
+import os
+import pandas as pd
+import requests
+import shutil
+import snapping
+import spatial_index
+import split
+import sys
+import threading
+import time
+import vector_tiles
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser(
+    description='Keep daily slices up to date from a long-running process')
+
+parser.add_argument('out_dir', type=str,
+        help='path to dailies directory')
+
+parser.add_argument('-l', '--latest', type=str, default='',
+        help='local latestdata.csv to watch, fetch from github otherwise')
+
+parser.add_argument('--input_jhu', type=str, default='',
+        help='local JHU file to watch, fetch from github otherwise')
+
+parser.add_argument('-i', '--interval', type=int, default=600,
+        help='seconds between two polls of the sources')
+
+parser.add_argument('-p', '--port', type=int, default=8001,
+        help='local port to serve health and stats on')
+
+parser.add_argument('-d', '--work_dir', type=str, default='.pipeline/daemon',
+        help='directory for downloads and intermediate files')
+
+parser.add_argument('-c', '--counts', type=str, default=None,
+        help='path to write the total case count (latestCounts.json) to')
+
+parser.add_argument('-z', '--zoom_levels', type=int, nargs='*',
+        help='also keep slices aggregated on map tiles at these zoom levels')
+
+parser.add_argument('-r', '--resample', type=str, nargs='+',
+        choices=sorted(generate_full_data.RESAMPLING_PERIODS),
+        help='also keep slices of new cases by week and/or by month')
+
+parser.add_argument('--vector_tiles', type=int, nargs='*',
+        help='also keep vector tiles of the counts at these zoom levels')
+
+parser.add_argument('--tiles_period', type=str, default='day',
+        choices=['day'] + sorted(generate_full_data.RESAMPLING_PERIODS),
+        help='write vector tiles for each day, week or month')
+
+parser.add_argument('--snap', type=float, default=None, metavar='METERS',
+        help='merge locations at most this far apart that have the same '
+        'city, province and country')
+
+parser.add_argument('-q', '--quiet', action='store_true',
+        help='only report errors')
+
+
+class Source(object):
+    '''
+    An input of the pipeline, either a URL or a local file, that we poll for
+    changes.
+    '''
+
+    def __init__(self, name, location, work_dir):
+        self.name = name
+        self.location = location
+        self.is_url = location.startswith('http://') or location.startswith('https://')
+        self.path = os.path.join(work_dir, name + '.csv') if self.is_url else location
+        # What we last processed successfully (etag or file stat, digest).
+        self.version = (None, None)
+        self.pending = None
+
+    def poll(self):
+        '''
+        Returns whether the content changed since the last commit().
+        '''
+        tag, digest = self.version
+        if self.is_url:
+            headers = {'If-None-Match': tag} if tag else {}
+            req = requests.get(self.location, headers=headers, timeout=120)
+            if req.status_code == 304:
+                return False
+            if req.status_code != 200:
+                raise IOError('could not get ' + self.location + ' (' +
+                              str(req.status_code) + ')')
+            new_tag = req.headers.get('ETag')
+            content = req.content
+        else:
+            stat = os.stat(self.path)
+            new_tag = (stat.st_mtime, stat.st_size)
+            if new_tag == tag:
+                return False
+            with open(self.path, 'rb') as f:
+                content = f.read()
+
+        self.pending = (new_tag, hashlib.sha1(content).hexdigest())
+        if self.pending[1] == digest:
+            self.commit()
+            return False
+        if self.is_url:
+            with open(self.path, 'wb') as f:
+                f.write(content)
+        return True
+
+    def commit(self):
+        '''
+        Marks the content seen by the last poll as processed.
+        '''
+        if self.pending is not None:
+            self.version = self.pending
+            self.pending = None
+
+
+def time_call(timings, name, func, *args):
+    '''
+    Calls a function, and records how long it took in 'timings'.
+    '''
+    t0 = time.time()
+    result = func(*args)
+    timings[name] = round(time.time() - t0, 3)
+    return result
+
+def trim(changes):
+    '''
+    Leaves out the dates and locations of a matrix of changes that don't
+    change.
+    '''
+    if changes.empty:
+        return changes
+    nonzero = changes.values != 0
+    return changes.loc[nonzero.any(axis=1), nonzero.any(axis=0)]
+
+
+class Output(object):
+    '''
+    A date x geoid matrix of new cases and its totals, kept in memory and
+    updated from matrices of changes. Dates are the first days of periods of
+    the pandas frequency 'freq' ('D' for days), and every period between the
+    first and the last one has a row.
+    '''
+
+    def __init__(self, freq='D'):
+        self.freq = freq
+        self.new = None
+        self.total = None
+
+    def latest_date(self):
+        return self.new.index[-1].replace('.', '-') if len(self.new) else ''
+
+    def update(self, changes):
+        '''
+        Applies a matrix of changes. Returns the dates whose new or total
+        cases changed, or None the first time, when all of them did.
+        '''
+        if self.new is None:
+            self.new = generate_full_data.fill_missing_dates(changes, self.freq)
+            self.total = self.new.cumsum()
+            return None
+        if changes.empty:
+            return []
+        old_dates = self.new.index
+        old_latest = self.latest_date()
+        rows = self.new.index.get_indexer(changes.index)
+        columns = self.new.columns.get_indexer(changes.columns)
+        first = changes.index.min()
+        if (rows >= 0).all() and (columns >= 0).all():
+            # Only the cells that changed, and the totals after them.
+            self.new.iloc[rows, columns] = (
+                self.new.values[np.ix_(rows, columns)] + changes.values)
+            later = self.new.index.get_indexer(self.new.index[self.new.index >= first])
+            carried = changes.reindex(self.new.index[later], fill_value=0).cumsum()
+            self.total.iloc[later, columns] = (
+                self.total.values[np.ix_(later, columns)] + carried.values)
+        else:
+            # New dates or locations, everything moves.
+            self.new = generate_full_data.fill_missing_dates(
+                ingest.add_counts(self.new, changes), self.freq)
+            self.total = self.new.cumsum()
+
+        # A change on one day changes the totals of every later one.
+        after = changes.reindex(self.new.index[self.new.index >= first],
+                                fill_value=0)
+        changed = ((after.values != 0).any(axis=1) |
+                   (after.values.cumsum(axis=0) != 0).any(axis=1))
+        dates = set(after.index[changed]) | set(self.new.index.difference(old_dates))
+        if self.latest_date() != old_latest:
+            # The previous latest slice gets its dated name.
+            dates |= set(d for d in self.new.index
+                         if d.replace('.', '-') in (old_latest, self.latest_date()))
+        return sorted(dates)
+
+
+class SliceDir(Output):
+    '''
+    An Output written as slices in a directory, along with their manifest.
+    '''
+
+    def __init__(self, out_dir, freq='D'):
+        super().__init__(freq)
+        self.out_dir = out_dir
+        # File names of dated slices by date (YYYY-MM-DD), like the manifest.
+        self.names = {}
+
+    def update(self, changes):
+        '''
+        Applies a matrix of changes and rewrites the slices of the dates that
+        changed. Returns the dates that changed, or None when all of them
+        did.
+        '''
+        dates = super().update(changes)
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        if dates is None:
+            if len(self.new):
+                generate_full_data.write_slices(self.new, self.total,
+                    self.out_dir, self.latest_date(), overwrite=True, quiet=True)
+                self.names = generate_full_data.read_manifest(self.out_dir)
+            return None
+        if dates:
+            self.write(dates)
+        return dates
+
+    def write(self, dates):
+        latest_date = self.latest_date()
+        replaced = []
+        for date in dates:
+            s = generate_full_data.daily_slice(self.new.loc[date],
+                                               self.total.loc[date])
+            content = json.dumps(s)
+            if s['date'] == latest_date:
+                name = generate_full_data.LATEST_SLICE_FILE
+                old_name = self.names.pop(s['date'], None)
+            else:
+                name = generate_full_data.hashed_slice_name(s['date'], content)
+                old_name = self.names.get(s['date'])
+                self.names[s['date']] = name
+            if old_name and old_name != name:
+                replaced.append(old_name)
+            path = os.path.join(self.out_dir, name)
+            if name == generate_full_data.LATEST_SLICE_FILE or not os.path.exists(path):
+                generate_full_data.write_file(path, content)
+        generate_full_data.write_manifest(self.out_dir, latest_date, self.names)
+        # Only once the manifest doesn't reference them anymore.
+        for name in replaced:
+            path = os.path.join(self.out_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TileWriter(object):
+    '''
+    Writes the vector tiles of the dates of an Output that changed.
+    '''
+
+    def __init__(self, out_dir, zoom_levels):
+        self.out_dir = out_dir
+        self.tiles_dir = os.path.join(out_dir, vector_tiles.TILES_DIR)
+        self.zoom_levels = zoom_levels
+        # The geoids that tile positions were computed for.
+        self.geoids = None
+
+    def write(self, output, dates):
+        if dates is None:
+            vector_tiles.write_vector_tiles(output.new, self.out_dir,
+                self.zoom_levels, overwrite=True, quiet=True)
+            return
+        if not dates:
+            return
+        if self.geoids is None or not self.geoids.equals(output.new.columns):
+            vector_tiles.set_positions(vector_tiles.geoid_positions(
+                output.new.columns, self.zoom_levels))
+            self.geoids = output.new.columns
+        for date in dates:
+            date_dir = os.path.join(self.tiles_dir, date)
+            if os.path.exists(date_dir):
+                shutil.rmtree(date_dir)
+            vector_tiles.write_day_tiles(date, output.new.loc[date],
+                                         output.total.loc[date], self.tiles_dir)
+        vector_tiles.write_index(self.tiles_dir, output.new.index,
+                                 self.zoom_levels)
+
+
+class Aggregates(object):
+    '''
+    Per-province and per-country new cases, kept in memory and written as
+    the series of the aggregates directory.
+    '''
+
+    def __init__(self, out_dir):
+        self.out_dir = os.path.join(out_dir, generate_full_data.AGGREGATES_DIR)
+        # For each level, a date x name matrix of new cases, and the series
+        # of each name.
+        self.sums = {}
+        self.series = {}
+
+    def update(self, changes, location_info, new_cases=None):
+        '''
+        Applies a date x geoid matrix of changes, or starts over from all new
+        cases when given (e.g. when location info changed), and rewrites the
+        aggregates. Only the series of names whose cases changed are computed
+        again, unless there are new dates.
+        '''
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        for file_name, level in generate_full_data.AGGREGATE_LEVELS:
+            if new_cases is not None:
+                sums = generate_full_data.location_sums(new_cases, location_info, level)
+                names = sums.columns
+                self.series[level] = {}
+            else:
+                delta = trim(generate_full_data.location_sums(changes, location_info, level))
+                if delta.empty:
+                    continue
+                sums = self.sums[level]
+                names = delta.columns
+                if delta.index.isin(sums.index).all() and delta.columns.isin(sums.columns).all():
+                    sums.loc[delta.index, delta.columns] += delta
+                else:
+                    grown = not delta.index.isin(sums.index).all()
+                    sums = generate_full_data.fill_missing_dates(
+                        ingest.add_counts(sums, delta))
+                    if grown:
+                        names = sums.columns
+            self.sums[level] = sums
+            for name in names:
+                self.series[level][name] = generate_full_data.location_series(sums[name])
+            generate_full_data.write_file(
+                os.path.join(self.out_dir, file_name + '.json'),
+                json.dumps({'dates': [d.replace('.', '-') for d in sums.index],
+                            'series': {name: self.series[level][name]
+                                       for name in sums.columns}},
+                           separators=(',', ':')))
+
+
+class Daemon(object):
+    '''
+    Keeps the outputs of generate_full_data up to date, with 'options' like
+    those of pipeline_stages(): zoom_levels, latest_counts_file, periods,
+    snap_distance, tile_zoom_levels and tiles_period.
+    '''
+
+    def __init__(self, out_dir, work_dir, latest='', input_jhu='',
+                 quiet=False, zoom_levels=None, latest_counts_file=None,
+                 periods=None, snap_distance=None, tile_zoom_levels=None,
+                 tiles_period='day'):
+        self.out_dir = out_dir
+        self.work_dir = work_dir
+        self.quiet = quiet
+        self.zoom_levels = zoom_levels or []
+        self.latest_counts_file = latest_counts_file
+        self.periods = periods or []
+        self.snap_distance = snap_distance
+        self.tile_zoom_levels = tile_zoom_levels or []
+        self.tiles_period = tiles_period
+        self.sources = {
+            'world': Source('latestdata', latest or generate_full_data.LATEST_DATA_URL, work_dir),
+            'us': Source('jhu', input_jhu or generate_full_data.JHU_URL, work_dir),
+        }
+        work = lambda name: os.path.join(work_dir, name)
+        self.world_info = work('location_info_world.data')
+        self.us_info = work('location_info_us.data')
+        self.tiles_info = work('location_info_tiles.data')
+        # Location info before snapping, when there is snapping.
+        self.all_info = (work('location_info.data') if snap_distance
+                         else generate_full_data.LOCATION_INFO_FILE)
+
+        self.lock = threading.Lock()
+        self.stats = {'status': 'starting', 'started': time.time(),
+                      'refreshes': 0, 'last_refresh': None,
+                      'last_change': None, 'last_error': None,
+                      'timings': {}, 'slices_written': 0,
+                      'dates': 0, 'locations': 0}
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets everything we keep in memory, so that the next refresh starts
+        over from the sources.
+        '''
+        self.ingest_state = ingest.load_state(None)
+        # Line list dates (DD.MM.YYYY) that the matrix has counts for.
+        self.world_dates = set()
+        self.world_day = None
+        self.us = pd.DataFrame()
+        self.us_info_content = None
+        self.snapped = None
+        if getattr(self, 'location_index', None) is not None:
+            self.close_location_index()
+        self.location_index = None
+
+        self.slices = SliceDir(self.out_dir)
+        # Before snapping, the same as the slices otherwise.
+        self.merged = Output() if self.snap_distance else self.slices
+        self.zoom_slices = {zoom: SliceDir(os.path.join(self.out_dir,
+                                spatial_index.level_dir_name(zoom)))
+                            for zoom in self.zoom_levels}
+        self.period_slices = {period: SliceDir(os.path.join(self.out_dir,
+                                  generate_full_data.RESAMPLING_PERIODS[period][1]),
+                                  generate_full_data.RESAMPLING_PERIODS[period][0])
+                              for period in self.periods}
+        self.tiles = self.tile_dates = None
+        if self.tile_zoom_levels:
+            self.tiles = TileWriter(self.out_dir, self.tile_zoom_levels)
+            if self.tiles_period == 'day':
+                self.tile_dates = self.slices
+            else:
+                self.tile_dates = self.period_slices.get(self.tiles_period,
+                    Output(generate_full_data.RESAMPLING_PERIODS[self.tiles_period][0]))
+        self.aggregates = Aggregates(self.out_dir)
+        for source in self.sources.values():
+            source.version = (None, None)
+            source.pending = None
+
+    def log(self, message):
+        if not self.quiet:
+            print(time.strftime('%Y-%m-%d %H:%M:%S') + ' ' + message)
+
+    def world_changes(self, day_changed):
+        '''
+        Ingests the line list rows that changed. Returns the matrix of
+        changes to the counts, and whether location info may have changed.
+        '''
+        with open(self.sources['world'].path, 'rb') as f:
+            content = f.read()
+        self.ingest_state, changes, appended = ingest.ingest_content(
+            content, self.ingest_state, quiet=self.quiet)
+        matrix = self.ingest_state['matrix']
+        past = set(matrix.index[ingest.in_the_past(pd.Series(matrix.index)).values])
+        # Dates in the future only count once they're in the past.
+        changes = changes[changes.index.isin(self.world_dates)]
+        became_past = sorted(past - self.world_dates)
+        changes = ingest.add_counts(changes, matrix.loc[became_past])
+        new_geoids = not changes.columns.isin(self.merged.new.columns
+            if self.merged.new is not None else []).all()
+        self.world_dates = past
+        changes.index = [split.normalize_date(d) for d in changes.index]
+        if not appended or day_changed or new_geoids:
+            # Appended rows don't change what the first row of a known
+            # location is.
+            ingest.write_location_info(ingest.past_rows(self.ingest_state['rows']),
+                                       self.world_info, quiet=self.quiet)
+            return changes, True
+        return changes, False
+
+    def us_changes(self):
+        '''
+        Reads JHU data again. Returns the matrix of changes to the counts,
+        and whether location info changed.
+        '''
+        us = generate_full_data.prepare_jhu_data(False, self.sources['us'].path,
+            quiet=self.quiet, location_info_file=self.us_info)
+        us = us.set_index('date')
+        us.index = [split.normalize_date(d) for d in us.index]
+        # Locations that round to the same geoid are one.
+        us = us.T.groupby(level=0).sum().T
+        changes = ingest.add_counts(us, self.us, -1)
+        self.us = us
+        with open(self.us_info) as f:
+            content = f.read()
+        info_changed = content != self.us_info_content
+        self.us_info_content = content
+        return changes, info_changed
+
+    def write_location_info(self):
+        '''
+        Joins the location info of both sources, like the location_info
+        stage of generate_full_data.
+        '''
+        self.close_location_index()
+        if not os.path.exists(self.us_info):
+            open(self.us_info, 'w').close()
+        in_files = [self.world_info, self.us_info]
+        if self.zoom_levels:
+            spatial_index.write_tile_location_info(in_files, self.tiles_info,
+                                                   self.zoom_levels)
+            in_files = [self.tiles_info] + in_files
+        functions.concatenate_location_info(in_files, self.all_info)
+
+    def close_location_index(self):
+        if self.location_index is not None:
+            self.location_index.close()
+            self.location_index = None
+
+    def snap(self, changes, info_changed):
+        '''
+        Returns the changes to the snapped matrix, from changes to the merged
+        one (already applied to it), and whether the locations that snap
+        together changed.
+        '''
+        known = self.snapped is not None and changes.columns.isin(self.snapped.index).all()
+        if known and not info_changed:
+            return snapping.snap_new_cases(changes, self.snapped), False
+        with location_index.LocationIndex(self.all_info) as location_info:
+            snapped = snapping.snap_geoids(self.merged.new.columns, location_info,
+                self.snap_distance, weights=self.merged.new.sum())
+        if self.snapped is not None and snapped.equals(self.snapped):
+            return snapping.snap_new_cases(changes, self.snapped), info_changed
+        self.close_location_index()
+        snapping.write_snapped_location_info(self.all_info,
+            generate_full_data.LOCATION_INFO_FILE, snapped)
+        result = snapping.snap_new_cases(self.merged.new, snapped)
+        if self.slices.new is not None:
+            result = ingest.add_counts(result, self.slices.new, -1)
+        self.snapped = snapped
+        return result, True
+
+    def update(self, changes, info_changed):
+        '''
+        Applies changes to the merged matrix and to everything that depends
+        on it. Returns how many slices were written.
+        '''
+        timings = {}
+        timed = lambda name, func, *args: time_call(timings, name, func, *args)
+
+        first = self.slices.new is None
+        if self.snap_distance:
+            self.merged.update(changes)
+            changes, info_changed = timed('snap', self.snap, changes, info_changed)
+            changes = trim(changes)
+        if self.location_index is None:
+            self.location_index = location_index.LocationIndex(
+                generate_full_data.LOCATION_INFO_FILE)
+
+        written = 0
+        count = lambda output, dates: len(output.new) if dates is None else len(dates)
+
+        dates = timed('slices', self.slices.update, changes)
+        written += count(self.slices, dates)
+        if self.zoom_levels and not changes.empty:
+            tile_index = spatial_index.build_tile_index(changes.columns,
+                                                        self.zoom_levels)
+        for zoom, output in self.zoom_slices.items():
+            level_changes = (spatial_index.aggregate_by_tile(changes, tile_index, zoom)
+                             if not changes.empty else changes)
+            written += count(output, timed('zoom_' + str(zoom), output.update,
+                                           trim(level_changes)))
+        period_dates = {}
+        for period, output in self.period_slices.items():
+            period_changes = (generate_full_data.resample_new_cases(changes, period)
+                              if not changes.empty else changes)
+            period_dates[period] = timed(period, output.update, trim(period_changes))
+            written += count(output, period_dates[period])
+        if self.tiles:
+            if self.tiles_period == 'day':
+                tile_dates = dates
+            elif self.tiles_period in period_dates:
+                tile_dates = period_dates[self.tiles_period]
+            else:
+                tile_dates = self.tile_dates.update(trim(
+                    generate_full_data.resample_new_cases(changes, self.tiles_period)
+                    if not changes.empty else changes))
+            timed('vector_tiles', self.tiles.write, self.tile_dates, tile_dates)
+
+        if first or info_changed:
+            timed('aggregates', self.aggregates.update, None,
+                  self.location_index, self.slices.new)
+        elif not changes.empty:
+            timed('aggregates', self.aggregates.update, changes,
+                  self.location_index)
+        if self.latest_counts_file:
+            generate_full_data.write_file(self.latest_counts_file, json.dumps(
+                generate_full_data.latest_counts(self.slices.total)))
+        return written, timings
+
+    def refresh(self):
+        '''
+        Polls the sources once, and updates whatever depends on the ones that
+        changed. Returns whether anything changed.
+        '''
+        try:
+            return self.try_refresh()
+        except Exception:
+            # What's in memory may be half updated, start over next time.
+            self.reset()
+            raise
+
+    def try_refresh(self):
+        timings = {}
+        timed = lambda name, func, *args: time_call(timings, name, func, *args)
+
+        changed = {name: timed('poll_' + name, source.poll)
+                   for name, source in self.sources.items()}
+        # Dates in the future are left out of world data, so it changes with
+        # the day too.
+        today = pd.Timestamp.now().date()
+        day_changed = today != self.world_day
+
+        changes = pd.DataFrame()
+        info_changed = False
+        if changed['world'] or day_changed:
+            world, info_changed = timed('world', self.world_changes, day_changed)
+            changes = ingest.add_counts(changes, world)
+        if changed['us']:
+            us, us_info_changed = timed('us', self.us_changes)
+            changes = ingest.add_counts(changes, us)
+            info_changed |= us_info_changed
+        if info_changed:
+            timed('location_info', self.write_location_info)
+        changes = trim(changes)
+
+        written = 0
+        if self.slices.new is None or not changes.empty or info_changed:
+            written, update_timings = self.update(changes, info_changed)
+            timings.update(update_timings)
+        self.world_day = today
+
+        # Sources only count as processed once everything went through, so
+        # that a failed refresh is retried.
+        for source in self.sources.values():
+            source.commit()
+
+        with self.lock:
+            self.stats['refreshes'] += 1
+            self.stats['last_refresh'] = time.time()
+            self.stats['status'] = 'ok'
+            self.stats['last_error'] = None
+            self.stats['timings'] = timings
+            if written:
+                self.stats['last_change'] = time.time()
+                self.stats['slices_written'] += written
+                self.stats['dates'] = len(self.slices.new.index)
+                self.stats['locations'] = len(self.slices.new.columns)
+        return bool(written)
+
+    def run(self, interval):
+        '''
+        Refreshes every 'interval' seconds, until interrupted.
+        '''
+        while True:
+            t0 = time.time()
+            try:
+                if self.refresh():
+                    self.log('Updated ' + str(self.stats['slices_written']) +
+                             ' slices so far, ' + json.dumps(self.stats['timings']))
+            except Exception as e:
+                print('Refresh failed: ' + repr(e))
+                with self.lock:
+                    self.stats['status'] = 'error'
+                    self.stats['last_error'] = repr(e)
+            time.sleep(max(0, interval - (time.time() - t0)))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def make_handler(daemon):
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            stats = daemon.snapshot()
+            if self.path == '/health':
+                code = 200 if stats['status'] == 'ok' else 503
+                body = {'status': stats['status'],
+                        'last_refresh': stats['last_refresh']}
+            elif self.path == '/stats':
+                code, body = 200, stats
+            else:
+                code, body = 404, {'error': 'not found'}
+            content = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+    return StatsHandler
+
+def serve_stats(daemon, port):
+    '''
+    Serves stats on localhost from a background thread, and returns the
+    server.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(daemon))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if not os.path.exists(args.work_dir):
+        os.makedirs(args.work_dir)
+
+    zoom_levels = args.zoom_levels
+    if zoom_levels is not None and len(zoom_levels) == 0:
+        zoom_levels = spatial_index.DEFAULT_ZOOM_LEVELS
+
+    tile_zoom_levels = args.vector_tiles
+    if tile_zoom_levels is not None and len(tile_zoom_levels) == 0:
+        tile_zoom_levels = spatial_index.DEFAULT_ZOOM_LEVELS
+
+    daemon = Daemon(args.out_dir, args.work_dir, args.latest, args.input_jhu,
+                    quiet=args.quiet, zoom_levels=zoom_levels,
+                    latest_counts_file=args.counts, periods=args.resample,
+                    snap_distance=args.snap, tile_zoom_levels=tile_zoom_levels,
+                    tiles_period=args.tiles_period)
+    server = serve_stats(daemon, args.port)
+    if not args.quiet:
+        print('Serving stats on http://127.0.0.1:' + str(args.port) + '/stats')
+    try:
+        daemon.run(args.interval)
+    except KeyboardInterrupt:
+        print('Shutting down...')
+        server.shutdown()
+        sys.exit(0)
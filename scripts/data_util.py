@@ -1,5 +1,9 @@
+import datetime
 import glob
+import gzip
+import json
 import os
+import shutil
 import sys
 
 sys.path.append("scripts")
@@ -9,16 +13,91 @@ import split
 # The directory where JSON files for daily data are expected to be.
 DAILIES_DIR = "app/dailies"
 
+# Overall number of cases and date, as shown on the page.
+LATEST_COUNTS_FILE = "latestCounts.json"
+
+# Per-country totals for the list of locations, generated from JHU data.
+COUNTRY_TOTALS_FILE = "countryTotals.json"
+
+# Where intermediate results of the data pipeline are kept between runs.
+PIPELINE_STATE_DIR = ".pipeline"
+
 self_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
 
-# Returns whether we were able to get the necessary data
-def retrieve_generable_data(out_dir, should_overwrite=False, quiet=False):
+# Writes a gzip-compressed copy of the given file next to it, so that it can
+# be served as is.
+def precompress(path):
+    with open(path, "rb") as f_in:
+        # A fixed modification time keeps the output stable for the same input.
+        with gzip.GzipFile(path + ".gz", "wb", compresslevel=9, mtime=0) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+
+# Returns whether we were able to write the per-country totals, in the format
+# of the ArcGIS feature service the client used to query.
+def write_country_totals(out_path, quiet=False):
+    import jhu_global_data
+
+    if not quiet:
+        print("Getting per-country totals...")
+    # The latest daily report might not be published yet.
+    for days_ago in range(1, 4):
+        date = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+        if jhu_global_data.write_snapshot(date, out_path, format_counts=False):
+            precompress(out_path)
+            return True
+    print("I wasn't able to get per-country totals")
+    return False
+
+
+# Writes the total count from the latest daily slice, for when we already
+# have daily data that we don't need to re-generate. Returns whether that
+# slice was available.
+def write_latest_counts_from_dailies(out_path):
+    latest_path = os.path.join(self_dir, DAILIES_DIR, "latest.json")
+    if not os.path.exists(latest_path):
+        return False
+    with open(latest_path) as f:
+        latest = json.load(f)
+        f.close()
+    # Each location's total is carried over in every slice after its first
+    # case, so the latest slice has them all.
+    count = sum([feature["properties"]["total"] for feature in latest["features"]])
+    with open(out_path, "w") as f:
+        json.dump([{"caseCount": "{:,}".format(count), "date": latest["date"]}], f)
+        f.close()
+    return True
+
+
+# Compares the total count we generated with the one in the published sheet,
+# and returns whether they match.
+def cross_check_total_count(counts_path, quiet=False):
     import scrape_total_count
 
+    with open(counts_path) as f:
+        ours = json.load(f)[0]["caseCount"]
+        f.close()
+    theirs = scrape_total_count.fetch_total_count()
+    if theirs is None or theirs.strip() != ours:
+        print("Warning: our total count (" + ours + ") doesn't match the "
+              "published one (" + str(theirs) + ")")
+        return False
+    if not quiet:
+        print("Our total count matches the published one.")
+    return True
+
+
+# Returns whether we were able to get the necessary data
+def retrieve_generable_data(out_dir, should_overwrite=False, quiet=False):
     success = True
-    out_path = os.path.join(out_dir, "latestCounts.json")
+    # The total count is normally written along with the daily slices.
+    out_path = os.path.join(out_dir, LATEST_COUNTS_FILE)
+    if not os.path.exists(out_path):
+        write_latest_counts_from_dailies(out_path)
+
+    out_path = os.path.join(out_dir, COUNTRY_TOTALS_FILE)
     if not os.path.exists(out_path) or should_overwrite:
-        success &= scrape_total_count.scrape_total_count(out_path)
+        success &= write_country_totals(out_path, quiet=quiet)
 
     return success
 
@@ -70,5 +149,7 @@ def generate_data(overwrite=False, quiet=False):
             "take a few minutes..."
         )
     generate_full_data.generate_data(
-        os.path.join(self_dir, DAILIES_DIR), overwrite=overwrite, quiet=quiet
+        os.path.join(self_dir, DAILIES_DIR), overwrite=overwrite, quiet=quiet,
+        latest_counts_file=os.path.join(self_dir, "app", LATEST_COUNTS_FILE),
+        state_dir=os.path.join(self_dir, PIPELINE_STATE_DIR)
     )
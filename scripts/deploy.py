@@ -3,11 +3,14 @@ Makes it easy and painless to deploy the site and make all necessary changes
 so that it's immediately ready to serve in production.
 """
 import datetime
+import multiprocessing
 import os
 import shlex
 import subprocess
 import sys
 
+import build_cache
+import check_dailies
 import data_util
 import js_compilation
 
@@ -24,12 +27,19 @@ EXCLUDED = [
     "js/externs_d3.js",
     "js/externs_mapbox.js",
     "js/healthmap.js",
+    "location_info.data.idx",
     "prerequisites.md",
     "run",
 ]
 
 BACKUP_DIR_PREFIX = "backup_"
 
+# Where outputs of JS compilation and Sass are kept, to skip building them
+# again when their sources didn't change.
+BUILD_CACHE_DIR = os.path.join(data_util.PIPELINE_STATE_DIR, "build")
+
+SASS_COMMAND = ["sass", "app/css/styles.scss", "app/css/styles.css"]
+
 # Returns True if everything we need is here, False otherwise.
 def check_dependencies():
     try:
@@ -79,10 +89,32 @@ def insert_analytics_code(quiet=False):
         f.close()
 
 
-def use_compiled_js(quiet=False):
-    js_compilation.compile_js(quiet)
+# Starts compiling JS and CSS in the background (unless the sources didn't
+# change), and returns the builds to wait for.
+def start_builds(quiet=False):
+    builds = [
+        build_cache.CachedBuild(
+            "css", SASS_COMMAND, inputs=["app/css/*.scss"],
+            outputs=["app/css/styles.css", "app/css/styles.css.map"],
+            cache_dir=BUILD_CACHE_DIR, quiet=quiet),
+        build_cache.CachedBuild(
+            "js", js_compilation.COMMAND, inputs=js_compilation.INPUTS,
+            outputs=[js_compilation.OUTPUT],
+            cache_dir=BUILD_CACHE_DIR, quiet=quiet),
+    ]
+    for build in builds:
+        build.start()
+    return builds
+
+
+def wait_for_builds(builds):
+    for build in builds:
+        if not build.wait():
+            print("Warning: I wasn't able to build '" + build.name + "'")
+
 
-    # Now link to the compiled code in the HTML file
+def use_compiled_js(quiet=False):
+    # Link to the compiled code in the HTML file
     main_page = ""
     scripting_time = False
     with open("app/index.html") as f:
@@ -139,12 +171,19 @@ def copy_contents(target_path, quiet=False):
     os.system(cmd)
 
 
-def deploy(target_path, quiet=False):
+# With 'cross_check', the total count we generated must also match the
+# published one.
+def deploy(target_path, quiet=False, cross_check=False):
     if not check_dependencies():
         sys.exit(1)
     backup_pristine_files()
-    data_util.prepare_for_deployment(quiet=quiet)
-    os.system("sass app/css/styles.scss app/css/styles.css")
+    # Compilation doesn't depend on the data, so it runs while we generate
+    # it.
+    builds = start_builds(quiet=quiet)
+    try:
+        data_util.prepare_for_deployment(quiet=quiet)
+    finally:
+        wait_for_builds(builds)
 
     use_compiled_js(quiet=quiet)
 
@@ -154,6 +193,19 @@ def deploy(target_path, quiet=False):
     else:
         insert_analytics_code(quiet=quiet)
 
+    if not check_dailies.check_dailies(data_util.DAILIES_DIR,
+            location_info_file="app/location_info.data", quiet=quiet,
+            processes=multiprocessing.cpu_count()):
+        restore_pristine_files()
+        print("The generated daily slices don't look right, bailing out.")
+        sys.exit(1)
+
+    if cross_check and not data_util.cross_check_total_count(
+            os.path.join("app", data_util.LATEST_COUNTS_FILE), quiet=quiet):
+        restore_pristine_files()
+        print("The generated total count doesn't look right, bailing out.")
+        sys.exit(1)
+
     if not backup_current_version(target_path, quiet=quiet):
         print("I could not back up the current version, bailing out.")
         sys.exit(1)
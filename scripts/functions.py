@@ -1,18 +1,33 @@
 import configparser
 import itertools
 import json
-import multiprocessing
+import location_index
+import numpy as np
 import os.path
 import pandas as pd
 import pickle
 import re
 import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from shutil import copyfile
 
 LAT_LNG_DECIMAL_PLACES = 4
 
+# Columns with geographical names. They have few distinct values compared to
+# the number of rows, and are kept as categories.
+LOCATION_COLUMNS = ['city', 'province', 'country']
+
+# Columns we read from each sheet, in A1 notation.
+SHEET_RANGE = 'A:V'
+
+# A date as curators enter it (%d.%m.%Y).
+DATE_RE = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+# The second part of a 'date - date' range, or the whole value otherwise.
+DATE_RANGE_END_RE = re.compile(r'^(?:[^-]*-)?([^-]*)')
+
 class GoogleSheet(object):
     '''
     Simple object to help organizing.
@@ -75,8 +90,7 @@ def savedata(data: list, outfile: str) -> None:
 
 
 
-def load_sheet(Sheet: GoogleSheet, config: configparser.ConfigParser) -> pd.DataFrame:
-    from googleapiclient.discovery import build
+def get_credentials(config: configparser.ConfigParser):
     from google_auth_oauthlib.flow import InstalledAppFlow
     from google.auth.transport.requests import Request
 
@@ -85,8 +99,6 @@ def load_sheet(Sheet: GoogleSheet, config: configparser.ConfigParser) -> pd.Data
     creds       = None
     token       = config['SHEETS'].get('TOKEN', './token.pickle')
     credentials = config['SHEETS'].get('CREDENTIALS', './credentials.json')
-    spreadsheetid = Sheet.spreadsheetid
-    data_range    = f'{Sheet.name}!A:V'
 
     if os.path.exists(token):
         with open(token, 'rb') as t:
@@ -105,82 +117,196 @@ def load_sheet(Sheet: GoogleSheet, config: configparser.ConfigParser) -> pd.Data
         with open(token, 'wb') as t:
             pickle.dump(creds, t)
 
+    return creds
+
+def build_sheets_service(config: configparser.ConfigParser):
+    '''
+    Returns a Sheets API service, and a function that creates a separate
+    authorized HTTP transport for each thread that uses it (the default one
+    isn't thread-safe).
+    '''
+    from googleapiclient.discovery import build
+    import google_auth_httplib2
+    import httplib2
+
+    creds = get_credentials(config)
     service = build('sheets', 'v4', credentials=creds)
+    return service, lambda: google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+
+def sheet_ranges(Sheet: GoogleSheet) -> list:
+    names = Sheet.name if isinstance(Sheet.name, list) else [Sheet.name]
+    return [f'{name}!{SHEET_RANGE}' for name in names]
+
+def load_sheet(Sheet: GoogleSheet, config: configparser.ConfigParser,
+               dropped: dict = None) -> pd.DataFrame:
+    service, _ = build_sheets_service(config)
 
     # Call the Sheets API
     sheet   = service.spreadsheets()
-    values  = sheet.values().get(spreadsheetId=spreadsheetid, range=data_range).execute().get('values', [])
-
-    if not values:
-        raise ValueError('Sheet data not found')
+    values  = sheet.values().get(spreadsheetId=Sheet.spreadsheetid, range=sheet_ranges(Sheet)[0]).execute().get('values', [])
 
-    else:
-        # Have to loop through values because they don't necessarily match the the column number.
-        columns = values[0]
-        data    = values[1:]
+    return values_to_dataframe(values, dropped)
 
-        n    = len(columns)
-        ilat = columns.index('latitude')
-        ilon = columns.index('longitude')
-        idate = columns.index('date_confirmation')
+def load_sheets(sheets: list, config: configparser.ConfigParser, service=None,
+                http_factory=None, max_workers: int = 8,
+                dropped: dict = None) -> pd.DataFrame:
+    '''
+    Loads all the given sheets and returns their rows in a single DataFrame.
+    Ranges from the same spreadsheet are fetched with one batchGet request,
+    and spreadsheets are fetched concurrently. The API service is only built
+    once (pass 'service' to use another one, e.g. for testing).
+    '''
+    if service is None:
+        service, http_factory = build_sheets_service(config)
+
+    # Group ranges by spreadsheet, keeping the order of the sheets.
+    ranges = {}
+    for Sheet in sheets:
+        ranges.setdefault(Sheet.spreadsheetid, []).extend(sheet_ranges(Sheet))
+
+    local = threading.local()
+    def fetch(spreadsheetid):
+        request = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheetid, ranges=ranges[spreadsheetid])
+        if http_factory is None:
+            response = request.execute()
+        else:
+            if not hasattr(local, 'http'):
+                local.http = http_factory()
+            response = request.execute(http=local.http)
+        return [r.get('values', []) for r in response.get('valueRanges', [])]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fetch, list(ranges)))
+
+    frames = []
+    for spreadsheetid, all_values in zip(ranges, results):
+        for data_range, values in zip(ranges[spreadsheetid], all_values):
+            if not values:
+                raise ValueError('Sheet data not found: ' + data_range)
+            frames.append(values_to_dataframe(values, dropped))
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+def parses_as_float(value) -> bool:
+    try:
+        float(value)
+        return True
+    except Exception:
+        return False
+
+def parses_as_date(value) -> bool:
+    try:
+        pd.to_datetime(value, format='%d.%m.%Y', exact=True)
+        return True
+    except Exception:
+        return False
+
+def recheck_failures(values: pd.Series, valid: pd.Series, check) -> pd.Series:
+    '''
+    Runs a scalar 'check' on the distinct values a vectorized parser rejected.
+    Vectorized parsers return NaN/NaT both on errors and on values like 'nan',
+    which the scalar parsers accept, so this keeps the original semantics.
+    '''
+    failed = values[~valid]
+    if len(failed):
+        valid = valid.copy()
+        valid[~valid] = failed.map({v: check(v) for v in failed.unique()})
+    return valid.astype(bool)
 
+def values_to_dataframe(values: list, dropped: dict = None) -> pd.DataFrame:
+    '''
+    Turns the raw values from a sheet (header row first) into a DataFrame,
+    keeping only rows with valid coordinates and confirmation dates.
+    Rows come back ragged from the API: trailing empty cells are left out.
+    Counts of dropped rows are added to 'dropped' (when given), by reason:
+    'length', 'coordinates', 'empty date' and 'date'.
+    '''
+    if not values:
+        raise ValueError('Sheet data not found')
 
-        keep = []
-        for _ in data:
-            d = _.copy() # might change the value.
+    columns = list(values[0])
+    rows    = values[1:]
+
+    n    = len(columns)
+    ilat = columns.index('latitude')
+    ilon = columns.index('longitude')
+    idate = columns.index('date_confirmation')
+
+    # Rows longer than the header can't be matched to columns, shorter ones
+    # get padded with empty strings.
+    lengths = pd.Series([len(r) for r in rows], dtype=int)
+    too_long = (lengths > n).values
+    df = pd.DataFrame([r for r, l in zip(rows, too_long) if not l])
+    df = df.reindex(columns=range(n)).fillna('').astype(object)
+    counts = {'length': int(too_long.sum())}
+
+    # float() accepts the coordinates.
+    valid = pd.Series(True, index=df.index)
+    for i in [ilat, ilon]:
+        parsed = pd.to_numeric(df[i], errors='coerce').notna()
+        valid &= recheck_failures(df[i], parsed, parses_as_float)
+    counts['coordinates'] = int((~valid).sum())
+    df = df[valid]
+
+    # Empty dates are skipped, for ranges the end of the range is used.
+    empty = df[idate] == ''
+    counts['empty date'] = int(empty.sum())
+    df = df[~empty]
+    dates = df[idate].str.rsplit('-', n=1).str[-1]
+    parsed = pd.to_datetime(dates, format='%d.%m.%Y', exact=True, errors='coerce').notna()
+    valid = recheck_failures(dates, parsed, parses_as_date)
+    counts['date'] = int((~valid).sum())
+    df = df[valid]
+
+    if dropped is not None:
+        for reason, count in counts.items():
+            dropped[reason] = dropped.get(reason, 0) + count
+
+    for x, y in enumerate(columns):
+        if y.strip() == '' and columns[x-1] == 'province':
+            columns[x] = 'country'
+    df.columns = columns
+    return df.reset_index(drop=True)
+
+def map_uniques(column: pd.Series, func) -> pd.Series:
+    '''
+    Applies a vectorized function to the distinct values of a column only,
+    and maps the results back onto the column. Sheet columns repeat the same
+    few values over and over, so this is a lot cheaper than processing every
+    row. Missing values stay missing.
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Categories are the distinct values already, just look results up
+        # by code (-1, i.e. missing, has no result).
+        results = pd.Series(np.asarray(func(pd.Series(column.cat.categories,
+            dtype=object)), dtype=object))
+        return pd.Series(results.reindex(column.cat.codes.values).values,
+                         index=column.index)
+    uniques = pd.Series(column.dropna().unique(), dtype=object)
+    return column.map(dict(zip(uniques, func(uniques))))
+
+def clean_strings(values: pd.Series) -> pd.Series:
+    '''
+    Strips, title-cases and fixes non-breaking spaces in names.
+    '''
+    return values.str.strip().str.title().str.replace('\xa0', ' ', regex=False) # encoding for a space that was found in some entries.
 
-            # Flags to write to log accurately.
-            length_error = False
-            lat_error    = False
-            date_error   = False
-            try:
+def is_date_confirmation(values: pd.Series) -> pd.Series:
+    '''
+    Whether values hold a %d.%m.%Y date (the end date, for ranges).
+    '''
+    range_end = values.str.extract(DATE_RANGE_END_RE, expand=False)
+    return range_end.str.contains(DATE_RE).fillna(False).astype(bool)
 
-                # Length Errors
-                # Trailing empty cells return a different length than otherwise
-                length_error = True
-                if len(d) < n :
-                    # extend with empty strings
-                    nstrings = n - len(d)
-                    d.extend(['']*nstrings)
-                assert len(d) == n
-                length_error = False
-
-                # Lat/Long errors
-                lat_error = True
-                _ = float(d[ilat])
-                _ = float(d[ilon])
-                lat_error = False
-
-                # Dates
-                date_error = True
-                date = d[idate]
-                if date == '':
-                    continue
-                elif '-' in d[idate]:
-                    date = d[idate].split('-')[-1]
-                else:
-                    date = d[idate]
-                _ = pd.to_datetime(date, format='%d.%m.%Y', exact=True)
-                date_error = False
-
-                keep.append(d)
-
-            except Exception as Err:
-                if True in [length_error, lat_error, date_error]:
-                    continue
-                else:
-                    raise Err
-        for x, y in enumerate(columns):
-            if y.strip() == '' and columns[x-1] == 'province':
-                columns[x] = 'country'
-        return pd.DataFrame(data=keep, columns=columns)
+def is_coordinate(values: pd.Series) -> pd.Series:
+    return pd.to_numeric(values, errors='coerce').notna()
 
 def clean_data(data: pd.DataFrame, colnames: list) -> pd.DataFrame:
     '''
     Basic cleaning and filtering on dataframe.
     Most of this gets done either by curators or pipeline now, this filters out for :
-    - valid lat/longs
-    - valid dates (using %d.%m.%Y format)
+    - valid lat/longs (numeric)
+    - valid dates (using %d.%m.%Y format, for ranges the end of the range)
     - manage white space
     - Keeps only columns that are going to be in final version.
 
@@ -188,34 +314,30 @@ def clean_data(data: pd.DataFrame, colnames: list) -> pd.DataFrame:
     :data: pd.DataFrame, data from sheet
     :colnames: list, list of columns we are keeping for final version
     '''
-    df = data.copy()
-    df.rename({x: x.strip() for x in df.columns}, inplace=True, axis=1)
+    # Column names sometimes come with extra white space.
+    source = {x.strip(): x for x in data.columns}
 
     # drop invalid lat/longs
-    lat,lon     = df.latitude, df.longitude
-    invalid_lat = lat.str.contains('#REF') | lat.str.contains('N/A') | lat.isnull() | (lat == '')
-    invalid_lon = lon.str.contains('#REF') | lon.str.contains('N/A') | lon.isnull() | (lon == '')
-    invalid     = invalid_lat | invalid_lon
-    df = df[~invalid] # NOT invalid
+    valid = (map_uniques(data[source['latitude']], is_coordinate).fillna(False) &
+             map_uniques(data[source['longitude']], is_coordinate).fillna(False))
 
     # Only keep those that have a date_confirmation
-    df['date_confirmation'] = df['date_confirmation'].str.strip() # some have empty spaces
-    dc = df.date_confirmation
-    dc = dc.fillna('')
-    dc = dc.apply(lambda x: x.split('-')[1].strip() if '-'  in x else x.strip())
-    valid_date = (dc != '') & ~(dc.isnull()) & dc.str.match('.*\d{2}\.\d{2}\.\d{4}.*')
-    df = df[valid_date]
-    df['date_confirmation'] = df['date_confirmation'].str.strip()
-
-    # Basic cleaning for strings
-    for c in ['city', 'province', 'country']:
-        df[c] = df[c].str.strip()
-        df[c] = df[c].str.title()
-        df[c] = df[c].str.replace('\xa0', ' ') # encoding for a space that was found in some entries.
-
-
-    # Only keep the columns we want
-    df = df[colnames]
+    dates = map_uniques(data[source['date_confirmation']], lambda x: x.str.strip()) # some have empty spaces
+    valid &= map_uniques(dates, is_date_confirmation).fillna(False)
+
+    # Only keep the rows and columns we want. Rows are picked by position,
+    # sheets that were concatenated can repeat index labels.
+    keep = valid.values.astype(bool)
+    df = data.loc[keep, [source[c] for c in colnames]]
+    df.columns = colnames
+    if 'date_confirmation' in df:
+        df['date_confirmation'] = dates.values[keep]
+
+    # Basic cleaning for strings. Location names repeat a lot, so keep them
+    # as categories from now on.
+    for c in LOCATION_COLUMNS:
+        if c in df:
+            df[c] = map_uniques(df[c], clean_strings).astype('category')
 
     return df
 
@@ -228,7 +350,7 @@ def reduceToUnique(data: pd.DataFrame) -> list:
     Does some situatinal name changing for consistency, but this should be done on Curator's side.
     '''
     df = data.copy()
-    groups = df.groupby(['latitude', 'longitude'])
+    groups = df.groupby(['latitude', 'longitude'], observed=True)
 
 
     results = []
@@ -305,72 +427,51 @@ def reduceToUnique(data: pd.DataFrame) -> list:
 
     return results
 
-def animation_formating(infile):
+# Pins for the legacy animation, by number of cases: fewer than 10, fewer than
+# 25, fewer than 50, and more.
+PIN_THRESHOLDS = [10, 25, 50]
+PINS = np.array(['pin4.svg', 'pin3.svg', 'pin2.svg', 'pin1.svg'])
+
+def iter_animation_blocks(data: pd.DataFrame):
     '''
-    Read from "full-data" and convert to something usable for the animation.
+    Yields one {date: [entries]} block per date, in chronological order, with
+    the cumulative count and pin for every location that has new cases that
+    day.
     '''
-
-    with open(infile, 'r') as F:
-        data = json.load(F)
-
-    data = data['data']
-    data = pd.DataFrame(data)
     data = data[['latitude', 'longitude', 'date_confirmation']]
 
     # drop #REF! in case they are propagated here :
-    data = data[data.latitude != '#REF!']
-    data = data[data.longitude != '#REF!']
-    data = data[data.date_confirmation != '#REF!']
+    data = data[(data.latitude != '#REF!') & (data.longitude != '#REF!') &
+                (data.date_confirmation != '#REF!')]
+    data = data.dropna()
 
-    data['date']  = pd.to_datetime(data.date_confirmation, errors='coerce', format='%d.%m.%Y')
-    data['coord'] = data.apply(lambda s: str('{}|{}'.format(s['latitude'], s['longitude'])), axis=1)
-#    data.drop(['date_confirmation', 'latitude', 'longitude'], inplace=True, axis=1)
-    data.dropna(inplace=True)
+    dates = pd.to_datetime(data.date_confirmation, errors='coerce', format='%d.%m.%Y')
+    coords = data.latitude.astype(str) + '|' + data.longitude.astype(str)
+    data = pd.DataFrame({'date': dates, 'coord': coords}).dropna()
 
     # Sort so that results are in order (might be important for animation)
-    data.sort_values(by='date', inplace=True)
+    data = data.sort_values(by='date', kind='mergesort')
+
+    # Count by date and location, then accumulate over dates for each location.
+    counts = data.groupby(['date', 'coord'], sort=False).size().reset_index(name='new')
+    counts['caseCount'] = counts.groupby('coord', sort=False).new.cumsum()
+    counts['pin'] = PINS[np.searchsorted(PIN_THRESHOLDS, counts.caseCount.values, side='right')]
+    latlong = counts.coord.str.split('|', n=1, expand=True)
+    counts['latitude'] = latlong[0]
+    counts['longitude'] = latlong[1]
+
+    for date, block in counts.groupby('date', sort=True):
+        yield {date.strftime('%Y-%m-%d'): [
+            {'caseCount': int(c), 'latitude': lat, 'longitude': lon, 'pin': pin}
+            for c, lat, lon, pin in zip(block.caseCount, block.latitude,
+                                        block.longitude, block.pin)]}
 
-    sums    = {} # To store cumulative sums at each location
-    results = {}
-
-    # Loop through dates and coordinates and count
-    for date in data.date.unique():
-        datestr = pd.to_datetime(date).strftime('%Y-%m-%d') # unique coverts to np.datetime64, which doesn't have strftime.
-
-        if datestr not in results.keys():
-            results[datestr] = []
-
-        subset = data[data.date == date]
-        for coord in subset.coord.unique():
-            N_cases = len(subset[subset.coord == coord])
-
-            if coord not in sums.keys():
-                sums[coord] = N_cases
-            else:
-                sums[coord] += N_cases
-
-
-            lat, long = coord.split('|')
-            results[datestr].append({'caseCount': sums[coord],
-                                     'latitude': lat,
-                                     'longitude': long})
-
-            if sums[coord] < 10:
-                pin = 'pin4.svg'
-            elif sums[coord] >= 10 and sums[coord] < 25:
-                pin = 'pin3.svg'
-            elif sums[coord] >= 25 and sums[coord] < 50:
-                pin = 'pin2.svg'
-            else:
-                pin = 'pin1.svg'
-
-            results[datestr][-1]['pin'] = pin
-
-    # Reformatting data to fit with animation script :
-    dates = results.keys()
-    array = [{d: results[d]} for d in dates]
-
-    return array
+def animation_formating(infile):
+    '''
+    Read from "full-data" and convert to something usable for the animation.
+    '''
+    data = pd.DataFrame(list(iter_json_array(infile, 'data')))
+    return list(iter_animation_blocks(data))
 
 
 def latlong_to_geo_id(lat, lng):
@@ -379,6 +480,19 @@ def latlong_to_geo_id(lat, lng):
   '''
   return "|".join([str(round(float(a), LAT_LNG_DECIMAL_PLACES)) for a in [lat, lng]])
 
+def latlong_to_geo_ids(lat: pd.Series, lng: pd.Series) -> pd.Series:
+  '''
+  Vectorized version of latlong_to_geo_id, returning a categorical Series.
+  Each distinct pair of coordinates is only converted once.
+  '''
+  pairs = pd.DataFrame({'lat': np.asarray(lat, dtype=object),
+                        'lng': np.asarray(lng, dtype=object)})
+  groups = pairs.groupby(['lat', 'lng'], sort=False, dropna=False)
+  codes = groups.ngroup().values
+  geo_ids = np.array([latlong_to_geo_id(a, b) for a, b in groups.size().index],
+                     dtype=object)
+  return pd.Series(pd.Categorical(geo_ids[codes]), index=lat.index)
+
 def find_country_iso_code_from_name(name, dict):
   if name == "nan":
     return ""
@@ -424,158 +538,252 @@ def compile_location_info(in_data, out_file,
     with open(out_file, "w") as f:
         f.write("\n".join(output))
         f.close()
+    location_index.build_index(out_file)
+
+    return location_info
 
-def chunks(all_features):
+def read_location_info(in_file):
     '''
-    Yields successive equal-sized chunks from the input list.
+    Returns a dictionary from geoid to [city, province, country code] for the
+    given location info file.
     '''
-    # TODO: Do proper parallelization while keeping accurate total counts.
-    CHUNK_SIZE = len(all_features)
-    for i in range(0, len(all_features), CHUNK_SIZE):
-        yield all_features[i:i + CHUNK_SIZE]
+    location_info = {}
+    with open(in_file) as f:
+        for line in f:
+            line = line.strip()
+            if ":" not in line:
+                continue
+            geo_id, location = line.split(":", 1)
+            location_info[geo_id] = location.split(",", 2)
+        f.close()
+    return location_info
 
-def animation_formating_geo(infile: str, outfile: str, groupby: str = 'day', quiet=False) -> None:
+def concatenate_location_info(in_files, out_file, remove_inputs=False):
     '''
-    Read from full data file, and reformat for animation.
-    Currently grouping on a weekly basis, but subject to change as
-    new cases come in (produces large files).
+    Joins several location info files into one, and indexes the result.
     '''
-    if not quiet:
-        print("Reading file...")
-    with open(infile, 'r') as f:
-        in_data = json.load(f)
+    parts = []
+    for in_file in in_files:
+        with open(in_file) as f:
+            content = f.read().strip()
+            f.close()
+        if content:
+            parts.append(content)
+    with open(out_file, "w") as f:
+        f.write("\n".join(parts))
         f.close()
+    location_index.build_index(out_file)
 
-    n_cpus = multiprocessing.cpu_count()
-    all_features = in_data["data"]
-    if not quiet:
-        print("Processing " + str(len(all_features)) + " features "
-              "with " + str(n_cpus) + " threads...")
-    pool = multiprocessing.Pool(n_cpus)
-    out_slices = pool.map(animation_formatting_geo_in_memory, chunks(all_features))
-    # Concatenate everybody.
-    out_data = list(itertools.chain.from_iterable(out_slices))
-
-    # Wrap in feature collection and write to disk
-    if not quiet:
-        print("Writing result...")
-    with open(outfile, 'w') as F:
-        json.dump({"type": "FeatureCollection", "features": out_data}, F)
-
-def animation_formatting_geo_in_memory(in_data: str, groupby: str = 'day') -> None:
-    # Give the caller an idea of the progress we're making.
-    print(".", end="", flush=True)
-    full = pd.DataFrame(in_data)
-
-    full.fillna('', inplace=True)
-    full['geoid']  = full.apply(
-        lambda s: latlong_to_geo_id(s['latitude'], s['longitude']), axis=1)
-    full['date_confirmation'] = full.date_confirmation.apply(lambda x: x.split('-')[0].strip())
-
-    full['date']   = pd.to_datetime(full['date_confirmation'], format="%d.%m.%Y")  # to ensure sorting is done by date value (not str)
-
-    if groupby == 'week':
-        full['date'] = full.date.apply(lambda x : x - timedelta(days=x.weekday()))
-        freq = 'W-MON'
-    else:
-        freq = 'D'
-
-    dmin   = full.date.min()
-    dmax   = full.date.max()
-    drange = pd.date_range(dmin, dmax, freq=freq)
-
-    geoids  = full.geoid.unique()
-    counts  = full.groupby(['date', 'geoid']).count()[['ID']]
-
-    timeline      = []
-    has_entry     = []
-    latest_counts = {geoid: 0 for geoid in geoids}
-
-    # Loop over dates to get counts
-    for d in drange:
-        if d in counts.index:
-            new_cases  = counts.loc[d]
+    if remove_inputs:
+        for in_file in in_files:
+            for path in [in_file, location_index.index_path_for(in_file)]:
+                if os.path.exists(path):
+                    os.remove(path)
 
-        else:
-            continue
+class _JSONStream(object):
+    '''
+    Buffered reader that decodes one JSON value at a time from a file.
+    '''
 
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        more = self.f.read(self.chunk_size)
+        self.eof = not more
+        self.buffer = self.buffer[self.pos:] + more
+        self.pos = 0
+
+    def peek(self):
+        '''
+        Returns the next non-whitespace character, or '' at the end.
+        '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '" + char + "' in JSON stream, found '" +
+                             self.peek() + "'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer might be cut short.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def iter_json_array(infile: str, key: str, chunk_size: int = 1 << 16):
+    '''
+    Yields the items of the array stored under 'key' in the top-level object
+    of a JSON file, without loading the whole file in memory.
+    '''
+    with open(infile, 'r') as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect('{')
+        while stream.peek() not in ['}', '']:
+            name = stream.value()
+            stream.expect(':')
+            if name != key:
+                stream.value()
+            else:
+                stream.expect('[')
+                while stream.peek() != ']':
+                    yield stream.value()
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                stream.expect(']')
+            if stream.peek() == ',':
+                stream.expect(',')
+
+def iter_daily_features(records, groupby: str = 'day'):
+    '''
+    Counts cases by date and location from an iterable of full data records,
+    and yields (date, features) tuples in chronological order, one date at a
+    time. Records can come in any order, so nothing is yielded before the
+    whole input was read: the records aren't kept in memory, but the counts
+    of every (date, location) pair are.
+    Locations are repeated (with zero new cases) on every date after their
+    first case, so that they don't disappear in the animation.
+    '''
+    geo_ids = {}  # (lat, long) -> geoid
+    dates = {}    # date_confirmation -> date
+    counts = {}   # date -> {geoid: new cases}
+    geoids = {}   # all geoids, in order of first appearance
+    for record in records:
+        lat = record.get('latitude')
+        lon = record.get('longitude')
+        if (lat, lon) not in geo_ids:
+            geo_ids[(lat, lon)] = latlong_to_geo_id(
+                '' if lat is None else lat, '' if lon is None else lon)
+        geoid = geo_ids[(lat, lon)]
+        geoids[geoid] = True
+
+        date_confirmation = record.get('date_confirmation') or ''
+        if date_confirmation not in dates:
+            date = datetime.strptime(
+                date_confirmation.split('-')[0].strip(), '%d.%m.%Y')
+            if groupby == 'week':
+                date -= timedelta(days=date.weekday())
+            dates[date_confirmation] = date
+        day_counts = counts.setdefault(dates[date_confirmation], {})
+        day_counts[geoid] = day_counts.get(geoid, 0) + 1
+
+    latest_counts = {}
+    for date in sorted(counts):
+        new_cases = counts.pop(date)
+        datestr = date.strftime('%Y-%m-%d')
+        features = []
         for geoid in geoids:
-            if geoid in new_cases.index:
-                N_new = int(new_cases.loc[geoid]['ID']) # json.dump doesn't support numpy.int64?
-                total = latest_counts[geoid] + N_new
-                latest_counts[geoid] += N_new
-
-            elif geoid in has_entry:
+            if geoid in new_cases:
+                N_new = new_cases[geoid]
+                latest_counts[geoid] = latest_counts.get(geoid, 0) + N_new
+            elif geoid in latest_counts:
                 # repeat location so it doesn't disappear in animation
                 N_new = 0
-                total = latest_counts[geoid]
             else:
                 continue
 
-            if N_new == total == 0:
-                raise Exception('This shouldn\'t be possible')
-
-            lat, lon = geoid.split('|')
-            entry = {
+            features.append({
                     "properties": {
                         "geoid": geoid,
-                        "date": d.strftime('%Y-%m-%d'),
+                        "date": datestr,
                         "new": N_new,
-                        "total": total,
+                        "total": latest_counts[geoid],
                     }
-            }
-
-            timeline.append(entry)
-            if geoid not in has_entry:
-                has_entry.append(geoid)
-
-    assert len(geoids) == len(has_entry), "Grouping failed"
+            })
+        yield datestr, features
 
+def animation_formating_geo(infile: str, outfile: str, groupby: str = 'day', quiet=False) -> None:
+    '''
+    Read from full data file, and reformat for animation.
+    Records are streamed from the input, and features are written out one
+    date at a time.
+    '''
+    if not quiet:
+        print("Processing " + infile + "...")
+    records = iter_json_array(infile, 'data')
+    with open(outfile, 'w') as F:
+        F.write('{"type": "FeatureCollection", "features": [')
+        separator = ''
+        for _, features in iter_daily_features(records, groupby):
+            for feature in features:
+                F.write(separator + json.dumps(feature))
+                separator = ', '
+        F.write(']}')
+
+def animation_formatting_geo_in_memory(in_data: list, groupby: str = 'day') -> list:
+    '''
+    Same as animation_formating_geo, for records that are already in memory.
+    '''
+    timeline = []
+    for _, features in iter_daily_features(in_data, groupby):
+        timeline.extend(features)
     return timeline
 
 
-def convert_to_geojson(infile, outfile):
+# Properties copied over from aggregated records to GeoJSON features, as
+# (feature property, record field).
+GEOJSON_PROPERTIES = [
+    ('age', 'age'),
+    ('sex', 'sex'),
+    ('city', 'city'),
+    ('province', 'province'),
+    ('country', 'country'),
+    ('date', 'date_confirmation'),
+    ('source', 'source'),
+    ('symptoms', 'symptoms'),
+    ('cases', 'cases'),
+    ('geo_resolution', 'geo_resolution'),
+]
+
+def convert_to_geojson(infile, outfile, chunk_size=10000):
     '''
     Convert aggregated file to geojson.
+    Records are read and features written in chunks of 'chunk_size', so
+    memory use doesn't depend on the size of the input. Returns the number
+    of features written.
     '''
-    geojson_format = {'type': 'Feature', 'geometry':
-            {"type": "Point",
-                "coordinates": None},
-            'properties': {'age': 'age', 'city': 'city',
-                'province': 'province',
-                'country': 'country',
-                'date': 'date_confirmation', 'sex': 'sex', 'source': 'source', 'symptoms': 'symptoms'}}
-    geojson_data = []
-
-
-    with open(infile, 'r') as F:
-        data = json.load(F)
-    df = pd.DataFrame(data['data'])
-
-    for i, row in df.iterrows():
-        d = geojson_format.copy()
-        entry = {
-                'type' : 'Feature',
-                'geometry': {
-                    'type': 'Point',
-                    'coordinates': [float(row['longitude']), float(row['latitude'])]
-                    },
-                'properties': {
-                    'age': row['age'],
-                    'sex': row['sex'],
-                    'city': row['city'],
-                    'province': row['province'],
-                    'country': row['country'],
-                    'date': row['date_confirmation'],
-                    'source': row['source'],
-                    'symptoms': row['symptoms'],
-                    'cases': row['cases'],
-                    'geo_resolution': row['geo_resolution']
-                }
-                }
-        geojson_data.append(entry)
-    final = {'type': 'FeatureCollection',
-            'features': geojson_data}
-
+    records = iter_json_array(infile, 'data')
+    written = 0
     with open(outfile, 'w') as F:
-        json.dump(final, F)
+        F.write('{"type": "FeatureCollection", "features": [')
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+
+            # Work on columns rather than on individual records.
+            lon = np.asarray([r['longitude'] for r in chunk], dtype=float).tolist()
+            lat = np.asarray([r['latitude'] for r in chunk], dtype=float).tolist()
+            columns = [(name, [r.get(field) for r in chunk])
+                       for name, field in GEOJSON_PROPERTIES]
+
+            features = []
+            for i in range(len(chunk)):
+                features.append(json.dumps({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lon[i], lat[i]]},
+                    'properties': {name: values[i] for name, values in columns}
+                }))
+            F.write((', ' if written else '') + ', '.join(features))
+            written += len(features)
+        F.write(']}')
+    return written
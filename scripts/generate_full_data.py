@@ -6,15 +6,24 @@ split into daily slices.
 '''
 
 import argparse
+import csv_ranges
+import hashlib
 import json
 import functions
 import os
 import multiprocessing
+import numpy as np
 import pandas as pd
+import pickle
 import re
 import requests
+import shutil
+import spatial_index
 import split
+import stages
 import sys
+import tempfile
+import vector_tiles
 
 from io import StringIO
 
@@ -22,6 +31,40 @@ JHU_URL= 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_
 
 LATEST_DATA_URL = 'https://raw.githubusercontent.com/beoutbreakprepared/nCoV2019/master/latest_data/latestdata.csv'
 
+LOCATION_INFO_FILE = 'app/location_info.data'
+
+# Country names and codes, used to compile location info.
+COUNTRIES_FILE = 'app/countries.data'
+
+# Sub-directory of the dailies directory for per-country and per-province
+# series.
+AGGREGATES_DIR = 'aggregates'
+# Files in there, with the level of location info they sum cases by.
+AGGREGATE_LEVELS = [('provinces', 1), ('countries', 2)]
+
+# Where the pipeline keeps track of completed stages, in its state directory.
+STATE_FILE = 'state.json'
+
+# The date x geoid matrix of new cases (and the latest date), in the state
+# directory, before and after snapping locations together.
+NEW_CASES_FILE = 'new_cases.pickle'
+SNAPPED_CASES_FILE = 'snapped.pickle'
+
+# The slice for the latest date always has the same name. Slices for other
+# dates are named after their date and a digest of their content, so that
+# they can be cached for good, and the manifest maps dates to those names.
+LATEST_SLICE_FILE = 'latest.json'
+MANIFEST_FILE = 'manifest.json'
+DATED_SLICE_PATTERN = re.compile(r'^\d{4}\.\d{2}\.\d{2}(\.[0-9a-f]+)?\.json$')
+
+# Periods that slices can be resampled to, with their pandas frequency
+# (weeks start on Mondays) and the sub-directory of the dailies directory
+# their slices go to.
+RESAMPLING_PERIODS = {
+    'week': ('W-SUN', 'weekly'),
+    'month': ('M', 'monthly'),
+}
+
 
 parser = argparse.ArgumentParser(description='Generate full-data.json file')
 
@@ -45,8 +88,67 @@ parser.add_argument('-t', '--timeit', action='store_const', const=True,
 parser.add_argument('--input_jhu', default='', type=str,
         help='read from local jhu file')
 
+parser.add_argument('-c', '--counts', type=str, default=None,
+        help='path to write the total case count (latestCounts.json) to')
+
+parser.add_argument('-z', '--zoom_levels', type=int, nargs='*',
+        help='also write slices aggregated on map tiles at these zoom levels '
+        '(defaults to ' + ' '.join(map(str, spatial_index.DEFAULT_ZOOM_LEVELS)) +
+        ' when no level is given)')
+
+parser.add_argument('-r', '--resample', type=str, nargs='+',
+        choices=sorted(RESAMPLING_PERIODS),
+        help='also write slices of new cases by week and/or by month, '
+        'named after the first day of each period')
+
+parser.add_argument('--vector_tiles', type=int, nargs='*',
+        help='also write vector tiles of the counts at these zoom levels '
+        '(defaults to ' + ' '.join(map(str, spatial_index.DEFAULT_ZOOM_LEVELS)) +
+        ' when no level is given)')
+
+parser.add_argument('--tiles_period', type=str, default='day',
+        choices=['day'] + sorted(RESAMPLING_PERIODS),
+        help='write vector tiles for each day, week or month')
 
-def prepare_latest_data(infile, quiet=False):
+parser.add_argument('--snap', type=float, default=None, metavar='METERS',
+        help='merge locations at most this far apart that have the same '
+        'city, province and country')
+
+parser.add_argument('-p', '--processes', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of processes to read latestdata.csv with (when not '
+        'ingesting it incrementally, see --state_dir)')
+
+parser.add_argument('-d', '--state_dir', type=str, default=None,
+        help='directory for intermediate results, stages that are up to date '
+        'are skipped when given')
+
+parser.add_argument('-s', '--stage', type=str, nargs='+',
+        help='only run these stages (needs --state_dir)')
+
+parser.add_argument('--status', action='store_true',
+        help='show which stages would run, and why')
+
+parser.add_argument('--force', action='store_true',
+        help='run stages even if they are up to date')
+
+
+def download(url, outfile, quiet=False):
+    if not quiet:
+        print("Downloading " + url + "...")
+    req = requests.get(url)
+    if req.status_code != 200:
+        print('could not get ' + url + ', aborting')
+        sys.exit(1)
+    with open(outfile, 'w') as f:
+        f.write(req.text)
+
+# Columns of latestdata.csv that we use.
+LATEST_DATA_COLUMNS = functions.LOCATION_COLUMNS + ['date_confirmation',
+    'latitude', 'longitude']
+
+def read_latest_data(infile, quiet=False, columns=LATEST_DATA_COLUMNS,
+    dtype=None):
     if infile :
         readfrom = infile
     else:
@@ -59,44 +161,117 @@ def prepare_latest_data(infile, quiet=False):
         readfrom = StringIO(req.text)
 
 
-    df = pd.read_csv(readfrom, usecols=['city', 'province', 'country',
-        'date_confirmation', 'latitude', 'longitude'])
-
-    df['latitude'] = df.latitude.astype(str)
-    df['longitude'] = df.longitude.astype(str)
+    # Every column has few distinct values compared to the number of rows, so
+    # read them all as categories and only work on the distinct values.
+    dtypes = {c: 'category' for c in columns}
+    dtypes.update(dtype or {})
+    return pd.read_csv(readfrom, usecols=columns, dtype=dtypes)
 
-    # filters
+def filter_latest_data(df):
+    '''
+    Keeps the rows from outside the US with valid coordinates and dates (in
+    the future too), with the date extracted and a geoid added.
+    '''
     df = df[~df.country.isin(['United States', 'Virgin Islands, U.S.', 'Puerto Rico'])]
-    df = df[~df.latitude.isnull() | df.longitude.isnull()]
-    df = df[~df.latitude.str.contains('[aA-zZ]', regex=True)]
-    df = df[~df.longitude.str.contains('[aA-zZ]', regex=True)]
-    df['date_confirmation'] = df.date_confirmation.str.extract('(\d{2}\.\d{2}\.\d{4})')
-    df = df[pd.to_datetime(df.date_confirmation,
-        format="%d.%m.%Y", errors='coerce') < pd.datetime.now()]
+    has_letters = lambda x: x.str.contains('[aA-zZ]', regex=True)
+    df = df[~functions.map_uniques(df.latitude, has_letters).fillna(True).astype(bool)]
+    df = df[~functions.map_uniques(df.longitude, has_letters).fillna(True).astype(bool)]
+    df = df.assign(date_confirmation=functions.map_uniques(df.date_confirmation,
+        lambda x: x.str.extract('(\d{2}\.\d{2}\.\d{4})', expand=False)).astype('category'))
+    is_date = lambda x: pd.to_datetime(x, format="%d.%m.%Y", errors='coerce').notna()
+    df = df[functions.map_uniques(df.date_confirmation, is_date).fillna(False).astype(bool)]
+
+    df["geoid"] = functions.latlong_to_geo_ids(df.latitude, df.longitude)
+    return df
 
-    df["geoid"] = df.apply(lambda row: functions.latlong_to_geo_id(
-        row.latitude, row.longitude), axis=1)
+def in_the_past(dates):
+    '''
+    Returns whether each of the given %d.%m.%Y dates is in the past.
+    '''
+    past = lambda x: pd.to_datetime(x, format="%d.%m.%Y",
+        errors='coerce') < pd.Timestamp.now()
+    return functions.map_uniques(dates, past).fillna(False).astype(bool)
+
+def format_new_cases(new):
+    '''
+    Gives a date x geoid matrix of new cases the shape the rest of the
+    pipeline expects.
+    '''
+    # Names only need to be plain strings from here on.
+    new.columns = new.columns.astype(str)
+    new = new.sort_index(axis=1)
+    new.index = new.index.astype(str)
+    new.index.name = 'date'
+    return new
+
+def latest_data_partial(args):
+    '''
+    Parses, filters and aggregates a byte range of latestdata.csv. Returns
+    the counts by (date, geoid), the dates in the order they appear in, and
+    the first row seen for each geoid.
+    '''
+    path, start, end = args
+    df = csv_ranges.read_range(path, start, end, usecols=LATEST_DATA_COLUMNS,
+        dtype={c: 'category' for c in LATEST_DATA_COLUMNS})
+    df = filter_latest_data(df)
+    df = df[in_the_past(df.date_confirmation)]
+
+    # Categories differ from one range to the next, so use plain values.
+    counts = df.groupby(['date_confirmation', 'geoid'], observed=True).size()
+    counts = counts.rename('count').reset_index().astype(
+        {'date_confirmation': object, 'geoid': object})
+    dates = pd.unique(df.date_confirmation.astype(object))
+    first = df[['geoid'] + functions.LOCATION_COLUMNS].drop_duplicates('geoid')
+    return counts, dates, first.astype(object)
+
+def prepare_latest_data_parallel(infile, processes, quiet=False,
+    location_info_file="app/location_info_world.data"):
+    '''
+    Same as prepare_latest_data, with the file split into byte ranges that
+    worker processes parse, filter and aggregate.
+    '''
+    # A few more ranges than processes, so that they even out.
+    ranges = csv_ranges.split_ranges(infile, processes * 4)
+    if not quiet:
+        print("Reading " + infile + " in " + str(len(ranges)) + " parts "
+              "with " + str(processes) + " processes...")
+    with multiprocessing.Pool(processes) as pool:
+        partials = pool.map(latest_data_partial,
+                            [(infile, start, end) for start, end in ranges])
+
+    # Partials come in file order, so the first row seen for a geoid and
+    # the order of dates are the same as when reading everything at once.
+    first = pd.concat([p[2] for p in partials]).drop_duplicates('geoid')
+    functions.compile_location_info(first.to_dict("records"),
+        location_info_file, quiet=quiet)
+
+    counts = pd.concat([p[0] for p in partials])
+    new = counts.groupby(['date_confirmation', 'geoid'], sort=False)['count'].sum()
+    new = new.unstack(fill_value=0)
+    new = new.reindex(pd.unique(np.concatenate([p[1] for p in partials])))
+    return format_new_cases(new)
+
+def prepare_latest_data(infile, quiet=False,
+    location_info_file="app/location_info_world.data", processes=1):
+    if processes > 1 and infile:
+        return prepare_latest_data_parallel(infile, processes, quiet=quiet,
+            location_info_file=location_info_file)
+
+    df = filter_latest_data(read_latest_data(infile, quiet=quiet))
+    df = df[in_the_past(df.date_confirmation)]
 
     # Extract mappings between lat|long and geographical names, then only keep
     # the geo_id.
-    functions.compile_location_info(df.to_dict("records"),
-        "app/location_info_world.data", quiet=quiet)
+    functions.compile_location_info(
+        df.drop_duplicates('geoid').to_dict("records"),
+        location_info_file, quiet=quiet)
     df = df.drop(['city', 'province', 'country', 'latitude', 'longitude'], axis=1)
 
-    dates  = df.date_confirmation.unique()
-    geoids = df.geoid.unique()
-    geoids.sort()
-
-    new = pd.DataFrame(columns=geoids, index=dates)
-    new.index.name = 'date'
-    for i in new.index:
-        counts = df[df.date_confirmation == i].geoid.value_counts()
-        new.loc[i] = counts
-    new = new.fillna(0)
-    new.reset_index(drop=False)
-    return new
+    new = df.groupby(['date_confirmation', 'geoid'], observed=True).size()
+    return format_new_cases(new.unstack(fill_value=0))
 
-def prepare_jhu_data(outfile, read_from_file, quiet=False):
+def prepare_jhu_data(outfile, read_from_file, quiet=False,
+    location_info_file="app/location_info_us.data"):
     '''
     Get JHU data from URL and format to
     to be compatible with full-data.json
@@ -132,7 +307,7 @@ def prepare_jhu_data(outfile, read_from_file, quiet=False):
     df["geoid"] = df.apply(lambda row: functions.latlong_to_geo_id(
         row['Lat'], row['Long_']), axis=1)
     functions.compile_location_info(df.to_dict("records"),
-        out_file="app/location_info_us.data",
+        out_file=location_info_file,
         keys=["Country_Region", "Province_State", "Admin2"],
         quiet=quiet)
 
@@ -188,6 +363,58 @@ def daily_slice(new_cases, total_cases):
 
     return {"date": new_cases.name.replace(".", "-"), "features": features}
 
+def location_aggregates(new_cases, location_info, level):
+    '''
+    Sums a date x geoid matrix of new cases by province (level 1) or country
+    (level 2), according to the given location info. Geoids we don't have
+    location info for are left out, like the client used to do.
+    Returns the compact structure we send to the browser:
+    {"dates": [...], "series": {name: {"new": [...], "total": [...]}}}
+    '''
+    new = location_sums(new_cases, location_info, level)
+    return {"dates": [d.replace(".", "-") for d in new.index],
+            "series": {name: location_series(new[name]) for name in new.columns}}
+
+def location_sums(new_cases, location_info, level):
+    '''
+    Returns a date x name matrix of the new cases of a date x geoid matrix,
+    summed by province (level 1) or country (level 2).
+    '''
+    keys = pd.Series([location_info[g][level] if g in location_info else None
+                      for g in new_cases.columns])
+    known = keys.notna().values
+    return new_cases.loc[:, known].T.groupby(keys[known].values).sum().T
+
+def location_series(new):
+    '''
+    Returns the series of new and total cases of a province or country, from
+    its new cases by date.
+    '''
+    return {"new": [int(x) for x in new.values],
+            "total": [int(x) for x in new.values.cumsum()]}
+
+def write_aggregates(new_cases, location_info_file, out_dir):
+    '''
+    Writes per-country and per-province series next to the daily slices.
+    '''
+    location_info = functions.read_location_info(location_info_file)
+    aggregates_dir = os.path.join(out_dir, AGGREGATES_DIR)
+    if not os.path.exists(aggregates_dir):
+        os.mkdir(aggregates_dir)
+    for name, level in AGGREGATE_LEVELS:
+        with open(os.path.join(aggregates_dir, name + ".json"), "w") as f:
+            json.dump(location_aggregates(new_cases, location_info, level), f,
+                      separators=(",", ":"))
+
+def latest_counts(total_cases):
+    '''
+    Returns the content of latestCounts.json (the overall number of cases and
+    the date it corresponds to) from a date x geoid matrix of total cases.
+    '''
+    count = int(total_cases.iloc[-1].sum()) if len(total_cases) else 0
+    date = total_cases.index[-1].replace('.', '-') if len(total_cases) else ''
+    return [{'caseCount': '{:,}'.format(count), 'date': date}]
+
 def chunks(new_cases, total_cases):
     '''
     Yields successive equal-sized chunks from the input list.
@@ -195,11 +422,96 @@ def chunks(new_cases, total_cases):
     for i in range(len(new_cases)):
         yield (new_cases.iloc[i], total_cases.iloc[i])
 
-def generate_data(out_dir, latest=False, jhu=False, input_jhu='',
-    export_full_data=False, overwrite=False, quiet=False):
+def hashed_slice_name(date, content):
+  '''
+  Returns the file name of the slice for 'date' (YYYY-MM-DD) with the given
+  JSON content.
+  '''
+  digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+  return date.replace('-', '.') + '.' + digest + '.json'
+
+def write_file(path, content):
+  # Write to a temporary file first, so that it's never served half-written.
+  temp_path = path + '.tmp'
+  with open(temp_path, 'w') as f:
+      f.write(content)
+  os.replace(temp_path, path)
+
+def write_manifest(out_dir, latest_date, names):
+  '''
+  Writes the manifest of a slice directory, from the file names of dated
+  slices by date (YYYY-MM-DD).
+  '''
+  write_file(os.path.join(out_dir, MANIFEST_FILE), json.dumps(
+      {'latest': latest_date, 'slices': dict(sorted(names.items()))}))
+
+def read_manifest(out_dir):
+  '''
+  Returns the file names of dated slices by date from the manifest of a
+  slice directory, or an empty dict if there is none.
+  '''
+  path = os.path.join(out_dir, MANIFEST_FILE)
+  if not os.path.exists(path):
+      return {}
+  with open(path) as f:
+      return json.load(f)['slices']
+
+def remove_stale_slices(out_dir, names):
+  '''
+  Removes dated slices that the manifest doesn't reference (anymore).
+  '''
+  keep = set(names.values())
+  for name in os.listdir(out_dir):
+    if DATED_SLICE_PATTERN.match(name) and name not in keep:
+        os.remove(os.path.join(out_dir, name))
+
+def write_slices(new_cases, total_cases, out_dir, latest_date,
+    overwrite=False, quiet=False):
+  '''
+  Writes one JSON file per row of the given date x geoid matrices, along with
+  a manifest of their names. The slice for 'latest_date' is named
+  'latest.json'. Dated slices that are already there have the same content
+  since their name says so, and aren't written again.
+  '''
+  n_cpus = multiprocessing.cpu_count()
+  if not quiet:
+      print("Processing " + str(len(new_cases)) + " features "
+            "with " + str(n_cpus) + " threads...")
+
+  with multiprocessing.Pool(n_cpus) as pool:
+      out_slices = pool.starmap(daily_slice, chunks(new_cases, total_cases),
+                                chunksize=10)
 
-  latest = prepare_latest_data(latest, quiet=quiet)
-  jhu = prepare_jhu_data(jhu, input_jhu, quiet=quiet)
+  names = {}
+  for s in out_slices:
+    content = json.dumps(s)
+    if s['date'] == latest_date:
+        out_name = LATEST_SLICE_FILE
+    else:
+        out_name = hashed_slice_name(s['date'], content)
+        names[s['date']] = out_name
+    daily_slice_file_path = os.path.join(out_dir, out_name)
+
+    if os.path.exists(daily_slice_file_path):
+        if out_name != LATEST_SLICE_FILE:
+            continue
+        if not overwrite:
+            print("I will not clobber '" + daily_slice_file_path + "', " "please delete it first")
+            continue
+
+    write_file(daily_slice_file_path, content)
+
+  # Only once the slices it references are there.
+  write_manifest(out_dir, latest_date, names)
+  if overwrite:
+      remove_stale_slices(out_dir, names)
+
+def merge_data(latest, jhu, export_full_data=False):
+  '''
+  Merges the world and US matrices of new cases, and returns the result with
+  normalized dates in order, one row per day, and geoids in order, along with
+  the date of the latest slice (the last one).
+  '''
   full = latest.merge(jhu, on='date', how='outer')
   full.fillna(0, inplace=True)
   full = full.set_index('date')
@@ -214,40 +526,277 @@ def generate_data(out_dir, latest=False, jhu=False, input_jhu='',
   if export_full_data:
       full.to_csv(export_full_data)
 
-  latest_date = split.normalize_date(full.index[-1]).replace('.', '-')
-
   full.index = [split.normalize_date(x) for x in full.index]
   full.index.name = 'date'
-  full = full.sort_values(by='date')
-
-  new_cases = full
-  total_cases = new_cases.cumsum()
-
-  n_cpus = multiprocessing.cpu_count()
-  if not quiet:
-      print("Processing " + str(len(full)) + " features "
-            "with " + str(n_cpus) + " threads...")
-
-  pool = multiprocessing.Pool(n_cpus)
-  out_slices = pool.starmap(daily_slice, chunks(new_cases, total_cases), chunksize=10)
-
-  for s in out_slices:
-    out_name = ("latest" if s['date'] == latest_date else s['date'].replace('-','.')) + '.json'
-    daily_slice_file_path = os.path.join(out_dir, out_name)
-
-    if not overwrite and os.path.exists(daily_slice_file_path):
-        print("I will not clobber '" + daily_slice_file_path + "', " "please delete it first")
-        continue
+  full = fill_missing_dates(full.sort_index().sort_index(axis=1))
+  latest_date = full.index[-1].replace('.', '-')
+  return full, latest_date
+
+def fill_missing_dates(new_cases, freq='D'):
+  '''
+  Adds rows of zeros to a date x geoid matrix of new cases for the days
+  between its first and last ones that it has no row for, e.g. days without
+  any case in the line list, so that every day gets a slice. With another
+  pandas frequency than 'D', rows are named after the first day of periods
+  of that frequency instead.
+  '''
+  if len(new_cases) == 0:
+      return new_cases
+  periods = pd.to_datetime(new_cases.index, format='%Y.%m.%d').to_period(freq)
+  dates = pd.period_range(periods.min(), periods.max(), freq=freq)
+  dates = dates.start_time.strftime('%Y.%m.%d')
+  if len(dates) == len(new_cases):
+      return new_cases
+  filled = new_cases.reindex(dates, fill_value=0)
+  filled.index.name = new_cases.index.name
+  return filled
+
+def write_zoom_levels(new_cases, out_dir, zoom_levels, latest_date,
+    overwrite=False, quiet=False):
+  '''
+  Writes coarser versions of the slices, one directory per zoom level.
+  '''
+  tile_index = spatial_index.build_tile_index(new_cases.columns, zoom_levels)
+  for zoom in zoom_levels:
+      level_dir = os.path.join(out_dir, spatial_index.level_dir_name(zoom))
+      if not os.path.exists(level_dir):
+          os.mkdir(level_dir)
+      level_new_cases = spatial_index.aggregate_by_tile(
+          new_cases, tile_index, zoom)
+      write_slices(level_new_cases, level_new_cases.cumsum(), level_dir,
+                   latest_date, overwrite=overwrite, quiet=quiet)
+
+def resample_new_cases(new_cases, period):
+  '''
+  Sums a date x geoid matrix of new cases by 'week' or 'month'. Rows are
+  named after the first day of their period, and periods without any case
+  are kept so that none is missing.
+  '''
+  freq = RESAMPLING_PERIODS[period][0]
+  periods = pd.to_datetime(new_cases.index, format='%Y.%m.%d').to_period(freq)
+  resampled = new_cases.groupby(periods).sum()
+  resampled.index = resampled.index.start_time.strftime('%Y.%m.%d')
+  resampled.index.name = 'date'
+  return fill_missing_dates(resampled, freq)
+
+def write_resampled_slices(new_cases, out_dir, periods, overwrite=False,
+    quiet=False):
+  '''
+  Writes slices of new cases by period, one directory per period. The
+  latest one is for the current (possibly incomplete) period.
+  '''
+  if len(new_cases) == 0:
+      return
+  for period in periods:
+      period_dir = os.path.join(out_dir, RESAMPLING_PERIODS[period][1])
+      if not os.path.exists(period_dir):
+          os.mkdir(period_dir)
+      resampled = resample_new_cases(new_cases, period)
+      write_slices(resampled, resampled.cumsum(), period_dir,
+                   resampled.index[-1].replace('.', '-'),
+                   overwrite=overwrite, quiet=quiet)
+
+def load_pickle(path):
+  with open(path, 'rb') as f:
+      return pickle.load(f)
+
+def save_pickle(data, path):
+  with open(path, 'wb') as f:
+      pickle.dump(data, f)
+
+def pipeline_stages(out_dir, work_dir, latest=False, jhu=False, input_jhu='',
+    export_full_data=False, overwrite=False, quiet=False, zoom_levels=None,
+    latest_counts_file=None, incremental=False, processes=1, periods=None,
+    snap_distance=None, tile_zoom_levels=None, tiles_period='day'):
+  '''
+  Returns the stages that generate the daily slices and related files.
+  Intermediate results go to 'work_dir'. With 'incremental', line list rows
+  are ingested incrementally, keeping track of them in 'work_dir'. Otherwise
+  the line list is read with 'processes' processes. Slices are also resampled
+  to the given 'periods' ('week', 'month'). With 'snap_distance', locations
+  that close to each other (in meters) are merged before anything gets
+  aggregated. With 'tile_zoom_levels', vector tiles are written for each
+  'tiles_period' ('day', 'week', 'month').
+  '''
+  work = lambda name: os.path.join(work_dir, name)
+  latest_csv = latest or work('latestdata.csv')
+  jhu_csv = input_jhu or work('jhu.csv')
+  world_info = work('location_info_world.data')
+  us_info = work('location_info_us.data')
+  tiles_info = work('location_info_tiles.data')
+  new_cases_file = work(NEW_CASES_FILE)
+  # What the stages after 'merge' work from.
+  cases_file = work(SNAPPED_CASES_FILE) if snap_distance else new_cases_file
+  all_info = work('location_info.data') if snap_distance else LOCATION_INFO_FILE
+
+  def world():
+      if incremental:
+          import ingest
+          world = ingest.ingest_latest_data(latest_csv, work('ingest.pickle'),
+              quiet=quiet, location_info_file=world_info)
+      else:
+          world = prepare_latest_data(latest_csv, quiet=quiet,
+                                      location_info_file=world_info,
+                                      processes=processes)
+      save_pickle(world, work('world.pickle'))
+
+  def us():
+      save_pickle(prepare_jhu_data(jhu, jhu_csv, quiet=quiet,
+                                   location_info_file=us_info),
+                  work('us.pickle'))
+
+  def merge():
+      save_pickle(merge_data(load_pickle(work('world.pickle')),
+                             load_pickle(work('us.pickle')), export_full_data),
+                  new_cases_file)
+
+  def snap():
+      import snapping
+      new_cases, latest_date = load_pickle(new_cases_file)
+      save_pickle((snapping.snap(new_cases, all_info, LOCATION_INFO_FILE,
+                                 snap_distance, quiet=quiet), latest_date),
+                  cases_file)
+
+  def slices():
+      new_cases, latest_date = load_pickle(cases_file)
+      write_slices(new_cases, new_cases.cumsum(), out_dir, latest_date,
+                   overwrite=overwrite, quiet=quiet)
+
+  def counts():
+      new_cases, _ = load_pickle(cases_file)
+      with open(latest_counts_file, 'w') as f:
+          json.dump(latest_counts(new_cases.cumsum()), f)
+
+  def location_info():
+      # Concatenate location info for the US and elsewhere
+      in_files = [world_info, us_info]
+      if zoom_levels:
+          # Slices of zoom levels refer to the centers of tiles. Actual
+          # locations come last, so they win if a center is one of them.
+          spatial_index.write_tile_location_info(in_files, tiles_info,
+                                                 zoom_levels)
+          in_files = [tiles_info] + in_files
+      functions.concatenate_location_info(in_files, all_info)
+
+  def aggregates():
+      new_cases, _ = load_pickle(cases_file)
+      write_aggregates(new_cases, LOCATION_INFO_FILE, out_dir)
+
+  def zoom():
+      new_cases, latest_date = load_pickle(cases_file)
+      write_zoom_levels(new_cases, out_dir, zoom_levels, latest_date,
+                        overwrite=overwrite, quiet=quiet)
+
+  def resample():
+      new_cases, _ = load_pickle(cases_file)
+      write_resampled_slices(new_cases, out_dir, periods, overwrite=overwrite,
+                             quiet=quiet)
+
+  def tiles():
+      new_cases, _ = load_pickle(cases_file)
+      if tiles_period != 'day':
+          new_cases = resample_new_cases(new_cases, tiles_period)
+      vector_tiles.write_vector_tiles(new_cases, out_dir, tile_zoom_levels,
+                                      overwrite=overwrite, quiet=quiet)
+
+  result = []
+  if not latest:
+      result.append(stages.Stage('fetch_latest',
+          lambda: download(LATEST_DATA_URL, latest_csv, quiet=quiet),
+          outputs=[latest_csv], always=True))
+  if not input_jhu:
+      result.append(stages.Stage('fetch_jhu',
+          lambda: download(JHU_URL, jhu_csv, quiet=quiet),
+          outputs=[jhu_csv], always=True))
+  result += [
+      # Dates in the future are left out, so results change with the day.
+      stages.Stage('world', world, inputs=[latest_csv, COUNTRIES_FILE],
+          outputs=[work('world.pickle'), world_info],
+          params={'today': str(pd.Timestamp.now().date())},
+          exclusive=processes > 1 and not incremental),
+      stages.Stage('us', us, inputs=[jhu_csv, COUNTRIES_FILE],
+          outputs=[work('us.pickle'), us_info], params={'jhu': jhu}),
+      stages.Stage('merge', merge,
+          inputs=[work('world.pickle'), work('us.pickle')],
+          outputs=[new_cases_file] + ([export_full_data] if export_full_data else [])),
+      stages.Stage('location_info', location_info, inputs=[world_info, us_info],
+          outputs=[all_info], params={'zoom_levels': zoom_levels}),
+  ]
+  if snap_distance:
+      result.append(stages.Stage('snap', snap, inputs=[new_cases_file, all_info],
+          outputs=[cases_file, LOCATION_INFO_FILE],
+          params={'distance': snap_distance}))
+  result += [
+      # Slices are written by worker processes.
+      stages.Stage('slices', slices, inputs=[cases_file],
+          outputs=[os.path.join(out_dir, '*.json')],
+          params={'overwrite': overwrite}, exclusive=True),
+      stages.Stage('aggregates', aggregates,
+          inputs=[cases_file, LOCATION_INFO_FILE],
+          outputs=[os.path.join(out_dir, AGGREGATES_DIR, '*.json')]),
+  ]
+  if latest_counts_file:
+      result.append(stages.Stage('counts', counts, inputs=[cases_file],
+          outputs=[latest_counts_file]))
+  if zoom_levels:
+      result.append(stages.Stage('zoom_levels', zoom, inputs=[cases_file],
+          outputs=[os.path.join(out_dir, spatial_index.level_dir_name(z), '*.json')
+                   for z in zoom_levels],
+          params={'zoom_levels': zoom_levels, 'overwrite': overwrite},
+          exclusive=True))
+  if periods:
+      result.append(stages.Stage('resample', resample, inputs=[cases_file],
+          outputs=[os.path.join(out_dir, RESAMPLING_PERIODS[p][1], '*.json')
+                   for p in periods],
+          params={'periods': periods, 'overwrite': overwrite},
+          exclusive=True))
+  if tile_zoom_levels:
+      tiles_dir = os.path.join(out_dir, vector_tiles.TILES_DIR)
+      result.append(stages.Stage('vector_tiles', tiles, inputs=[cases_file],
+          outputs=[os.path.join(tiles_dir, vector_tiles.INDEX_FILE),
+                   os.path.join(tiles_dir, '*', '*', '*', '*.pbf')],
+          params={'zoom_levels': tile_zoom_levels, 'period': tiles_period,
+                  'overwrite': overwrite},
+          exclusive=True))
+  return result
 
-    with open(daily_slice_file_path, "w") as f:
-        f.write(json.dumps(s))
-
-  # Concatenate location info for the US and elsewhere
-  os.system("rm -f app/location_info.data")
-  os.system("cat app/location_info_world.data app/location_info_us.data > "
-            "app/location_info.data")
-  os.remove("app/location_info_world.data")
-  os.remove("app/location_info_us.data")
+def generate_data(out_dir, latest=False, jhu=False, input_jhu='',
+    export_full_data=False, overwrite=False, quiet=False, zoom_levels=None,
+    latest_counts_file=None, state_dir=None, only=None, force=False,
+    processes=1, periods=None, snap_distance=None, tile_zoom_levels=None,
+    tiles_period='day'):
+  '''
+  Runs the stages of the pipeline. With 'state_dir', intermediate results are
+  kept there and stages that are up to date are skipped, otherwise everything
+  runs in a temporary directory.
+  '''
+  work_dir = state_dir or tempfile.mkdtemp()
+  if not os.path.exists(work_dir):
+      os.makedirs(work_dir)
+  try:
+      pipeline = stages.Pipeline(pipeline_stages(out_dir, work_dir, latest,
+          jhu, input_jhu, export_full_data, overwrite, quiet, zoom_levels,
+          latest_counts_file, incremental=bool(state_dir),
+          processes=processes, periods=periods, snap_distance=snap_distance,
+          tile_zoom_levels=tile_zoom_levels, tiles_period=tiles_period),
+          state_file=os.path.join(work_dir, STATE_FILE) if state_dir else None,
+          quiet=quiet)
+      pipeline.run(only=only, force=force)
+  finally:
+      if not state_dir:
+          shutil.rmtree(work_dir)
+
+def show_status(out_dir, state_dir, **kwargs):
+  '''
+  Shows which stages generate_data() would run with the same arguments, and
+  why.
+  '''
+  # Like generate_data() with a state directory.
+  pipeline = stages.Pipeline(pipeline_stages(out_dir, state_dir,
+      incremental=True, **kwargs),
+      state_file=os.path.join(state_dir, STATE_FILE))
+  for name, reason in pipeline.status():
+      print(name + ": " + ("would run (" + reason + ")" if reason else "up to date"))
 
 if __name__ == '__main__':
     args = parser.parse_args()
@@ -256,7 +805,34 @@ if __name__ == '__main__':
         import time
         t0 = time.time()
 
-    generate_data(args.out_dir, args.latest, args.jhu, args.input_jhu, args.full)
+    zoom_levels = args.zoom_levels
+    if zoom_levels is not None and len(zoom_levels) == 0:
+        zoom_levels = spatial_index.DEFAULT_ZOOM_LEVELS
+
+    tile_zoom_levels = args.vector_tiles
+    if tile_zoom_levels is not None and len(tile_zoom_levels) == 0:
+        tile_zoom_levels = spatial_index.DEFAULT_ZOOM_LEVELS
+
+    if (args.stage or args.status) and not args.state_dir:
+        print("Please give a state directory (--state_dir)")
+        sys.exit(1)
+
+    if args.status:
+        show_status(args.out_dir, args.state_dir, latest=args.latest,
+                    jhu=args.jhu, input_jhu=args.input_jhu,
+                    export_full_data=args.full, zoom_levels=zoom_levels,
+                    latest_counts_file=args.counts, processes=args.processes,
+                    periods=args.resample, snap_distance=args.snap,
+                    tile_zoom_levels=tile_zoom_levels,
+                    tiles_period=args.tiles_period)
+        sys.exit(0)
+
+    generate_data(args.out_dir, args.latest, args.jhu, args.input_jhu, args.full,
+                  zoom_levels=zoom_levels, latest_counts_file=args.counts,
+                  state_dir=args.state_dir, only=args.stage, force=args.force,
+                  processes=args.processes, periods=args.resample,
+                  snap_distance=args.snap, tile_zoom_levels=tile_zoom_levels,
+                  tiles_period=args.tiles_period)
 
     if args.timeit:
         print(round(time.time() - t0, 2), "seconds")
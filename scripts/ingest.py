@@ -0,0 +1,222 @@
+'''
+Incremental ingest of the line list (latestdata.csv).
+
+The line list is mostly appended to, so instead of re-aggregating every row
+on each run, we keep a state file with, for each case ID (as a 64-bit
+digest), a hash of the row and the (date, geoid) cell it contributes to,
+along with the matrix of new cases built so far. On the next run only rows
+that were added, removed or modified are filtered, and their contributions
+are added to or subtracted from the stored matrix.
+
+The result is the same as that of generate_full_data.prepare_latest_data.
+'''
+
+import functions
+import generate_full_data
+import hashlib
+import io
+import numpy as np
+import os
+import pandas as pd
+import pickle
+
+from pandas.api.types import union_categoricals
+
+# Bumped whenever the format of the state file changes, older state files
+# are then ignored.
+STATE_VERSION = 1
+
+ID_COLUMN = 'ID'
+
+STATE_COLUMNS = ['hash', 'date', 'geoid'] + functions.LOCATION_COLUMNS
+
+
+def row_keys(ids):
+    '''
+    Returns an index of digests of the given IDs. Rows sharing an ID also
+    get their occurrence hashed in, so that keys stay distinct.
+    '''
+    ids = pd.Series(ids.values, dtype=object).fillna('')
+    occurrence = 0
+    if ids.duplicated().any():
+        occurrence = ids.groupby(ids.values, sort=False).cumcount()
+    keys = pd.util.hash_pandas_object(
+        pd.DataFrame({'ID': ids, 'occurrence': occurrence}), index=False)
+    return pd.Index(keys.values, name='key')
+
+def load_state(state_file):
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') == STATE_VERSION:
+            return state
+    return {'version': STATE_VERSION,
+            'rows': pd.DataFrame(columns=STATE_COLUMNS,
+                index=pd.Index([], dtype='uint64', name='key')),
+            'matrix': pd.DataFrame()}
+
+def save_state(state, state_file):
+    temp_path = state_file + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, state_file)
+
+def contributions(df):
+    '''
+    Returns the state rows for the given line list rows: their (date, geoid)
+    cell, or missing values for rows that we filter out.
+    '''
+    valid = generate_full_data.filter_latest_data(df)
+    rows = df[functions.LOCATION_COLUMNS].astype(object)
+    rows['date'] = valid.date_confirmation.astype(object).reindex(df.index)
+    rows['geoid'] = valid.geoid.astype(object).reindex(df.index)
+    return rows
+
+def add_counts(matrix, counts, sign=1):
+    '''
+    Adds (or subtracts) a matrix of counts to another one, aligning them.
+    '''
+    if counts.empty:
+        return matrix
+    dates = matrix.index.union(counts.index)
+    geoids = matrix.columns.union(counts.columns)
+    matrix = matrix.reindex(index=dates, columns=geoids, fill_value=0)
+    counts = counts.reindex(index=dates, columns=geoids, fill_value=0)
+    values = matrix.values.astype('int64') + sign * counts.values.astype('int64')
+    return pd.DataFrame(values, index=dates.rename('date'),
+                        columns=geoids.rename('geoid'))
+
+def concat_rows(old, changed, keys):
+    '''
+    Returns the state rows for 'keys', taken from 'old' or 'changed'. Columns
+    stay categorical all along, which is much cheaper than going through
+    objects.
+    '''
+    columns = {'hash': np.concatenate([old['hash'].values.astype('uint64'),
+                                      changed['hash'].values.astype('uint64')])}
+    for c in STATE_COLUMNS[1:]:
+        columns[c] = union_categoricals([
+            pd.Categorical(old[c]), pd.Categorical(changed[c].astype(object))],
+            ignore_order=True)
+    rows = pd.DataFrame(columns, index=old.index.append(changed.index))
+    return rows.reindex(keys)
+
+def cell_counts(rows):
+    '''
+    Returns a date x geoid matrix of how many rows contribute to each cell.
+    '''
+    rows = rows[rows.geoid.notna()]
+    if len(rows) == 0:
+        return pd.DataFrame()
+    return rows.groupby(['date', 'geoid'], observed=True).size().unstack(fill_value=0)
+
+def read_rows(content):
+    '''
+    Parses line list rows from CSV content, indexed by row key. Returns them
+    along with a hash of each row.
+    '''
+    columns = [ID_COLUMN] + generate_full_data.LATEST_DATA_COLUMNS
+    df = generate_full_data.read_latest_data(io.BytesIO(content), quiet=True,
+        columns=columns, dtype={ID_COLUMN: str})
+    df.index = row_keys(df[ID_COLUMN])
+    df = df.drop(ID_COLUMN, axis=1)
+    return df, pd.util.hash_pandas_object(df, index=False)
+
+def read_appended_rows(content, state):
+    '''
+    When the file we ingested last is a prefix of 'content', returns the rows
+    that were appended since (and their hashes), or None otherwise.
+    '''
+    source = state.get('source')
+    if not source or len(content) < source['size']:
+        return None
+    prefix = content[:source['size']]
+    if not prefix.endswith(b'\n') or hashlib.sha1(prefix).hexdigest() != source['digest']:
+        return None
+    header = content[:content.find(b'\n') + 1]
+    df, hashes = read_rows(header + content[source['size']:])
+    # Keys of repeated IDs depend on what comes before, so they need the
+    # whole file.
+    if df.index.isin(state['rows'].index).any():
+        return None
+    return df, hashes
+
+def ingest_content(content, state, quiet=False):
+    '''
+    Applies a version of the line list (its CSV content) to an ingest state
+    (see load_state()). Returns the new state, the date x geoid matrix of
+    changes to its counts (dates in the future included), and whether rows
+    were only appended.
+    '''
+    old = state['rows']
+    appended = read_appended_rows(content, state)
+    if appended is not None:
+        df, hashes = appended
+        unchanged = np.zeros(len(df), dtype=bool)
+        gone = np.zeros(len(old), dtype=bool)
+        keys = old.index.append(df.index)
+    else:
+        df, hashes = read_rows(content)
+        old_hashes = old['hash'].astype('uint64').reindex(df.index, fill_value=0)
+        unchanged = (df.index.isin(old.index) & (old_hashes.values == hashes.values))
+        gone = ~old.index.isin(df.index[unchanged])
+        keys = df.index
+    if not quiet:
+        print("Ingesting " + str(int((~unchanged).sum())) + " new or modified "
+              "rows, removing " + str(int(gone.sum())) + " old ones...")
+
+    changed = contributions(df[~unchanged])
+    changed['hash'] = hashes[~unchanged]
+    changes = add_counts(cell_counts(changed), cell_counts(old[gone]), -1)
+    matrix = add_counts(state['matrix'], changes)
+    # Cells that no row contributes to anymore.
+    matrix = matrix.loc[(matrix != 0).any(axis=1), (matrix != 0).any(axis=0)]
+
+    rows = concat_rows(old[~gone], changed, keys)
+    state = {'version': STATE_VERSION, 'rows': rows, 'matrix': matrix,
+             'source': {'size': len(content),
+                        'digest': hashlib.sha1(content).hexdigest()}}
+    return state, changes, appended is not None
+
+def past_rows(rows):
+    '''
+    Returns the state rows that contribute to a cell, on a date in the past.
+    '''
+    # Dates in the future are only left out now, as they'll become valid.
+    rows = rows[rows.geoid.notna()]
+    return rows[in_the_past(rows.date)]
+
+def write_location_info(rows, location_info_file, quiet=False):
+    '''
+    Writes the location info of the geoids of the given state rows, from the
+    first row of each.
+    '''
+    functions.compile_location_info(
+        rows[['geoid'] + functions.LOCATION_COLUMNS].drop_duplicates('geoid').to_dict("records"),
+        location_info_file, quiet=quiet)
+
+def ingest_latest_data(infile, state_file, quiet=False,
+    location_info_file="app/location_info_world.data"):
+    '''
+    Same as generate_full_data.prepare_latest_data, but only processes the
+    rows that changed since the state in 'state_file' was saved. When rows
+    were only appended to the file, only those get parsed.
+    '''
+    with open(infile, 'rb') as f:
+        content = f.read()
+
+    state, _, _ = ingest_content(content, load_state(state_file), quiet=quiet)
+    save_state(state, state_file)
+
+    rows = past_rows(state['rows'])
+    write_location_info(rows, location_info_file, quiet=quiet)
+
+    # Dates come in the order they first appear in, like when aggregating
+    # everything at once.
+    matrix = state['matrix']
+    new = matrix.reindex(pd.unique(rows.date.astype(object)))
+    new = new.loc[:, (new != 0).any(axis=0)]
+    return generate_full_data.format_new_cases(new)
+
+def in_the_past(dates):
+    return generate_full_data.in_the_past(dates.astype('category'))
@@ -1,80 +1,174 @@
 #!/usr/bin/env python3
 
+import argparse
 import requests
 import pandas as pd
-from datetime import datetime, timedelta 
+from datetime import datetime, timedelta
+import multiprocessing
+import os
 import sys
 from io import StringIO
 import json
 
-def legend_group(count):
-    if count <= 10:
-        return '10'
-    elif 10 < count <= 100:
-        return '100'
-    elif 100 < count <= 500:
-        return  '500'
-    elif 500 < count <= 2000:
-        return '2000'
-    else:
-        return 'default'
+URL_BASE = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/{}.csv'
 
-def main(outfile):
-    url_base = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/{}.csv'
-    date = (datetime.now() - timedelta(days=1)).strftime('%m-%d-%Y')
-    url = url_base.format(date)
+CENTRAL_US_LAT = 39.8283
+CENTRAL_US_LONG = -98.5795
 
+# Upper bounds (inclusive) of the legend groups, the last group has no bound.
+LEGEND_BOUNDS = [10, 100, 500, 2000]
+LEGEND_GROUPS = ['10', '100', '500', '2000', 'default']
 
-    req = requests.get(url)
-    if req.status_code != 200:
-        print('Couldn\'t get Global JHU data, aborting')
-        sys.exit(1)
+# Older daily reports use different column names.
+COLUMN_NAMES = {
+    'Country/Region': 'Country_Region',
+    'Latitude': 'Lat',
+    'Longitude': 'Long_',
+}
+
+parser = argparse.ArgumentParser(
+    description='Build per-country totals from JHU daily reports')
+
+parser.add_argument('out', type=str,
+        help='output file, or output directory with --backfill')
+
+parser.add_argument('-b', '--backfill', type=str, nargs=2,
+        metavar=('START', 'END'),
+        help='write one snapshot per day for this range of dates (YYYY-MM-DD)')
+
+parser.add_argument('-c', '--cache_dir', type=str, default='',
+        help='directory where daily reports are cached')
+
+parser.add_argument('-p', '--processes', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of reports to process in parallel')
+
+
+def legend_groups(counts):
+    '''
+    Returns the legend group of each of the given counts.
+    '''
+    bins = [-float('inf')] + LEGEND_BOUNDS + [float('inf')]
+    return pd.cut(counts, bins=bins, labels=LEGEND_GROUPS).astype(str)
+
+def read_daily_report(date, cache_dir=''):
+    '''
+    Returns the JHU daily report for the given date as a DataFrame, or None if
+    it isn't available (or doesn't have coordinates, like the earliest ones).
+    Reports are read from and saved to 'cache_dir' when given.
+    '''
+    name = date.strftime('%m-%d-%Y') + '.csv'
+    cache_path = os.path.join(cache_dir, name) if cache_dir else ''
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            text = f.read()
+    else:
+        req = requests.get(URL_BASE.format(date.strftime('%m-%d-%Y')))
+        if req.status_code != 200:
+            return None
+        text = req.text
+        if cache_path:
+            with open(cache_path, 'w') as f:
+                f.write(text)
 
-    df = pd.read_csv(StringIO(req.text), usecols=['Lat', 'Long_',
-        'Country_Region', 'Confirmed'])
-    df = df[~(df.Lat.isna() | df.Long_.isna())] 
+    df = pd.read_csv(StringIO(text)).rename(columns=COLUMN_NAMES)
+    if not set(['Lat', 'Long_', 'Country_Region', 'Confirmed']) <= set(df.columns):
+        return None
+    return df
 
-    central_us_lat  = '39.8283'
-    central_us_long = '98.5795'
+def country_snapshot(df, format_counts=True):
+    '''
+    Sums up confirmed cases by country from a daily report, in decreasing
+    order of cases. With 'format_counts', counts are strings with thousands
+    separators.
+    '''
+    df = df[['Lat', 'Long_', 'Country_Region', 'Confirmed']]
+    df = df[~(df.Lat.isna() | df.Long_.isna())]
 
     counts = df[['Country_Region', 'Confirmed']].groupby('Country_Region', as_index=False).sum()
-   
+    counts['Confirmed'] = counts.Confirmed.fillna(0).astype(int)
+
+    # Use the first location reported for each country as its centroid.
     df = df.drop('Confirmed', axis=1)
     df = df.drop_duplicates(subset='Country_Region')
-
     counts = counts.merge(df, on='Country_Region', how='left')
-    counts['legendGroup'] = counts.Confirmed.map(legend_group)
-    counts['Confirmed'] = counts.Confirmed.map('{:,}'.format)
-    counts[counts.Country_Region == 'US'][['Lat', 'Long_']] = [central_us_lat, central_us_long]
-    counts[counts.Country_Region == 'US']['Country_Region'] = 'United States of America'
+    us = counts.Country_Region == 'US'
+    counts.loc[us, 'Lat'] = CENTRAL_US_LAT
+    counts.loc[us, 'Long_'] = CENTRAL_US_LONG
+    counts.loc[us, 'Country_Region'] = 'United States of America'
     counts['Lat'] = counts.Lat.round(4)
     counts['Long_'] = counts.Long_.round(4)
-    counts.Country_Region = counts.Country_Region.apply(lambda x: 'United States of America' if x == 'US' else x)
+
+    # Sort on the numbers, before they get formatted.
+    counts = counts.sort_values(by='Confirmed', ascending=False, kind='mergesort')
+    counts['legendGroup'] = legend_groups(counts.Confirmed)
+    if format_counts:
+        counts['Confirmed'] = counts.Confirmed.map('{:,}'.format)
+
     features = []
-    for i, row in counts.iterrows():
-        print(row.dtype)
-        entry = {
+    for confirmed, name, group, x, y in zip(counts.Confirmed.tolist(),
+            counts.Country_Region.tolist(), counts.legendGroup.tolist(),
+            counts.Long_.tolist(), counts.Lat.tolist()):
+        features.append({
             'attributes': {
-                'cum_conf': row['Confirmed'],
-                'ADM0_NAME': row['Country_Region'],
-                'legendGroup': row['legendGroup']
+                'cum_conf': confirmed,
+                'ADM0_NAME': name,
+                'legendGroup': group
             },
             'centroid': {
-                  "x" : row['Long_'], 
-                  "y" : row['Lat']
-                }
-              }
-        features.append(entry)
-
-    features = sorted(features, 
-            key=lambda x: int(x['attributes']['cum_conf'].replace(',','')), 
-            reverse=True)
-    data = {'features': features}
+                'x': x,
+                'y': y
+            }
+        })
+    return {'features': features}
 
+def write_snapshot(date, outfile, cache_dir='', format_counts=True):
+    '''
+    Writes the per-country snapshot for the given date. Returns whether the
+    daily report was available.
+    '''
+    df = read_daily_report(date, cache_dir)
+    if df is None:
+        return False
     with open(outfile, 'w') as f:
-        json.dump(data, f) 
+        json.dump(country_snapshot(df, format_counts), f)
+    return True
 
+def write_snapshot_for_day(args):
+    date, out_dir, cache_dir = args
+    outfile = os.path.join(out_dir, date.strftime('%Y.%m.%d') + '.json')
+    return date, write_snapshot(date, outfile, cache_dir)
 
-if __name__ == '__main__':
-    main(sys.argv[1])
+def backfill(start, end, out_dir, cache_dir='', processes=1):
+    '''
+    Writes one snapshot per day from 'start' to 'end' (inclusive) in
+    'out_dir', processing several daily reports in parallel. Returns the
+    dates for which no report was available.
+    '''
+    for d in [out_dir, cache_dir]:
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+    dates = pd.date_range(start, end, freq='D').to_pydatetime().tolist()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(write_snapshot_for_day,
+                           [(date, out_dir, cache_dir) for date in dates])
+    return [date for date, ok in results if not ok]
 
+def main(outfile, cache_dir=''):
+    date = datetime.now() - timedelta(days=1)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if not write_snapshot(date, outfile, cache_dir):
+        print('Couldn\'t get Global JHU data, aborting')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.backfill:
+        missing = backfill(args.backfill[0], args.backfill[1], args.out,
+                           args.cache_dir, args.processes)
+        for date in missing:
+            print('No daily report for ' + date.strftime('%Y-%m-%d'))
+    else:
+        main(args.out, args.cache_dir)
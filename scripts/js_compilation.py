@@ -1,20 +1,31 @@
-import os
+import subprocess
 
+# Sources of the compiled bundle, along with the compiler itself.
+INPUTS = [
+    "app/js/healthmap.js",
+    "app/js/externs_d3.js",
+    "app/js/externs_mapbox.js",
+    "tools/closure-compiler.jar",
+]
+
+OUTPUT = "app/js/bundle.js"
+
+COMMAND = ["java", "-jar", "tools/closure-compiler.jar",
+           "--language_in", "ECMASCRIPT6",
+           "--compilation_level", "SIMPLE_OPTIMIZATIONS",
+           "--js", "app/js/healthmap.js",
+           "--externs", "app/js/externs_d3.js",
+           "--externs", "app/js/externs_mapbox.js",
+           "--js_output_file", OUTPUT]
+
+# Returns whether compilation succeeded.
 def compile_js(quiet=False):
 
     if not quiet:
         print("Compiling Javascript...")
 
-    cmd = ("java -jar tools/closure-compiler.jar "
-           "--language_in ECMASCRIPT6 "
-           "--compilation_level SIMPLE_OPTIMIZATIONS "
-           "--js app/js/healthmap.js "
-           "--externs app/js/externs_d3.js "
-           "--externs app/js/externs_mapbox.js "
-           "--js_output_file app/js/bundle.js")
-    if quiet:
-        cmd += " 2> /dev/null"
-    os.system(cmd)
+    return subprocess.call(
+        COMMAND, stderr=subprocess.DEVNULL if quiet else None) == 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,266 @@
+'''
+Sidecar binary index for location info files.
+
+A location info file is a newline-separated list of 'geoid:city,province,CC'
+entries. Next to it we keep an index file that holds the geoids in sorted
+order along with the byte offset of the corresponding line, so that tools
+can memory-map both files and look geoids up with a binary search instead
+of parsing the whole text file.
+
+Index layout (all integers little-endian):
+    header:  magic (8 bytes), entry count (uint32), data file size (uint64),
+             data file modification time (uint64, in ns), SHA-1 of the data
+             file (20 bytes)
+    entries: key offset (uint32), key length (uint16),
+             line offset (uint32), line length (uint32)
+    keys:    the concatenated geoids, in sorted order
+'''
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+INDEX_SUFFIX = ".idx"
+
+MAGIC = b"GEOIDX02"
+HEADER = struct.Struct("<8sIQQ20s")
+ENTRY = struct.Struct("<IHII")
+
+
+def index_path_for(data_path):
+    return data_path + INDEX_SUFFIX
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def read_entries(data_path):
+    '''
+    Returns a dictionary from geoid to (line offset, line length) for the
+    given location info file. Later lines win over earlier ones, which is
+    also what the client does when it loads the file.
+    '''
+    entries = {}
+    offset = 0
+    with open(data_path, "rb") as f:
+        for line in f:
+            length = len(line)
+            stripped = line.rstrip(b"\r\n")
+            if b":" in stripped:
+                geoid = stripped.split(b":", 1)[0]
+                entries[geoid] = (offset, len(stripped))
+            offset += length
+    return entries
+
+
+def build_index(data_path, index_path=None):
+    '''
+    Writes the sidecar index for the given location info file and returns
+    its path.
+    '''
+    index_path = index_path or index_path_for(data_path)
+    stat = os.stat(data_path)
+    digest = file_digest(data_path)
+    entries = read_entries(data_path)
+    geoids = sorted(entries.keys())
+
+    table = bytearray()
+    keys = bytearray()
+    for geoid in geoids:
+        line_offset, line_length = entries[geoid]
+        table += ENTRY.pack(len(keys), len(geoid), line_offset, line_length)
+        keys += geoid
+
+    with open(index_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(geoids), stat.st_size,
+                            stat.st_mtime_ns, digest))
+        f.write(table)
+        f.write(keys)
+    return index_path
+
+
+def _map_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class LocationIndex(object):
+    '''
+    Random access to a location info file through its sidecar index.
+    Geoids resolve to a (city, province, country code) tuple.
+    '''
+
+    def __init__(self, data_path, index_path=None, rebuild=False):
+        self.data_path = data_path
+        self.index_path = index_path or index_path_for(data_path)
+        if rebuild or not os.path.exists(self.index_path):
+            build_index(self.data_path, self.index_path)
+
+        self._index = _map_file(self.index_path)
+        if len(self._index) < HEADER.size:
+            magic = None
+        else:
+            magic, self._count, data_size, data_mtime, data_digest = \
+                HEADER.unpack_from(self._index, 0)
+        if magic != MAGIC:
+            raise ValueError("'" + self.index_path + "' is not a location "
+                             "index file (or an older kind), please rebuild it")
+        # The content only needs to be checked when the file was touched,
+        # e.g. by a checkout or a copy.
+        stat = os.stat(self.data_path)
+        if data_size != stat.st_size or (
+                data_mtime != stat.st_mtime_ns and
+                data_digest != file_digest(self.data_path)):
+            raise ValueError("'" + self.index_path + "' is out of date, "
+                             "please rebuild it")
+        self._keys_start = HEADER.size + self._count * ENTRY.size
+        self._data = _map_file(self.data_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for m in (self._index, self._data):
+            if isinstance(m, mmap.mmap):
+                m.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._index, HEADER.size + i * ENTRY.size)
+
+    def _key(self, i):
+        key_offset, key_length, _, _ = self._entry(i)
+        start = self._keys_start + key_offset
+        return self._index[start:start + key_length]
+
+    def _value(self, i):
+        _, key_length, line_offset, line_length = self._entry(i)
+        start = line_offset + key_length + 1
+        value = self._data[start:line_offset + line_length].decode("utf-8")
+        return tuple(value.split(",", 2))
+
+    def _find(self, geoid):
+        key = geoid.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key(lo) == key:
+            return lo
+        return -1
+
+    def __contains__(self, geoid):
+        return self._find(geoid) >= 0
+
+    def __getitem__(self, geoid):
+        i = self._find(geoid)
+        if i < 0:
+            raise KeyError(geoid)
+        return self._value(i)
+
+    def lookup(self, geoid, default=None):
+        i = self._find(geoid)
+        return self._value(i) if i >= 0 else default
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._key(i).decode("utf-8")
+
+    def items(self):
+        '''
+        Yields (geoid, (city, province, country code)) pairs in geoid order.
+        '''
+        for i in range(self._count):
+            yield self._key(i).decode("utf-8"), self._value(i)
+
+
+def diff(old_data_path, new_data_path):
+    '''
+    Compares two versions of a location info file. Returns a dictionary with
+    lists of 'added' and 'removed' geoids, as well as 'changed' entries in the
+    form (geoid, old value, new value).
+    '''
+    result = {"added": [], "removed": [], "changed": []}
+    with LocationIndex(old_data_path) as old, \
+         LocationIndex(new_data_path) as new:
+        old_items = old.items()
+        new_items = new.items()
+        old_item = next(old_items, None)
+        new_item = next(new_items, None)
+        # Both sides are sorted, so walk them in lockstep.
+        while old_item is not None or new_item is not None:
+            if new_item is None or (old_item is not None and
+                                    old_item[0] < new_item[0]):
+                result["removed"].append(old_item[0])
+                old_item = next(old_items, None)
+            elif old_item is None or new_item[0] < old_item[0]:
+                result["added"].append(new_item[0])
+                new_item = next(new_items, None)
+            else:
+                if old_item[1] != new_item[1]:
+                    result["changed"].append(
+                        (old_item[0], old_item[1], new_item[1]))
+                old_item = next(old_items, None)
+                new_item = next(new_items, None)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build and query location info index files")
+    subparsers = parser.add_subparsers(dest="command")
+
+    build = subparsers.add_parser("build", help="(re-)build the index")
+    build.add_argument("data", help="path to a location info file")
+
+    lookup = subparsers.add_parser("lookup", help="resolve geoids to names")
+    lookup.add_argument("data", help="path to a location info file")
+    lookup.add_argument("geoids", nargs="+", help="geoids ('lat|long')")
+
+    compare = subparsers.add_parser("diff", help="compare two versions")
+    compare.add_argument("old", help="path to the old location info file")
+    compare.add_argument("new", help="path to the new location info file")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        print("Wrote " + build_index(args.data))
+    elif args.command == "lookup":
+        with LocationIndex(args.data) as index:
+            for geoid in args.geoids:
+                location = index.lookup(geoid)
+                print(geoid + ": " + (",".join(location) if location
+                                      else "(unknown)"))
+    elif args.command == "diff":
+        changes = diff(args.old, args.new)
+        for geoid in changes["added"]:
+            print("+ " + geoid)
+        for geoid in changes["removed"]:
+            print("- " + geoid)
+        for geoid, old, new in changes["changed"]:
+            print("~ " + geoid + ": " + ",".join(old) + " -> " +
+                  ",".join(new))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
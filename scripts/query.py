@@ -0,0 +1,261 @@
+'''
+Answers questions like "new cases per day in this province" from the date x
+geoid matrix of new cases that the pipeline keeps in its state directory,
+and the location info file, without going through the daily slices.
+
+Geoids are grouped by city, province and country once when loading, so a
+query only sums the columns it needs. Names are only unique within their
+country (and cities within their province), so provinces are looked up
+along with their country, and cities along with both. Provinces and
+countries also get their series summed up front. Recent queries are kept in
+an LRU cache.
+
+The same queries can be served over HTTP, e.g.
+  /series?country=US&province=Texas&start=2020-03-01&end=2020-03-31
+returns {"dates": [...], "new": [...], "total": [...]}, like the aggregates.
+'''
+
+import argparse
+import functions
+import functools
+import generate_full_data
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+import urllib.parse
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Levels of location info, in the order of its fields.
+LEVELS = ['city', 'province', 'country']
+# Levels we sum series for when loading, there are too many cities.
+SUMMED_LEVELS = ['province', 'country']
+# The fields of location info that identify a location at each level.
+LEVEL_FIELDS = {'city': [0, 1, 2], 'province': [1, 2], 'country': [2]}
+
+# How many location queries to keep the series of.
+CACHE_SIZE = 1024
+
+parser = argparse.ArgumentParser(
+    description='Query time series of cases by location and date range')
+
+parser.add_argument('-d', '--state_dir', type=str, default='.pipeline',
+        help='state directory of the data pipeline, to read the case matrix from')
+
+parser.add_argument('--snapped', action='store_true',
+        help='read the matrix of snapped locations (see generate_full_data.py '
+        '--snap), which the location info goes with after snapping')
+
+parser.add_argument('-l', '--location_info', type=str,
+        default=generate_full_data.LOCATION_INFO_FILE,
+        help='location info file for the geoids of the case matrix')
+
+parser.add_argument('-g', '--geoid', type=str, help='a single location')
+parser.add_argument('--city', type=str,
+        help='needs --province (possibly empty) and --country')
+parser.add_argument('--province', type=str, help='needs --country')
+parser.add_argument('--country', type=str, help='country code')
+parser.add_argument('--start', type=str, help='first date (YYYY-MM-DD)')
+parser.add_argument('--end', type=str, help='last date (YYYY-MM-DD)')
+
+parser.add_argument('-s', '--serve', type=int, metavar='PORT',
+        help='answer queries over HTTP on this port instead')
+
+
+class QueryError(Exception):
+    pass
+
+
+def cases_file(state_dir, snapped=False):
+    '''
+    Returns the path of the case matrix in a state directory.
+    '''
+    return os.path.join(state_dir, generate_full_data.SNAPPED_CASES_FILE
+                        if snapped else generate_full_data.NEW_CASES_FILE)
+
+def location_key(city=None, province=None, country=None):
+    '''
+    Returns the most specific level given, and the key of the location there.
+    '''
+    if city is not None and (province is None or country is None):
+        raise QueryError("Cities need a province (possibly empty) and a country")
+    if province is not None and country is None:
+        raise QueryError("Provinces need a country")
+    if city is not None:
+        return 'city', (city, province, country)
+    if province is not None:
+        return 'province', (province, country)
+    return 'country', (country,)
+
+def normalize_date(date):
+    return date.replace('.', '-') if date else date
+
+def group_rows(keys):
+    '''
+    Returns a dictionary from each key to the sorted array of positions it
+    is at, leaving out missing keys.
+    '''
+    codes, names = pd.factorize(pd.Series(keys, dtype=object))
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+    return {name: order[bounds[i]:bounds[i + 1]] for i, name in enumerate(names)}
+
+
+class CaseMatrix(object):
+    '''
+    New cases by location and by date, indexed for queries.
+    Attributes:
+    :dates: -> np.ndarray, dates (YYYY-MM-DD) in order.
+    :geoids: -> pd.Index, locations.
+    :new: -> np.ndarray, geoid x date new cases.
+    :groups: -> dict, for each level, from location key to rows of 'new'.
+    :sums: -> dict, for each summed level, from location key to its new cases.
+    :overall: -> np.ndarray, new cases everywhere.
+    '''
+
+    def __init__(self, new_cases, location_info):
+        self.dates = np.array([normalize_date(d) for d in new_cases.index])
+        self.geoids = pd.Index(new_cases.columns)
+        # Geoid-major, so that the dates of a location are contiguous.
+        self.new = np.ascontiguousarray(new_cases.values.T, dtype=np.int64)
+        self.groups = {}
+        self.sums = {}
+        for level, fields in LEVEL_FIELDS.items():
+            self.groups[level] = group_rows(
+                [tuple(location_info[g][i] for i in fields)
+                 if g in location_info else None for g in self.geoids])
+        for level in SUMMED_LEVELS:
+            self.sums[level] = {key: self.new[rows].sum(axis=0)
+                                for key, rows in self.groups[level].items()}
+        self.overall = self.new.sum(axis=0)
+        self.location_series = functools.lru_cache(maxsize=CACHE_SIZE)(
+            self.compute_location_series)
+
+    def compute_location_series(self, geoid=None, city=None, province=None,
+                                country=None):
+        '''
+        Returns read-only arrays of new and total cases for all dates, for
+        a geoid or a location.
+        '''
+        if geoid is not None:
+            if (city, province, country) != (None, None, None):
+                raise QueryError("Please give either a geoid or a location")
+            if geoid not in self.geoids:
+                raise QueryError("Unknown location '" + geoid + "'")
+            new = self.new[self.geoids.get_loc(geoid)]
+        elif (city, province, country) == (None, None, None):
+            new = self.overall
+        else:
+            level, key = location_key(city, province, country)
+            if key not in self.groups[level]:
+                raise QueryError("Unknown " + level + " '" + ",".join(key) + "'")
+            if level in self.sums:
+                new = self.sums[level][key]
+            else:
+                new = self.new[self.groups[level][key]].sum(axis=0)
+        new = new.copy()
+        total = np.cumsum(new)
+        new.flags.writeable = False
+        total.flags.writeable = False
+        return new, total
+
+    def series(self, geoid=None, city=None, province=None, country=None,
+               start=None, end=None):
+        '''
+        Returns {"dates": [...], "new": [...], "total": [...]} for a geoid or
+        a location (see location_key()), or everywhere, between 'start' and
+        'end' (YYYY-MM-DD, both included). Totals count cases from before
+        'start' too.
+        '''
+        new, total = self.location_series(geoid, city, province, country)
+        first, last = 0, len(self.dates)
+        if start:
+            first = np.searchsorted(self.dates, normalize_date(start), 'left')
+        if end:
+            last = np.searchsorted(self.dates, normalize_date(end), 'right')
+        return {"dates": self.dates[first:last].tolist(),
+                "new": new[first:last].tolist(),
+                "total": total[first:last].tolist()}
+
+
+def load(state_dir, location_info_file, snapped=False):
+    path = cases_file(state_dir, snapped)
+    if not os.path.exists(path):
+        raise QueryError("I can't find a case matrix in '" + state_dir + "', "
+                         "please run generate_full_data.py with --state_dir")
+    new_cases, _ = generate_full_data.load_pickle(path)
+    return CaseMatrix(new_cases, functions.read_location_info(location_info_file))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/series':
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        query = {key: values[-1] for key, values in
+                 urllib.parse.parse_qs(url.query, keep_blank_values=True).items()}
+        unknown = set(query) - set(['geoid', 'start', 'end'] + LEVELS)
+        if unknown:
+            self.send_json(HTTPStatus.BAD_REQUEST, {
+                "error": "Unknown parameters: " + ", ".join(sorted(unknown))})
+            return
+        try:
+            self.send_json(HTTPStatus.OK, self.server.matrix.series(**query))
+        except QueryError as e:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": str(e)})
+
+    def send_json(self, status, content):
+        body = json.dumps(content, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        if not self.server.quiet:
+            super().log_message(*args)
+
+
+def make_server(matrix, port=8001, bind='', quiet=False):
+    '''
+    Returns a server answering queries on the given CaseMatrix, that
+    serve_forever() starts.
+    '''
+    server = ThreadingHTTPServer((bind, port), QueryHandler)
+    server.daemon_threads = True
+    server.matrix = matrix
+    server.quiet = quiet
+    return server
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    try:
+        matrix = load(args.state_dir, args.location_info, args.snapped)
+    except QueryError as e:
+        print(e)
+        sys.exit(1)
+    if args.serve:
+        server = make_server(matrix, args.serve)
+        print('Answering queries on http://localhost:' + str(args.serve) +
+              '/series')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('Shutting down...')
+        finally:
+            server.server_close()
+        sys.exit(0)
+    try:
+        print(json.dumps(matrix.series(args.geoid, args.city, args.province,
+                                       args.country, args.start, args.end)))
+    except QueryError as e:
+        print(e)
+        sys.exit(1)
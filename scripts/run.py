@@ -1,6 +1,7 @@
 import data_util
 import os
 import shlex
+import static_server
 import subprocess
 import sys
 import threading
@@ -14,8 +15,7 @@ def run_sass_precompiler():
 
 
 def run_http_server():
-    # Uses port 8000 by default.
-    return subprocess.call(shlex.split("python3 -m http.server"))
+    static_server.serve(".", port=8000)
 
 
 def run():
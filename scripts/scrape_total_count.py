@@ -5,8 +5,9 @@ import sys
 from bs4 import BeautifulSoup
 from datetime import datetime
 
-# Returns whether the operation was successful
-def scrape_total_count(out_path):
+# Returns the total case count from the published sheet, as a string, or None
+# if we weren't able to find it.
+def fetch_total_count():
 
     url = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vR30F8lYP3jG7YOq8es0PBpJIE5yvRVZffOyaqC0GgMBN6yt0Q-NI8pxS7hd1F9dYXnowSC6zpZmW9D/pubhtml/sheet?headers=false&gid=0&range=A1:I183'
     fp = urllib.request.urlopen(url)
@@ -17,9 +18,15 @@ def scrape_total_count(out_path):
 
     soup = BeautifulSoup(html, 'html.parser')
     try:
-      count = soup.select_one('tbody tr:nth-of-type(5) td:nth-of-type(1)').text
+      return soup.select_one('tbody tr:nth-of-type(5) td:nth-of-type(1)').text
     except NotImplementedError as e:
       print("I wasn't able to scrape the number I wanted: " + str(e))
+      return None
+
+# Returns whether the operation was successful
+def scrape_total_count(out_path):
+    count = fetch_total_count()
+    if count is None:
       return False
 
     date  = datetime.now().strftime('%Y-%m-%d')
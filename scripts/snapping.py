@@ -0,0 +1,168 @@
+'''
+Merges geoids that are only a few meters apart and have the same location
+info (city, province and country), which happens when the same place is
+entered with slightly different coordinates.
+
+Geoids are bucketed on a grid whose cells are as large as the snapping
+distance, so that only geoids in neighboring cells (and with the same
+location info) get compared. Pairs that are close enough are joined with a
+union-find, and each resulting cluster is rewritten to its geoid with the
+most cases.
+'''
+
+import functions
+import location_index
+import numpy as np
+import pandas as pd
+import spatial_index
+
+EARTH_RADIUS_METERS = 6371000.0
+
+# Half of the neighboring cells (along with the cell itself), so that each
+# pair of cells is only looked at once.
+NEIGHBOR_OFFSETS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def distances_meters(lat1, lng1, lat2, lng2):
+    '''
+    Returns great-circle distances between arrays of coordinates.
+    '''
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def close_pairs(lat, lng, groups, distance):
+    '''
+    Returns arrays (i, j) of the indices of points that are in the same group
+    and at most 'distance' meters apart, with i < j.
+    '''
+    # Roughly meters, which is accurate enough for bucketing nearby points.
+    y = np.radians(lat) * EARTH_RADIUS_METERS
+    x = np.radians(lng) * np.cos(np.radians(lat)) * EARTH_RADIUS_METERS
+    cells = pd.DataFrame({"group": groups,
+                          "cx": np.floor(x / distance).astype(np.int64),
+                          "cy": np.floor(y / distance).astype(np.int64),
+                          "point": np.arange(len(lat))})
+
+    found_i, found_j = [], []
+    for dx, dy in NEIGHBOR_OFFSETS:
+        shifted = cells.assign(cx=cells.cx + dx, cy=cells.cy + dy)
+        pairs = cells.merge(shifted, on=["group", "cx", "cy"],
+                            suffixes=("_a", "_b"))
+        i, j = pairs.point_a.values, pairs.point_b.values
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        found_i.append(i)
+        found_j.append(j)
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    close = distances_meters(lat[i], lng[i], lat[j], lng[j]) <= distance
+    i, j = i[close], j[close]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def find_root(parents, x):
+    while parents[x] != x:
+        # Path halving.
+        parents[x] = parents[parents[x]]
+        x = parents[x]
+    return x
+
+
+def clusters(n, i, j):
+    '''
+    Returns an array with the cluster of each of 'n' points, where points i
+    and j are joined for each of the given pairs.
+    '''
+    parents = list(range(n))
+    for a, b in zip(i.tolist(), j.tolist()):
+        root_a = find_root(parents, a)
+        root_b = find_root(parents, b)
+        if root_a != root_b:
+            parents[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find_root(parents, x) for x in range(n)], dtype=np.int64)
+
+
+def snap_geoids(geoids, location_info, distance, weights=None):
+    '''
+    Returns a Series from each of the given geoids to the geoid it snaps to
+    (itself for most of them). Geoids snap together when they are at most
+    'distance' meters apart, possibly through other geoids, and have the
+    same location info. Each cluster snaps to its geoid with the largest
+    weight (e.g. number of cases), or the first one in sorted order.
+    '''
+    geoids = pd.Index(geoids)
+    known = np.array([g in location_info for g in geoids], dtype=bool)
+    result = pd.Series(geoids, index=geoids)
+    if known.sum() < 2:
+        return result
+
+    candidates = geoids[known]
+    lat, lng = spatial_index.split_geoids(candidates)
+    groups, _ = pd.factorize(pd.Index(
+        [",".join(location_info[g]) for g in candidates]))
+    i, j = close_pairs(lat, lng, groups, distance)
+    cluster = clusters(len(candidates), i, j)
+
+    frame = pd.DataFrame({"cluster": cluster, "geoid": candidates})
+    frame["weight"] = (weights.reindex(candidates).fillna(0).values
+                       if weights is not None else 0)
+    # The first geoid of each cluster, by decreasing weight then by name.
+    canonical = frame.sort_values(["weight", "geoid"], ascending=[False, True],
+                                  kind="mergesort").drop_duplicates("cluster")
+    canonical = canonical.set_index("cluster").geoid
+    result[candidates] = canonical.reindex(cluster).values
+    return result
+
+
+def snap_new_cases(new_cases, snapped):
+    '''
+    Sums the columns of a date x geoid matrix of new cases that snap to the
+    same geoid.
+    '''
+    result = new_cases.T.groupby(snapped.reindex(new_cases.columns).values).sum().T
+    result = result.sort_index(axis=1)
+    result.columns.name = new_cases.columns.name
+    result.index.name = new_cases.index.name
+    return result
+
+
+def write_snapped_location_info(in_file, out_file, snapped):
+    '''
+    Copies a location info file, without the geoids that snap to another
+    one, and indexes the result.
+    '''
+    with open(in_file) as f:
+        lines = f.read().strip().split("\n")
+        f.close()
+    kept = []
+    for line in lines:
+        geoid = line.split(":", 1)[0]
+        if snapped.get(geoid, geoid) == geoid:
+            kept.append(line)
+    with open(out_file, "w") as f:
+        f.write("\n".join(kept))
+        f.close()
+    location_index.build_index(out_file)
+
+
+def snap(new_cases, in_location_info_file, out_location_info_file, distance,
+         quiet=False):
+    '''
+    Snaps the geoids of a date x geoid matrix of new cases that are at most
+    'distance' meters apart and have the same location info. Returns the
+    resulting matrix, and writes the location info of the remaining geoids.
+    '''
+    location_info = functions.read_location_info(in_location_info_file)
+    snapped = snap_geoids(new_cases.columns, location_info, distance,
+                          weights=new_cases.sum())
+    result = snap_new_cases(new_cases, snapped)
+    write_snapped_location_info(in_location_info_file, out_location_info_file,
+                                snapped)
+    if not quiet:
+        print("Snapped " + str(len(new_cases.columns)) + " locations to " +
+              str(len(result.columns)) + " within " + str(distance) + " meters")
+    return result
@@ -0,0 +1,135 @@
+'''
+Buckets geoids into map tiles at several zoom levels, so that slices can be
+pre-aggregated for coarse views of the map.
+
+Tiles use the same "slippy map" scheme as the map client (Web Mercator,
+2^zoom x 2^zoom tiles), and are identified by 'zoom/x/y' keys.
+'''
+
+import functions
+import numpy as np
+import pandas as pd
+
+DEFAULT_ZOOM_LEVELS = [2, 4, 6]
+
+# Web Mercator is undefined at the poles.
+MAX_LATITUDE = 85.0511
+
+
+def level_dir_name(zoom):
+    return "z" + str(zoom)
+
+
+def split_geoids(geoids):
+    '''
+    Returns arrays of latitudes and longitudes for the given 'lat|long'
+    geoids.
+    '''
+    parts = pd.Series(geoids, dtype=object).str.split("|", expand=True)
+    return parts[0].astype(float).values, parts[1].astype(float).values
+
+
+def mercator_coordinates(lat, lng, zoom):
+    '''
+    Returns the x and y positions of arrays of coordinates, in tiles (the
+    integer part is the tile number, the rest the position in the tile).
+    '''
+    n = 2 ** zoom
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lng) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n
+    return x, y
+
+
+def tile_coordinates(lat, lng, zoom):
+    '''
+    Returns the x and y tile numbers for arrays of coordinates.
+    '''
+    n = 2 ** zoom
+    x, y = mercator_coordinates(lat, lng, zoom)
+    return (np.clip(np.floor(x), 0, n - 1).astype(int),
+            np.clip(np.floor(y), 0, n - 1).astype(int))
+
+
+def build_tile_index(geoids, zoom_levels):
+    '''
+    Returns a DataFrame indexed by geoid, with one column of tile keys per
+    zoom level.
+    '''
+    lat, lng = split_geoids(geoids)
+    index = pd.DataFrame(index=pd.Index(geoids, name="geoid"))
+    index["latitude"] = lat
+    index["longitude"] = lng
+    for zoom in zoom_levels:
+        x, y = tile_coordinates(lat, lng, zoom)
+        index[zoom] = (str(zoom) + "/" + pd.Series(x).astype(str) + "/" +
+                       pd.Series(y).astype(str)).values
+    return index
+
+
+def tile_centers(keys):
+    '''
+    Returns a Series from each of the given tile keys to the geoid of the
+    tile's geometric center, which stands for the tile in slices. It only
+    depends on the tile, so it stays the same from one run to the next.
+    '''
+    keys = pd.Index(keys)
+    parts = pd.Series(keys, dtype=object).str.split("/", expand=True).astype(int)
+    n = 2.0 ** parts[0].values
+    x = parts[1].values + 0.5
+    y = parts[2].values + 0.5
+    lng = x / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * y / n))))
+    return pd.Series([functions.latlong_to_geo_id(a, b)
+                      for a, b in zip(lat, lng)], index=keys, dtype=object)
+
+
+def tile_location_info(location_info, zoom_levels):
+    '''
+    Returns location info for the centers of the tiles that the geoids of
+    'location_info' fall in, at each zoom level. Tiles only get a country,
+    when all of their locations are in the same one.
+    '''
+    geoids = list(location_info.keys())
+    if not geoids:
+        return {}
+    tile_index = build_tile_index(geoids, zoom_levels)
+    countries = pd.Series([location_info[g][-1] for g in geoids],
+                          index=tile_index.index)
+    result = {}
+    for zoom in zoom_levels:
+        by_tile = countries.groupby(tile_index[zoom].values)
+        single = by_tile.nunique() == 1
+        country = by_tile.first().where(single, "")
+        for key, geoid in tile_centers(country.index).items():
+            result[geoid] = ["", "", country[key]]
+    return result
+
+
+def write_tile_location_info(in_files, out_file, zoom_levels):
+    '''
+    Writes the location info of tile centers for the locations of the given
+    location info files.
+    '''
+    location_info = {}
+    for in_file in in_files:
+        location_info.update(functions.read_location_info(in_file))
+    tiles = tile_location_info(location_info, zoom_levels)
+    with open(out_file, "w") as f:
+        f.write("\n".join(geoid + ":" + ",".join(tiles[geoid])
+                          for geoid in sorted(tiles)))
+        f.close()
+
+
+def aggregate_by_tile(new_cases, tile_index, zoom):
+    '''
+    Sums a date x geoid matrix of new cases over the tiles at the given zoom
+    level. Columns of the result are the geoids of the tiles' centers, so it
+    can be turned into slices like the original matrix.
+    '''
+    keys = tile_index[zoom].reindex(new_cases.columns)
+    aggregated = new_cases.T.groupby(keys.values).sum().T
+    aggregated.columns = tile_centers(aggregated.columns).values
+    aggregated = aggregated.sort_index(axis=1)
+    aggregated.index.name = new_cases.index.name
+    return aggregated
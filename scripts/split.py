@@ -3,7 +3,6 @@ import functions
 import os
 import sys
 
-TEMP_JSON = "temp.json"
 TOPLEVEL_KEY = "data"
 
 # Geo properties that the client doesn't use and that we can prune out.
@@ -31,51 +30,42 @@ def process_feature(feature):
         del feature["properties"][prop]
   return feature
 
-def split_by_day(data, out_dir):
-  # A dictionary from each date to a list of corresponding features
-  daily_splits = {}
-  if "features" in data:
-    for feature in data["features"]:
-      if "properties" in feature and "date" in feature["properties"]:
-        iso_date = feature["properties"]["date"]
-        date = normalize_date(iso_date)
-        # Remove the date from each feature and place it only once at the top-level.
-        feature = process_feature(feature)
-        if date in daily_splits:
-          daily_splits[date]["features"].append(feature)
-        else:
-          daily_splits[date] = {"date": iso_date, "features": [feature]}
-      else:
-        print("Warning: unexpected object '" + str(feature) + "'")
-  else:
-    print("I was expecting to find a '" + TOPLEVEL_KEY + "' key in the data")
-
-  dates = sorted(list(daily_splits.keys()))
-  print("Date range: " + str(dates[0]) + " to " + dates[-1])
-  for i in range(len(dates)):
-    date = dates[i]
-    daily_slice_file_path = os.path.join(out_dir, ("latest" if i == len(dates) - 1 else date) + ".json")
-    if os.path.exists(daily_slice_file_path):
-      print("I will not clobber '" + daily_slice_file_path + "', "
-            "please delete it first")
-      continue
-    with open(daily_slice_file_path, "w") as f:
-      f.write(json.dumps(daily_splits[date]))
-      f.close()
+def write_daily_slices(days, out_dir):
+  '''
+  Writes each (iso date, features) tuple from the given iterable to its own
+  file as soon as the next date comes in. The last date is written as
+  'latest'.
+  '''
+  previous = None
+  first_date = None
+  for iso_date, features in days:
+    if previous is not None:
+      write_daily_slice(previous[0], previous[1], normalize_date(previous[0]), out_dir)
+    else:
+      first_date = normalize_date(iso_date)
+    previous = (iso_date, [process_feature(f) for f in features])
+  if previous is None:
+    print("I didn't find any data to split")
+    return
+  write_daily_slice(previous[0], previous[1], "latest", out_dir)
+  print("Date range: " + first_date + " to " + normalize_date(previous[0]))
 
-def convert_to_client_format(file_path):
-  functions.animation_formating_geo(file_path, TEMP_JSON)
+def write_daily_slice(iso_date, features, name, out_dir):
+  daily_slice_file_path = os.path.join(out_dir, name + ".json")
+  if os.path.exists(daily_slice_file_path):
+    print("I will not clobber '" + daily_slice_file_path + "', "
+          "please delete it first")
+    return
+  with open(daily_slice_file_path, "w") as f:
+    f.write(json.dumps({"date": iso_date, "features": features}))
+    f.close()
 
 def split_full_data_to_daily_slices(full_data_file_path, out_dir):
-  # TODO: Support passinng data directly instead of writing to and
-  # re-reading from disk.
-  print("Converting to format for sending to the browser...")
-  convert_to_client_format(full_data_file_path)
-  print("Splitting...")
-  with open(TEMP_JSON) as f:
-    split_by_day(json.loads(f.read()), out_dir)
-    f.close()
-  os.remove(TEMP_JSON)
+  # Records are read one by one and only their counts by date and location
+  # are kept, then days are written out one at a time.
+  print("Converting to format for sending to the browser and splitting...")
+  records = functions.iter_json_array(full_data_file_path, TOPLEVEL_KEY)
+  write_daily_slices(functions.iter_daily_features(records), out_dir)
 
 def main():
   if sys.version_info[0] < 3:
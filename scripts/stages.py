@@ -0,0 +1,253 @@
+'''
+A small engine to run a pipeline as a graph of named stages.
+
+Each stage declares the files it reads (inputs) and writes (outputs), as
+paths or glob patterns. A stage depends on the stages that write its inputs.
+When a state file is given, we remember a fingerprint of each stage's inputs
+and parameters, as well as of its outputs, after it completes. On the next
+run a stage is skipped if neither changed, so a failed run picks up where it
+stopped and unchanged stages don't run again.
+
+Independent stages run concurrently, on threads. Stages that start their own
+worker processes should be marked 'exclusive' so that we don't fork while
+other stages are running.
+'''
+
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Reads files in blocks of this size when fingerprinting them.
+BLOCK_SIZE = 1 << 20
+
+
+def expand(path):
+    '''
+    Returns the sorted files matching a path or a glob pattern.
+    '''
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path] if os.path.exists(path) else []
+
+
+def fingerprint(path):
+    '''
+    Returns a digest of the content of the files matching a path (or glob
+    pattern), or None if there are none.
+    '''
+    files = expand(path)
+    if not files:
+        return None
+    digest = hashlib.sha1()
+    for name in files:
+        digest.update(name.encode("utf-8") + b"\0")
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class Stage(object):
+    '''
+    A step of a pipeline.
+    Attributes:
+    :name: -> str, unique name of the stage.
+    :func: -> callable, runs the stage (no arguments).
+    :inputs: -> list, paths or glob patterns the stage reads.
+    :outputs: -> list, paths or glob patterns the stage writes.
+    :params: -> dict, anything else the outputs depend on (JSON-serializable).
+    :always: -> bool, run even if nothing changed (e.g. for downloads).
+    :exclusive: -> bool, don't run concurrently with other stages.
+    '''
+
+    def __init__(self, name, func, inputs=None, outputs=None, params=None,
+                 always=False, exclusive=False):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.params = params or {}
+        self.always = always
+        self.exclusive = exclusive
+
+    def key(self):
+        '''
+        Returns a fingerprint of the stage's inputs and parameters.
+        '''
+        inputs = {path: fingerprint(path) for path in self.inputs}
+        description = json.dumps([self.name, self.params, inputs],
+                                 sort_keys=True, default=str)
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def output_fingerprints(self):
+        return {path: fingerprint(path) for path in self.outputs}
+
+
+class Pipeline(object):
+    '''
+    Runs stages in dependency order, skipping the ones that are up to date
+    according to 'state_file' (when given, everything runs otherwise).
+    '''
+
+    def __init__(self, stages, state_file=None, quiet=False, max_workers=4):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError("Duplicate stage '" + stage.name + "'")
+            self.stages[stage.name] = stage
+        self.order = [stage.name for stage in stages]
+        self.state_file = state_file
+        self.quiet = quiet
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+        # How long each stage that ran during the last run() took.
+        self.timings = {}
+
+        # A stage depends on those that write one of its inputs.
+        writers = {}
+        for stage in stages:
+            for path in stage.outputs:
+                writers[path] = stage.name
+        self.dependencies = {}
+        for stage in stages:
+            self.dependencies[stage.name] = sorted(set(
+                writers[path] for path in stage.inputs if path in writers))
+
+    def load_state(self):
+        if self.state_file and os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        # Write to a temporary file first, so that a crash can't leave us
+        # with a truncated state file.
+        temp_path = self.state_file + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.state_file)
+
+    def stale_reason(self, name):
+        '''
+        Returns why the given stage needs to run, or None if it's up to date.
+        '''
+        stage = self.stages[name]
+        if not self.state_file:
+            return "no state is kept"
+        if stage.always:
+            return "always runs"
+        previous = self.state.get(name)
+        if previous is None:
+            return "never completed"
+        if previous["key"] != stage.key():
+            return "inputs or parameters changed"
+        if previous["outputs"] != stage.output_fingerprints():
+            return "outputs are missing or were modified"
+        return None
+
+    def status(self):
+        '''
+        Returns (stage name, reason) pairs in order, where the reason is why
+        the stage would run, or None if it would be skipped. Stages after one
+        that would run are reported as such, since their inputs may change.
+        '''
+        result = []
+        rerun = set()
+        for name in self.order:
+            reason = self.stale_reason(name)
+            upstream = [d for d in self.dependencies[name] if d in rerun]
+            if reason is None and upstream:
+                reason = "may change after '" + "', '".join(upstream) + "'"
+            if reason is not None:
+                rerun.add(name)
+            result.append((name, reason))
+        return result
+
+    def run_stage(self, name, force=False):
+        '''
+        Runs a single stage if it needs to, and records it as completed.
+        Returns whether it ran.
+        '''
+        stage = self.stages[name]
+        reason = "forced" if force else self.stale_reason(name)
+        if reason is None:
+            if not self.quiet:
+                print("Stage '" + name + "' is up to date, skipping")
+            return False
+
+        for path in stage.inputs:
+            if not expand(path):
+                raise ValueError("Stage '" + name + "' needs '" + path + "', "
+                                 "please run the stages that write it first")
+        key = stage.key()
+        if not self.quiet:
+            print("Running stage '" + name + "' (" + reason + ")...")
+        t0 = time.time()
+        stage.func()
+        seconds = round(time.time() - t0, 2)
+        if not self.quiet:
+            print("Stage '" + name + "' done in " + str(seconds) + " seconds")
+
+        with self.lock:
+            self.timings[name] = seconds
+            self.state[name] = {"key": key,
+                                "outputs": stage.output_fingerprints()}
+            self.save_state()
+        return True
+
+    def run(self, only=None, force=False):
+        '''
+        Runs the whole pipeline, or just the stages in 'only' (without their
+        dependencies, whose outputs must be there already). With 'force',
+        stages run even if they are up to date. Returns how long each stage
+        that ran took, in seconds.
+        '''
+        self.timings = {}
+        if only:
+            for name in only:
+                if name not in self.stages:
+                    raise ValueError("I don't know about stage '" + name + "'")
+            for name in [n for n in self.order if n in only]:
+                self.run_stage(name, force=force)
+            return dict(self.timings)
+
+        pending = list(self.order)
+        done = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                exclusive_running = any(self.stages[n].exclusive for n in running.values())
+                for name in list(pending):
+                    if exclusive_running:
+                        break
+                    if not all(d in done for d in self.dependencies[name]):
+                        continue
+                    if self.stages[name].exclusive and running:
+                        continue
+                    pending.remove(name)
+                    running[executor.submit(self.run_stage, name, force)] = name
+                    if self.stages[name].exclusive:
+                        break
+
+                if not running:
+                    raise ValueError("Stages " + ", ".join(pending) + " have "
+                                     "dependencies that can't be satisfied")
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        # Let the other stages finish so that their state is
+                        # recorded, but don't start new ones.
+                        pending = []
+                        wait(list(running))
+                        future.result()
+                    done.add(name)
+        return dict(self.timings)
@@ -0,0 +1,217 @@
+'''
+A static file server for local development, that behaves like the production
+setup rather than like 'python3 -m http.server':
+
+- requests are handled on several threads, over keep-alive connections,
+- precompressed siblings of files ('.br', '.gz') are served as is to clients
+  that accept them,
+- responses carry an ETag and a Last-Modified date, and conditional requests
+  (If-None-Match, If-Modified-Since) get a 304 when nothing changed,
+- daily slices named after their content are cached for good, while
+  everything else (including 'latest.json' and the manifest) has to be
+  revalidated.
+'''
+
+import argparse
+import email.utils
+import functools
+import os
+import re
+import sys
+import urllib.parse
+
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Content encodings we have precompressed siblings for, by order of
+# preference.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Slices for past days are named after a hash of their content, so a given
+# name always has the same content, unlike 'latest.json'.
+IMMUTABLE_PATTERN = re.compile(
+    r'(^|/)dailies/([a-z0-9]+/)?\d{4}\.\d{2}\.\d{2}\.[0-9a-f]+\.json$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'no-cache'
+
+parser = argparse.ArgumentParser(
+    description='Serve a directory the way it is served in production')
+
+parser.add_argument('-d', '--directory', type=str, default='.',
+        help='directory to serve')
+
+parser.add_argument('-p', '--port', type=int, default=8000,
+        help='port to listen on')
+
+
+def accepted_encodings(header):
+    '''
+    Returns the content encodings a client accepts, from its Accept-Encoding
+    header.
+    '''
+    accepted = set()
+    for part in (header or '').split(','):
+        fields = part.split(';')
+        name = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0
+        if name and quality > 0:
+            accepted.add(name)
+    return accepted
+
+def cache_control(url_path):
+    if IMMUTABLE_PATTERN.search(url_path):
+        return IMMUTABLE_CACHE_CONTROL
+    return DEFAULT_CACHE_CONTROL
+
+def make_etag(stat):
+    # Each variant of a file is a different file, with its own ETag.
+    return '"' + format(stat.st_mtime_ns, 'x') + '-' + format(stat.st_size, 'x') + '"'
+
+def etag_matches(header, etag):
+    '''
+    Returns whether an If-None-Match header matches the given ETag, using
+    weak comparison.
+    '''
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.replace('W/', '', 1) == etag:
+            return True
+    return False
+
+
+class StaticHandler(SimpleHTTPRequestHandler):
+    # Keep connections open, the client fetches hundreds of files in a row.
+    protocol_version = 'HTTP/1.1'
+
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map,
+                          **{'.pbf': 'application/x-protobuf'})
+
+    def variants(self, path):
+        '''
+        Returns the (encoding, path) pairs of precompressed siblings of a
+        file, leaving out those older than the file itself.
+        '''
+        mtime = os.path.getmtime(path)
+        result = []
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix) and os.path.getmtime(path + suffix) >= mtime:
+                result.append((encoding, path + suffix))
+        return result
+
+    def not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Takes precedence over If-Modified-Since.
+            return etag_matches(if_none_match, etag)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        if since is None or since.tzinfo is None:
+            return False
+        return int(mtime) <= since.timestamp()
+
+    def send_head(self):
+        url_path = urllib.parse.urlsplit(self.path).path
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and url_path.endswith('/'):
+            index = os.path.join(path, 'index.html')
+            if os.path.isfile(index):
+                path = index
+        # Directory listings, redirects and errors work as usual.
+        if not os.path.isfile(path) or path.endswith('/'):
+            return super().send_head()
+
+        variants = self.variants(path)
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        encoding, served = None, path
+        for candidate, candidate_path in variants:
+            if candidate in accepted or '*' in accepted:
+                encoding, served = candidate, candidate_path
+                break
+        try:
+            f = open(served, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+
+        try:
+            stat = os.fstat(f.fileno())
+            etag = make_etag(stat)
+            if self.not_modified(etag, stat.st_mtime):
+                f.close()
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_cache_headers(etag, stat, url_path, variants)
+                self.end_headers()
+                return None
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Length', str(stat.st_size))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_cache_headers(etag, stat, url_path, variants)
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
+
+    def send_cache_headers(self, etag, stat, url_path, variants):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+        self.send_header('Cache-Control', cache_control(url_path))
+        if variants:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def copyfile(self, source, outputfile):
+        # Let the kernel copy the file to the socket when it can, headers
+        # were already written since the output isn't buffered.
+        self.connection.sendfile(source)
+
+    def log_message(self, *args):
+        if not self.server.quiet:
+            super().log_message(*args)
+
+
+def make_server(directory, port=8000, bind='', quiet=False):
+    '''
+    Returns a server for the given directory, that serve_forever() starts.
+    With 'quiet', requests aren't logged.
+    '''
+    handler = functools.partial(StaticHandler, directory=directory)
+    server = ThreadingHTTPServer((bind, port), handler)
+    server.daemon_threads = True
+    server.quiet = quiet
+    return server
+
+def serve(directory, port=8000, bind=''):
+    server = make_server(directory, port, bind)
+    print('Serving ' + os.path.abspath(directory) + ' on http://localhost:' +
+          str(server.server_address[1]) + '/')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if not os.path.isdir(args.directory):
+        print('I can\'t find directory \'' + args.directory + '\'')
+        sys.exit(1)
+    try:
+        serve(args.directory, args.port)
+    except KeyboardInterrupt:
+        print('Shutting down...')
+        sys.exit(0)
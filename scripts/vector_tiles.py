@@ -0,0 +1,228 @@
+'''
+Writes the daily counts as Mapbox Vector Tiles, so that a map only needs to
+load the tiles it shows rather than every location of every day.
+
+Tiles are laid out as 'tiles/<date>/<zoom>/<x>/<y>.pbf' under the dailies
+directory, along with an index of the dates and zoom levels there are tiles
+for. Each tile has one layer of points with the 'geoid', 'new' and 'total'
+properties of slices. Points that are too close to tell apart at a zoom
+level are merged, keeping the geoid and position of the one with the most
+cases.
+
+The encoder only covers what we need from the vector tile format (point
+features with string and integer properties), see
+https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+'''
+
+import json
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import spatial_index
+
+TILES_DIR = "tiles"
+INDEX_FILE = "index.json"
+
+LAYER_NAME = "cases"
+LAYER_VERSION = 2
+# Size of a tile in its own coordinates.
+EXTENT = 4096
+# Points in the same cell of this size (in tile coordinates) are merged, that
+# is about 2 pixels on a 512 pixel tile.
+MERGE_CELL = 16
+
+KEYS = ["geoid", "new", "total"]
+
+# Protocol buffer wire types.
+VARINT = 0
+LENGTH_DELIMITED = 2
+
+# Geometry command to move to a point, repeated once.
+MOVE_TO_ONCE = (1 & 0x7) | (1 << 3)
+POINT = 1
+
+# Positions of every geoid at every zoom level, set in each worker process.
+positions = None
+
+
+def varint(value):
+    '''
+    Encodes a non-negative integer as a protocol buffer varint.
+    '''
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, wire_type):
+    return varint((number << 3) | wire_type)
+
+
+def length_delimited(number, payload):
+    return field(number, LENGTH_DELIMITED) + varint(len(payload)) + payload
+
+
+def packed(number, values):
+    return length_delimited(number, b"".join(varint(v) for v in values))
+
+
+def encode_value(value):
+    if isinstance(value, str):
+        return length_delimited(1, value.encode("utf-8"))
+    if value < 0:
+        # sint_value
+        return field(6, VARINT) + varint(zigzag(value))
+    # uint_value
+    return field(5, VARINT) + varint(value)
+
+
+def encode_layer(points, name=LAYER_NAME, extent=EXTENT):
+    '''
+    Encodes a layer of (x, y, geoid, new, total) points, with x and y in tile
+    coordinates. Like in slices, 'new' is left out when it's 0.
+    '''
+    values = {}
+
+    def value_index(value):
+        if value not in values:
+            values[value] = len(values)
+        return values[value]
+
+    features = []
+    for x, y, geoid, new, total in points:
+        tags = [0, value_index(geoid)]
+        if new != 0:
+            tags += [1, value_index(new)]
+        tags += [2, value_index(total)]
+        features.append(length_delimited(2,
+            packed(2, tags) +
+            field(3, VARINT) + varint(POINT) +
+            packed(4, [MOVE_TO_ONCE, zigzag(x), zigzag(y)])))
+
+    return (field(15, VARINT) + varint(LAYER_VERSION) +
+            length_delimited(1, name.encode("utf-8")) +
+            b"".join(features) +
+            b"".join(length_delimited(3, k.encode("utf-8")) for k in KEYS) +
+            b"".join(length_delimited(4, encode_value(v)) for v in values) +
+            field(5, VARINT) + varint(extent))
+
+
+def encode_tile(layers):
+    '''
+    Encodes a tile out of encoded layers.
+    '''
+    return b"".join(length_delimited(3, layer) for layer in layers)
+
+
+def geoid_positions(geoids, zoom_levels):
+    '''
+    Returns, for each zoom level, a DataFrame indexed by geoid with the tile
+    each geoid is in and its (integer) position in that tile.
+    '''
+    lat, lng = spatial_index.split_geoids(geoids)
+    result = {}
+    for zoom in zoom_levels:
+        x, y = spatial_index.mercator_coordinates(lat, lng, zoom)
+        tile_x, tile_y = spatial_index.tile_coordinates(lat, lng, zoom)
+        frame = pd.DataFrame(index=pd.Index(geoids, name="geoid"))
+        frame["tile_x"] = tile_x
+        frame["tile_y"] = tile_y
+        frame["x"] = np.clip(np.floor((x - tile_x) * EXTENT), 0, EXTENT - 1).astype(int)
+        frame["y"] = np.clip(np.floor((y - tile_y) * EXTENT), 0, EXTENT - 1).astype(int)
+        result[zoom] = frame
+    return result
+
+
+def merged_points(frame):
+    '''
+    Merges the points of a DataFrame of positions and counts that fall in
+    the same cell of the same tile. Returns one row per remaining point.
+    '''
+    frame = frame.assign(cell_x=frame.x // MERGE_CELL, cell_y=frame.y // MERGE_CELL)
+    cell = ["tile_x", "tile_y", "cell_x", "cell_y"]
+    sums = frame.groupby(cell)[["new", "total"]].sum()
+    # The point with the most cases stands for the others.
+    first = frame.sort_values("total", ascending=False, kind="mergesort")
+    first = first.reset_index().drop_duplicates(cell).set_index(cell)
+    first[["new", "total"]] = sums.reindex(first.index).values
+    return first.reset_index()
+
+
+def set_positions(value):
+    global positions
+    positions = value
+
+
+def write_day_tiles(date, new, total, out_dir):
+    '''
+    Writes the tiles for one date, from Series of new and total cases by
+    geoid. Returns how many tiles were written.
+    '''
+    counts = pd.DataFrame({"new": new, "total": total})
+    counts = counts[(counts.new != 0) | (counts.total != 0)]
+    counts.index.name = "geoid"
+    written = 0
+    for zoom, frame in positions.items():
+        points = merged_points(frame.reindex(counts.index).join(counts))
+        for (tile_x, tile_y), tile in points.groupby(["tile_x", "tile_y"]):
+            tile_dir = os.path.join(out_dir, date, str(zoom), str(tile_x))
+            if not os.path.exists(tile_dir):
+                os.makedirs(tile_dir)
+            layer = encode_layer(zip(tile.x.tolist(), tile.y.tolist(),
+                                     tile.geoid.tolist(), tile.new.tolist(),
+                                     tile.total.tolist()))
+            with open(os.path.join(tile_dir, str(tile_y) + ".pbf"), "wb") as f:
+                f.write(encode_tile([layer]))
+            written += 1
+    return written
+
+
+def write_vector_tiles(new_cases, out_dir, zoom_levels, overwrite=False,
+                       quiet=False):
+    '''
+    Writes vector tiles at the given zoom levels for each row of a date x
+    geoid matrix of new cases, in the 'tiles' directory of 'out_dir'.
+    '''
+    tiles_dir = os.path.join(out_dir, TILES_DIR)
+    if os.path.exists(tiles_dir):
+        if not overwrite:
+            print("I will not clobber '" + tiles_dir + "', please delete it first")
+            return
+        shutil.rmtree(tiles_dir)
+    os.makedirs(tiles_dir)
+
+    total_cases = new_cases.cumsum()
+    n_cpus = multiprocessing.cpu_count()
+    if not quiet:
+        print("Writing vector tiles for " + str(len(new_cases)) + " dates "
+              "with " + str(n_cpus) + " processes...")
+    with multiprocessing.Pool(n_cpus, initializer=set_positions,
+            initargs=(geoid_positions(new_cases.columns, zoom_levels),)) as pool:
+        written = pool.starmap(write_day_tiles, [
+            (date, new_cases.iloc[i], total_cases.iloc[i], tiles_dir)
+            for i, date in enumerate(new_cases.index)])
+
+    write_index(tiles_dir, new_cases.index, zoom_levels)
+    if not quiet:
+        print("Wrote " + str(sum(written)) + " tiles")
+
+
+def write_index(tiles_dir, dates, zoom_levels):
+    '''
+    Writes the index of the dates and zoom levels there are tiles for.
+    '''
+    with open(os.path.join(tiles_dir, INDEX_FILE), "w") as f:
+        json.dump({"layer": LAYER_NAME, "extent": EXTENT,
+                   "zoom_levels": list(zoom_levels),
+                   "dates": list(dates),
+                   "url": "{date}/{z}/{x}/{y}.pbf"}, f)
+        f.close()
@@ -0,0 +1,56 @@
+import base_test
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import build_cache
+
+class BuildCacheTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Build cache tests"
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def write_source(self, content):
+        with open(self.path("source.txt"), "w") as f:
+            f.write(content)
+
+    def build(self):
+        # Copies the source to the output, and counts how many times it ran.
+        code = ("import sys; "
+                "open(sys.argv[3], 'a').write('.'); "
+                "open(sys.argv[2], 'w').write(open(sys.argv[1]).read())")
+        build = build_cache.CachedBuild(
+            "copy", [sys.executable, "-c", code, self.path("source.txt"),
+                     self.path("output.txt"), self.path("runs.txt")],
+            inputs=[self.path("source.txt")], outputs=[self.path("output.txt")],
+            cache_dir=self.path("cache"), quiet=True)
+        build.start()
+        self.check(build.wait(), "The build should succeed")
+        with open(self.path("runs.txt")) as f:
+            runs = len(f.read())
+        with open(self.path("output.txt")) as f:
+            return runs, f.read()
+
+    def run(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.write_source("a")
+        self.check(self.build() == (1, "a"), "The first build should run")
+
+        os.remove(self.path("output.txt"))
+        self.check(self.build() == (1, "a"),
+                   "Unchanged sources should restore the cached outputs")
+
+        self.write_source("b")
+        self.check(self.build() == (2, "b"),
+                   "Changed sources should be built again")
+
+        self.write_source("a")
+        self.check(self.build() == (2, "a"),
+                   "Earlier builds should stay cached")
+
+        shutil.rmtree(self.temp_dir)
@@ -0,0 +1,77 @@
+import base_test
+import json
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import check_dailies
+import generate_full_data
+
+class CheckDailiesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Daily slices consistency tests"
+
+    def problems(self):
+        location_info = {"1|1": ["", "", "DE"], "2|2": ["", "", "FR"]}
+        return check_dailies.check(check_dailies.load_dailies(self.temp_dir),
+                                   location_info)
+
+    def slice_path(self, date):
+        names = generate_full_data.read_manifest(self.temp_dir)
+        return os.path.join(self.temp_dir, names[date])
+
+    def run(self):
+        self.temp_dir = tempfile.mkdtemp()
+        new_cases = pd.DataFrame({"1|1": [1, 0, 2, 1], "2|2": [0, 3, 0, 1]},
+            index=["2020.03.01", "2020.03.02", "2020.03.03", "2020.03.04"])
+        generate_full_data.write_slices(new_cases, new_cases.cumsum(),
+            self.temp_dir, "2020-03-04", overwrite=True, quiet=True)
+        self.check(self.problems() == [],
+                   "Generated slices should be consistent")
+
+        with open(self.slice_path("2020-03-02")) as f:
+            s = json.load(f)
+        s["features"][0]["properties"]["total"] = 5
+        with open(self.slice_path("2020-03-02"), "w") as f:
+            json.dump(s, f)
+        problems = self.problems()
+        self.check(len(problems) == 2 and "lower" in problems[0] and
+                   "sum of new cases" in problems[1],
+                   "Wrong totals should be reported, not " + str(problems))
+
+        os.remove(self.slice_path("2020-03-02"))
+        problems = self.problems()
+        self.check("missing files" in problems[0] and
+                   "1 days are missing" in problems[1],
+                   "Missing days should be reported, not " + str(problems))
+
+        new_cases["3|3"] = 1
+        generate_full_data.write_slices(new_cases, new_cases.cumsum(),
+            self.temp_dir, "2020-03-04", overwrite=True, quiet=True)
+        problems = self.problems()
+        self.check(len(problems) == 1 and "location info" in problems[0],
+                   "Unknown locations should be reported, not " + str(problems))
+
+        # Days without any case have no row in either source, they should
+        # still get a slice.
+        shutil.rmtree(self.temp_dir)
+        self.temp_dir = tempfile.mkdtemp()
+        world = pd.DataFrame({"date": ["01.03.2020", "04.03.2020"],
+                              "1|1": [1, 2]})
+        us = pd.DataFrame({"date": ["06.03.2020"], "2|2": [3]})
+        merged, latest_date = generate_full_data.merge_data(world, us)
+        self.check(list(merged.index) == ["2020.03.0" + str(d) for d in range(1, 7)]
+                   and merged.loc["2020.03.02"].sum() == 0 and
+                   merged.values.sum() == 6,
+                   "Merging should fill in days without cases, not " +
+                   str(merged))
+        generate_full_data.write_slices(merged, merged.cumsum(), self.temp_dir,
+            latest_date, overwrite=True, quiet=True)
+        self.check(self.problems() == [],
+                   "Slices of merged data with days without cases should be "
+                   "consistent, not " + str(self.problems()))
+        shutil.rmtree(self.temp_dir)
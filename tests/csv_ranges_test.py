@@ -0,0 +1,39 @@
+import base_test
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import csv_ranges
+
+class CsvRangesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "CSV byte range tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, "data.csv")
+        rows = []
+        for i in range(40):
+            notes = ["plain", '"two\nlines"', '"with ""quotes"" and\n""a newline"""',
+                     '"comma, and\n\nblank line"', '""'][i % 5]
+            rows.append(str(i) + ",city " + str(i) + "," + notes + ",x")
+        with open(path, "w") as f:
+            f.write("ID,city,notes,other\n" + "\n".join(rows) + "\n")
+        expected = pd.read_csv(path, dtype=str)
+
+        for parts in [1, 2, 3, 7, 16, 100]:
+            ranges = csv_ranges.split_ranges(path, parts)
+            self.check(ranges[0][0] == len("ID,city,notes,other\n") and
+                       ranges[-1][1] == os.path.getsize(path) and
+                       all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])),
+                       "Ranges should cover the records without gaps")
+            result = pd.concat([csv_ranges.read_range(path, start, end, dtype=str)
+                                for start, end in ranges], ignore_index=True)
+            self.check(result.equals(expected),
+                       "Reading " + str(parts) + " parts should give the same "
+                       "as reading everything")
+        shutil.rmtree(temp_dir)
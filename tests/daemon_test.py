@@ -0,0 +1,193 @@
+import base_test
+import glob
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append("scripts")
+import daemon
+import generate_full_data
+# Imported by stages, from a directory we won't be in anymore.
+import ingest
+
+LATEST_DATA = ("ID,city,province,country,date_confirmation,latitude,longitude\n"
+               "1,Berlin,Berlin,Germany,01.03.2020,52.52,13.405\n"
+               "2,Paris,,France,09.03.2020,48.8566,2.3522\n"
+               "3,Paris,,France,10.03.2020,48.8566,2.3522\n")
+
+JHU_DATA = ("Admin2,Province_State,Country_Region,Lat,Long_,3/1/20,3/2/20\n"
+            "King,Washington,US,47.4914,-121.8346,1,3\n")
+
+class DaemonTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Daemon tests"
+
+    def write(self, name, content):
+        with open(os.path.join(self.temp_dir, name), "w") as f:
+            f.write(content)
+
+    def run(self):
+        self.temp_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        # The pipeline writes the location info in 'app'.
+        os.makedirs(os.path.join(self.temp_dir, "app"))
+        shutil.copy(generate_full_data.COUNTRIES_FILE,
+                    os.path.join(self.temp_dir, "app"))
+        os.chdir(self.temp_dir)
+        try:
+            self.check_source()
+            self.check_refresh()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(self.temp_dir)
+
+    def check_source(self):
+        self.write("source.csv", "a")
+        source = daemon.Source("source", "source.csv", ".")
+        self.check(source.poll(), "A new source should have changed")
+        self.check(source.poll(), "Sources should change until committed")
+        source.commit()
+        self.check(not source.poll(), "Sources shouldn't change on their own")
+        # Same content, different modification time.
+        os.utime("source.csv", (time.time() + 10, time.time() + 10))
+        self.check(not source.poll(), "Touching a source shouldn't change it")
+        self.write("source.csv", "b")
+        self.check(source.poll(), "Sources should change with their content")
+
+    def files(self):
+        """
+        Returns the modification time of every slice and tile, by path.
+        """
+        paths = glob.glob("dailies/**/*.json", recursive=True)
+        paths += glob.glob("dailies/**/*.pbf", recursive=True)
+        return {path: os.stat(path).st_mtime_ns for path in paths}
+
+    def rewritten(self, before):
+        """
+        Returns the slices and tiles that were added or written again since
+        'before', and those that are gone.
+        """
+        # Modification times are only so precise.
+        time.sleep(0.01)
+        after = self.files()
+        return (set(p for p in after if before.get(p) != after[p]),
+                set(before) - set(after))
+
+    def compare_with_pipeline(self, d):
+        """
+        Checks that the daemon wrote the same as generate_full_data.
+        """
+        # The pipeline rewrites the location info the daemon has mapped.
+        d.close_location_index()
+        os.makedirs("batch")
+        generate_full_data.generate_data("batch", latest="latestdata.csv",
+            input_jhu="jhu.csv", overwrite=True, quiet=True, zoom_levels=[2],
+            periods=["week"], tile_zoom_levels=[2], latest_counts_file="batch.json")
+        for path in ["manifest.json", "latest.json", "weekly/manifest.json",
+                     "weekly/latest.json", "z2/manifest.json", "z2/latest.json",
+                     "aggregates/countries.json", "aggregates/provinces.json",
+                     "tiles/index.json"]:
+            with open(os.path.join("dailies", path)) as f:
+                ours = json.load(f)
+            with open(os.path.join("batch", path)) as f:
+                theirs = json.load(f)
+            self.check(ours == theirs, "The daemon should write the same '" +
+                       path + "' as the pipeline: " + str(ours) + " vs " + str(theirs))
+        with open("counts.json") as f, open("batch.json") as g:
+            self.check(json.load(f) == json.load(g),
+                       "The daemon should write the same counts as the pipeline")
+        shutil.rmtree("batch")
+
+    def check_refresh(self):
+        self.write("latestdata.csv", LATEST_DATA)
+        self.write("jhu.csv", JHU_DATA)
+        os.makedirs("dailies")
+        os.makedirs("work")
+        d = daemon.Daemon("dailies", "work", "latestdata.csv", "jhu.csv",
+                          quiet=True, periods=["week"], zoom_levels=[2],
+                          tile_zoom_levels=[2], latest_counts_file="counts.json")
+        server = daemon.serve_stats(d, 0)
+        connection = http.client.HTTPConnection("127.0.0.1",
+                                                server.server_address[1])
+        def get(path):
+            connection.request("GET", path)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        try:
+            self.check(get("/health")[0] == 503,
+                       "The daemon shouldn't be healthy before refreshing")
+            self.check(d.refresh(), "The first refresh should write slices")
+            status, stats = get("/health")
+            self.check(status == 200 and stats["status"] == "ok",
+                       "The daemon should be healthy after refreshing")
+            status, stats = get("/stats")
+            self.check(stats["dates"] == 10 and stats["locations"] == 3 and
+                       "slices" in stats["timings"],
+                       "Stats should describe the matrix: " + str(stats))
+            for path in ["dailies/manifest.json", "dailies/weekly/manifest.json",
+                         "dailies/z2/manifest.json", "dailies/aggregates/countries.json",
+                         "dailies/tiles/index.json", "counts.json"]:
+                self.check(os.path.exists(path), "Refreshing should write " + path)
+            self.check(not d.refresh(), "Nothing should be written when "
+                       "sources didn't change")
+
+            before = self.files()
+            written = stats["slices_written"]
+            self.write("latestdata.csv", LATEST_DATA +
+                       "4,Berlin,Berlin,Germany,10.03.2020,52.52,13.405\n")
+            self.check(d.refresh(), "An appended row should be applied")
+            rewritten, gone = self.rewritten(before)
+            expected = set(os.path.join("dailies", path) for path in [
+                "latest.json", "manifest.json", "weekly/latest.json",
+                "weekly/manifest.json", "z2/latest.json", "z2/manifest.json",
+                "aggregates/countries.json", "aggregates/provinces.json",
+                "tiles/index.json"])
+            tiles = set(p for p in rewritten if p.endswith(".pbf"))
+            self.check(rewritten - tiles == expected and not gone,
+                       "Only the latest slices should be written again, not " +
+                       str(sorted(rewritten - tiles - expected)))
+            self.check(tiles and all(p.startswith("dailies/tiles/2020.03.10/")
+                                     for p in tiles),
+                       "Only the tiles of the latest date should be written "
+                       "again, not " + str(sorted(tiles)))
+            self.check(d.snapshot()["slices_written"] == written + 3,
+                       "Stats should count the slices written")
+            with open("dailies/latest.json") as f:
+                latest = json.load(f)
+            self.check({"geoid": "52.52|13.405", "new": 1, "total": 2} in
+                       [feature["properties"] for feature in latest["features"]],
+                       "The latest slice should have the new case: " + str(latest))
+            self.compare_with_pipeline(d)
+
+            # A new date, in a new location.
+            before = self.files()
+            self.write("latestdata.csv", LATEST_DATA +
+                       "4,Berlin,Berlin,Germany,10.03.2020,52.52,13.405\n"
+                       "5,Rome,Lazio,Italy,11.03.2020,41.9028,12.4964\n")
+            self.check(d.refresh(), "A new date should be applied")
+            rewritten, gone = self.rewritten(before)
+            dated = set(p for p in rewritten if "2020.03." in os.path.basename(p)
+                        and p.endswith(".json"))
+            self.check(len(dated) == 2 and
+                       all(os.path.basename(p).startswith("2020.03.10.")
+                           for p in dated) and not gone,
+                       "Only the previous latest slices should get a dated "
+                       "name, not " + str(sorted(dated)))
+            self.compare_with_pipeline(d)
+
+            # Rows that change rather than get appended.
+            self.write("latestdata.csv", LATEST_DATA.replace("01.03.2020", "05.03.2020") +
+                       "5,Rome,Lazio,Italy,11.03.2020,41.9028,12.4964\n")
+            self.check(d.refresh(), "Modified and removed rows should be applied")
+            self.compare_with_pipeline(d)
+            self.check(get("/nope")[0] == 404, "Unknown paths should be a 404")
+        finally:
+            d.close_location_index()
+            connection.close()
+            server.shutdown()
+            server.server_close()
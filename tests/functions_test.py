@@ -0,0 +1,28 @@
+import base_test
+import pandas as pd
+import sys
+
+sys.path.append("scripts")
+import benchmarks
+import functions
+
+class CleanDataTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Sheet cleaning tests"
+
+    def run(self):
+        # Sheets concatenated without ignore_index repeat index labels.
+        data = pd.concat([benchmarks.synthetic_sheet(200, seed=0),
+                          benchmarks.synthetic_sheet(200, seed=1)])
+        self.check(not data.index.is_unique, "The test sheet should repeat labels")
+        expected = benchmarks.legacy_clean_data(data, benchmarks.SHEET_COLUMNS)
+        result = functions.clean_data(data, benchmarks.SHEET_COLUMNS)
+        self.check(list(result.index) == list(expected.index),
+                   "The same rows should be kept, with their labels")
+        self.check(result.astype(object).reset_index(drop=True).equals(
+                       expected.reset_index(drop=True)),
+                   "Cleaning should match the row by row version")
+        self.check(result.date_confirmation.str.strip().equals(
+                       result.date_confirmation),
+                   "Confirmation dates should be stripped")
@@ -0,0 +1,159 @@
+import base_test
+import hashlib
+import json
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import generate_full_data
+
+def new_cases_matrix(columns, dates):
+    return pd.DataFrame(columns, index=pd.Index(dates, name="date"))
+
+class SlicesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Daily slice tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        dates = ["2020.03.01", "2020.03.02", "2020.03.03"]
+        new_cases = new_cases_matrix(
+            {"52.52|13.405": [1, 0, 2], "48.8566|2.3522": [0, 3, 1]}, dates)
+        write = lambda new_cases: generate_full_data.write_slices(
+            new_cases, new_cases.cumsum(), temp_dir, "2020-03-03",
+            overwrite=True, quiet=True)
+        write(new_cases)
+
+        with open(os.path.join(temp_dir, generate_full_data.MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.check(manifest["latest"] == "2020-03-03" and
+                   sorted(manifest["slices"]) == ["2020-03-01", "2020-03-02"],
+                   "The manifest should list dated slices by date")
+        for date, name in manifest["slices"].items():
+            with open(os.path.join(temp_dir, name)) as f:
+                content = f.read()
+            self.check(name == date.replace("-", ".") + "." +
+                       hashlib.sha1(content.encode("utf-8")).hexdigest()[:12] +
+                       ".json", "Slices should be named after their content")
+            self.check(json.loads(content)["date"] == date,
+                       "Slices should be for the date they're listed for")
+        with open(os.path.join(temp_dir, generate_full_data.LATEST_SLICE_FILE)) as f:
+            self.check(json.load(f)["date"] == "2020-03-03",
+                       "The latest slice should keep its fixed name")
+
+        # Files that aren't dated slices should survive the cleanup.
+        for name in ["notes.json", "2020.03.01.json.gz"]:
+            with open(os.path.join(temp_dir, name), "w") as f:
+                f.write("{}")
+        os.mkdir(os.path.join(temp_dir, "weekly"))
+        write(new_cases)
+        self.check(generate_full_data.read_manifest(temp_dir) == manifest["slices"],
+                   "Slices with the same content should keep their name")
+
+        changed = new_cases.copy()
+        changed.loc["2020.03.02", "52.52|13.405"] = 5
+        write(changed)
+        names = generate_full_data.read_manifest(temp_dir)
+        self.check(names["2020-03-02"] != manifest["slices"]["2020-03-02"] and
+                   names["2020-03-01"] == manifest["slices"]["2020-03-01"],
+                   "Only slices whose content changed should be renamed")
+        self.check(sorted(os.listdir(temp_dir)) == sorted(
+                       list(names.values()) + ["2020.03.01.json.gz", "latest.json",
+                       "manifest.json", "notes.json", "weekly"]),
+                   "Stale slices, and only them, should be removed")
+        shutil.rmtree(temp_dir)
+
+class ResampleTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Resampling tests"
+
+    def run(self):
+        # Dates come in the order they first appear in the line list.
+        new_cases = new_cases_matrix(
+            {"52.52|13.405": [4, 1, 2, 8, 16], "48.8566|2.3522": [0, 1, 0, 3, 0]},
+            ["2020.03.01", "2020.02.29", "2020.03.02", "2020.03.31", "2020.04.01"])
+
+        weekly = generate_full_data.resample_new_cases(new_cases, "week")
+        self.check(list(weekly.index) == ["2020.02.24", "2020.03.02",
+                   "2020.03.09", "2020.03.16", "2020.03.23", "2020.03.30"],
+                   "Weeks should start on Mondays, without gaps: " +
+                   str(list(weekly.index)))
+        self.check(list(weekly["52.52|13.405"]) == [5, 2, 0, 0, 0, 24] and
+                   list(weekly["48.8566|2.3522"]) == [1, 0, 0, 0, 0, 3],
+                   "Weeks should end on Sundays")
+
+        monthly = generate_full_data.resample_new_cases(new_cases, "month")
+        self.check(list(monthly.index) == ["2020.02.01", "2020.03.01", "2020.04.01"],
+                   "Months should be named after their first day")
+        self.check(list(monthly["52.52|13.405"]) == [1, 14, 16] and
+                   list(monthly["48.8566|2.3522"]) == [1, 3, 0],
+                   "Months should end on their last day")
+        for resampled in [weekly, monthly]:
+            self.check(resampled.sum().equals(new_cases.sum()),
+                       "Resampled totals should be the daily ones")
+
+        temp_dir = tempfile.mkdtemp()
+        generate_full_data.write_resampled_slices(new_cases, temp_dir, ["week"],
+                                                  quiet=True)
+        with open(os.path.join(temp_dir, "weekly", "latest.json")) as f:
+            latest = json.load(f)
+        totals = {p["properties"]["geoid"]: p["properties"]["total"]
+                  for p in latest["features"]}
+        self.check(latest["date"] == "2020-03-30" and
+                   totals == {"52.52|13.405": 31, "48.8566|2.3522": 4},
+                   "The latest weekly slice should be for the current week")
+        shutil.rmtree(temp_dir)
+
+class AggregatesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Aggregate series tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        info_file = os.path.join(temp_dir, "location_info.data")
+        with open(info_file, "w") as f:
+            f.write("52.52|13.405:Berlin,Berlin,DE\n"
+                    "48.1351|11.582:Munich,Bavaria,DE\n"
+                    "48.8566|2.3522:Paris,,FR")
+        location_info = {g: info for g, info in [
+            ("52.52|13.405", ("Berlin", "DE")), ("48.1351|11.582", ("Bavaria", "DE")),
+            ("48.8566|2.3522", ("", "FR"))]}
+        new_cases = new_cases_matrix(
+            {"52.52|13.405": [1, 0, 2, 0], "48.1351|11.582": [0, 3, 1, 1],
+             "48.8566|2.3522": [2, 0, 0, 5],
+             # Not in the location info, left out.
+             "1.0|1.0": [9, 9, 9, 9]},
+            ["2020.03.01", "2020.03.02", "2020.03.03", "2020.03.04"])
+        generate_full_data.write_slices(new_cases, new_cases.cumsum(), temp_dir,
+                                        "2020-03-04", quiet=True)
+        generate_full_data.write_aggregates(new_cases, info_file, temp_dir)
+
+        names = generate_full_data.read_manifest(temp_dir)
+        names["2020-03-04"] = generate_full_data.LATEST_SLICE_FILE
+        for aggregate, level in [("provinces", 0), ("countries", 1)]:
+            with open(os.path.join(temp_dir, "aggregates", aggregate + ".json")) as f:
+                aggregates = json.load(f)
+            self.check(aggregates["dates"] == sorted(names),
+                       "Aggregates should have every date")
+            for i, date in enumerate(aggregates["dates"]):
+                with open(os.path.join(temp_dir, names[date])) as f:
+                    features = json.load(f)["features"]
+                sums = {}
+                for p in [feature["properties"] for feature in features]:
+                    if p["geoid"] not in location_info:
+                        continue
+                    name = location_info[p["geoid"]][level]
+                    new, total = sums.get(name, (0, 0))
+                    sums[name] = (new + p.get("new", 0), total + p["total"])
+                self.check(all(sums.get(name, (0, 0)) == (s["new"][i], s["total"][i])
+                               for name, s in aggregates["series"].items()) and
+                           set(sums) <= set(aggregates["series"]),
+                           "The " + aggregate + " on " + date + " should add up "
+                           "the slice of that day")
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,90 @@
+import base_test
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import generate_full_data
+import ingest
+
+HEADER = "ID,city,province,country,date_confirmation,latitude,longitude\n"
+
+ROWS = [
+    "1,Berlin,Berlin,Germany,01.03.2020,52.52,13.405",
+    "2,Munich,Bavaria,Germany,01.03.2020,48.1351,11.582",
+    "3,Paris,,France,02.03.2020,48.8566,2.3522",
+    # Repeated IDs, both rows count.
+    "3,Paris,,France,03.03.2020,48.8566,2.3522",
+    # Left out: in the US, and without coordinates.
+    "4,Seattle,Washington,United States,02.03.2020,47.6062,-122.3321",
+    "5,Lyon,,France,02.03.2020,,",
+]
+
+class IngestTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Incremental ingest tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        self.csv = os.path.join(temp_dir, "latestdata.csv")
+        self.state = os.path.join(temp_dir, "ingest.pickle")
+        self.temp_dir = temp_dir
+
+        self.check_ingest(ROWS, "initial rows")
+
+        appended = ROWS + ["6,Berlin,Berlin,Germany,04.03.2020,52.52,13.405",
+                           "7,Rome,Lazio,Italy,04.03.2020,41.9028,12.4964"]
+        self.check(self.appended_only(appended),
+                   "Appended rows should be read on their own")
+        self.check_ingest(appended, "appended rows")
+
+        modified = list(appended)
+        modified[1] = "2,Munich,Bavaria,Germany,02.03.2020,48.1351,11.582"
+        modified[5] = "5,Lyon,,France,02.03.2020,45.764,4.8357"
+        self.check(not self.appended_only(modified),
+                   "Modified rows should make us read the whole file")
+        self.check_ingest(modified, "modified rows")
+
+        removed = modified[:2] + modified[4:6] + modified[7:]
+        self.check_ingest(removed, "removed rows")
+
+        duplicated = removed + ["1,Berlin,Berlin,Germany,04.03.2020,52.52,13.405",
+                                "7,Paris,,France,05.03.2020,48.8566,2.3522"]
+        self.check(not self.appended_only(duplicated),
+                   "Appended rows with known IDs should make us read the "
+                   "whole file")
+        self.check_ingest(duplicated, "appended rows with repeated IDs")
+        shutil.rmtree(temp_dir)
+
+    def write_csv(self, rows):
+        with open(self.csv, "w") as f:
+            f.write(HEADER + "\n".join(rows) + "\n")
+
+    def appended_only(self, rows):
+        self.write_csv(rows)
+        with open(self.csv, "rb") as f:
+            content = f.read()
+        return ingest.read_appended_rows(
+            content, ingest.load_state(self.state)) is not None
+
+    def check_ingest(self, rows, what):
+        '''
+        Checks that ingesting 'rows' on top of the current state gives the
+        same as reading them all from scratch.
+        '''
+        self.write_csv(rows)
+        incremental_info = os.path.join(self.temp_dir, "incremental.data")
+        full_info = os.path.join(self.temp_dir, "full.data")
+        incremental = ingest.ingest_latest_data(self.csv, self.state, quiet=True,
+            location_info_file=incremental_info)
+        full = generate_full_data.prepare_latest_data(self.csv, quiet=True,
+            location_info_file=full_info)
+        self.check(incremental.astype("int64").equals(full.astype("int64")),
+                   "Ingesting " + what + " should give the same as reading "
+                   "everything:\n" + str(incremental) + "\n" + str(full))
+        with open(incremental_info) as f1, open(full_info) as f2:
+            self.check(sorted(f1.read().split("\n")) == sorted(f2.read().split("\n")),
+                       "Ingesting " + what + " should give the same location "
+                       "info as reading everything")
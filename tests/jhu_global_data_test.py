@@ -0,0 +1,86 @@
+import base_test
+import datetime
+import gzip
+import json
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import data_util
+import jhu_global_data
+
+class JhuGlobalDataTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Per-country totals tests"
+
+    def run(self):
+        report = pd.DataFrame({
+            "Country_Region": ["France", "US", "France", "US", "Chad", "Peru"],
+            "Lat": [48.8566, 47.4914, 45.764, 40.7128, 12.1348, None],
+            "Long_": [2.3522, -121.8346, 4.8357, -74.006, 15.0557, -77.0428],
+            "Confirmed": [1500, 3000, 500, 2, 7, 40]})
+        snapshot = jhu_global_data.country_snapshot(report, format_counts=False)
+        attributes = [f["attributes"] for f in snapshot["features"]]
+        self.check([(a["ADM0_NAME"], a["cum_conf"]) for a in attributes] ==
+                   [("United States of America", 3002), ("France", 2000),
+                    ("Chad", 7)],
+                   "Cases should be summed by country, in decreasing order, "
+                   "leaving out locations without coordinates")
+        self.check([a["legendGroup"] for a in attributes] == ["default", "2000", "10"],
+                   "Countries should be in the legend group of their count")
+        centroids = [f["centroid"] for f in snapshot["features"]]
+        self.check(centroids[0] == {"x": jhu_global_data.CENTRAL_US_LONG,
+                                    "y": jhu_global_data.CENTRAL_US_LAT} and
+                   centroids[1] == {"x": 2.3522, "y": 48.8566},
+                   "Countries should be placed at their first location, the "
+                   "US in its center")
+        formatted = jhu_global_data.country_snapshot(report)
+        self.check(formatted["features"][0]["attributes"]["cum_conf"] == "3,002",
+                   "Counts should be formatted when asked to")
+
+
+class CountryTotalsFileTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Per-country totals file tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        date = datetime.datetime(2020, 5, 1)
+        # A cached daily report, so that nothing is fetched.
+        with open(os.path.join(temp_dir, "05-01-2020.csv"), "w") as f:
+            f.write("Country_Region,Lat,Long_,Confirmed\n"
+                    "France,48.8566,2.3522,1500\n"
+                    "US,47.4914,-121.8346,3000\n"
+                    "France,45.764,4.8357,500\n")
+        path = os.path.join(temp_dir, data_util.COUNTRY_TOTALS_FILE)
+        self.check(jhu_global_data.write_snapshot(date, path, temp_dir,
+                                                  format_counts=False),
+                   "The snapshot should be written from a cached report")
+        with open(path, "rb") as f:
+            content = f.read()
+        features = json.loads(content.decode("utf-8"))["features"]
+        self.check([(f["attributes"]["ADM0_NAME"], f["attributes"]["cum_conf"])
+                    for f in features] ==
+                   [("United States of America", 3000), ("France", 2000)],
+                   "The totals file should parse, with one feature per country")
+        self.check(all(type(f["attributes"]["cum_conf"]) == int and
+                       set(f["centroid"]) == set(["x", "y"]) for f in features),
+                   "Counts should be plain numbers for the client to sort, "
+                   "next to a centroid")
+
+        data_util.precompress(path)
+        with gzip.open(path + ".gz", "rb") as f:
+            self.check(f.read() == content,
+                       "The gzip copy should decompress to the totals file")
+        with open(path + ".gz", "rb") as f:
+            first = f.read()
+        data_util.precompress(path)
+        with open(path + ".gz", "rb") as f:
+            self.check(f.read() == first,
+                       "Compressing the same file twice should give the same bytes")
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,72 @@
+import base_test
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import location_index
+
+OLD_INFO = ("52.52|13.405:Berlin,Berlin,DE\n"
+            "48.8566|2.3522:Paris,Ile-De-France,FR\n"
+            "35.6762|139.6503:Tokyo,Tokyo,JP")
+NEW_INFO = ("52.52|13.405:Berlin,Berlin,DE\n"
+            "48.8566|2.3522:,Ile-De-France,FR\n"
+            "40.4168|-3.7038:Madrid,Madrid,ES")
+
+class LocationIndexTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Location index tests"
+
+    def write(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def run(self):
+        self.temp_dir = tempfile.mkdtemp()
+        old_path = self.write("old.data", OLD_INFO)
+        new_path = self.write("new.data", NEW_INFO)
+
+        location_index.build_index(old_path)
+        self.check(os.path.exists(old_path + location_index.INDEX_SUFFIX),
+                   "Building an index should write a sidecar file")
+
+        with location_index.LocationIndex(old_path) as index:
+            self.check(len(index) == 3,
+                       "The index should contain every geoid")
+            self.check(index.lookup("52.52|13.405") == ("Berlin", "Berlin", "DE"),
+                       "Known geoids should resolve to their location")
+            self.check(index.lookup("0.0|0.0") is None,
+                       "Unknown geoids should not resolve")
+            self.check(list(index) == sorted(list(index)),
+                       "Geoids should be iterated in sorted order")
+
+        # Same size, different content, and possibly the same mtime.
+        stat = os.stat(old_path)
+        self.write("old.data", OLD_INFO.replace("Tokyo,Tokyo", "Kyoto,Kyoto"))
+        try:
+            location_index.LocationIndex(old_path)
+            self.check(False, "Edits that keep the size should be noticed")
+        except ValueError:
+            pass
+        # Touched, but with the same content.
+        self.write("old.data", OLD_INFO)
+        os.utime(old_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with location_index.LocationIndex(old_path) as index:
+            self.check(index.lookup("35.6762|139.6503") == ("Tokyo", "Tokyo", "JP"),
+                       "Touching the data file shouldn't outdate its index")
+
+        changes = location_index.diff(old_path, new_path)
+        self.check(changes["added"] == ["40.4168|-3.7038"],
+                   "The diff should list added geoids")
+        self.check(changes["removed"] == ["35.6762|139.6503"],
+                   "The diff should list removed geoids")
+        self.check([c[0] for c in changes["changed"]] == ["48.8566|2.3522"],
+                   "The diff should list changed geoids")
+
+    def tear_down(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        super().tear_down()
@@ -0,0 +1,75 @@
+import base_test
+import http.client
+import json
+import pandas as pd
+import sys
+import threading
+
+sys.path.append("scripts")
+import query
+
+class QueryTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Case query tests"
+
+    def run(self):
+        new_cases = pd.DataFrame(
+            {"52.52|13.405": [1, 0, 2], "52.5|13.4": [0, 1, 0],
+             "48.1351|11.582": [3, 0, 1], "48.8566|2.3522": [2, 0, 5],
+             "33.749|-84.388": [0, 4, 0], "41.7151|44.8271": [1, 0, 0],
+             "1.0|1.0": [7, 7, 7]},
+            index=pd.Index(["2020.03.01", "2020.03.02", "2020.03.03"],
+                           name="date"))
+        location_info = {"52.52|13.405": ["Berlin", "Berlin", "DE"],
+                         "52.5|13.4": ["Berlin", "Berlin", "DE"],
+                         "48.1351|11.582": ["Munich", "Bavaria", "DE"],
+                         "48.8566|2.3522": ["Paris", "", "FR"],
+                         "33.749|-84.388": ["Atlanta", "Georgia", "US"],
+                         "41.7151|44.8271": ["Tbilisi", "Georgia", "GE"]}
+        matrix = query.CaseMatrix(new_cases, location_info)
+
+        self.check(matrix.series(country="DE") ==
+                   {"dates": ["2020-03-01", "2020-03-02", "2020-03-03"],
+                    "new": [4, 1, 3], "total": [4, 5, 8]},
+                   "Series should add up the locations of a country")
+        self.check(matrix.series(city="Berlin", province="Berlin", country="DE",
+                                 start="2020-03-02") ==
+                   {"dates": ["2020-03-02", "2020-03-03"],
+                    "new": [1, 2], "total": [2, 4]},
+                   "Date ranges should keep totals from before them")
+        self.check(matrix.series(geoid="48.1351|11.582", end="2020.03.01")["total"]
+                   == [3], "Single locations should be queryable")
+        self.check(matrix.series(province="Georgia", country="US")["total"] ==
+                   [0, 4, 4], "Provinces should be told apart by their country")
+        self.check(matrix.series(city="Paris", province="", country="FR")["total"] ==
+                   [2, 2, 7], "Cities without a province should be queryable")
+        self.check(matrix.series()["total"][-1] == 41,
+                   "Series without filters should cover every location")
+        for filters in [{"country": "XX"}, {"province": "Georgia"},
+                        {"city": "Paris", "country": "FR"},
+                        {"city": "Paris", "province": "", "country": "DE"}]:
+            try:
+                matrix.series(**filters)
+                self.check(False, "Unknown or ambiguous locations should be "
+                           "an error: " + str(filters))
+            except query.QueryError:
+                pass
+
+        server = query.make_server(matrix, port=0, bind="localhost", quiet=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        connection = http.client.HTTPConnection("localhost",
+                                                server.server_address[1])
+        connection.request("GET", "/series?province=Bavaria&country=DE&start=2020-03-03")
+        response = connection.getresponse()
+        self.check(response.status == 200 and json.loads(response.read()) ==
+                   {"dates": ["2020-03-03"], "new": [1], "total": [4]},
+                   "The server should answer queries")
+        connection.request("GET", "/series?country=XX")
+        response = connection.getresponse()
+        response.read()
+        self.check(response.status == 404, "Unknown locations should be a 404")
+        connection.close()
+        server.shutdown()
+        server.server_close()
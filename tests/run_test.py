@@ -1,8 +1,78 @@
 import base_test
+import gzip
+import http.client
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+sys.path.append("scripts")
+import static_server
 
 class RunTest(base_test.BaseTest):
     def display_name(self):
         return "Local run tests"
 
+    def write(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def get(self, path, headers=None):
+        self.connection.request("GET", path, headers=headers or {})
+        response = self.connection.getresponse()
+        return response, response.read()
+
     def run(self):
-        pass
+        self.temp_dir = tempfile.mkdtemp()
+        self.write("dailies/2020.03.01.0123456789ab.json", b'{"date": "2020-03-01"}')
+        self.write("dailies/2020.03.01.0123456789ab.json.gz",
+                   gzip.compress(b'{"date": "2020-03-01"}'))
+        self.write("dailies/latest.json", b'{"date": "2020-03-02"}')
+        server = static_server.make_server(self.temp_dir, port=0,
+                                           bind="127.0.0.1", quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.connection = http.client.HTTPConnection(
+            "127.0.0.1", server.server_address[1], timeout=10)
+        try:
+            self.check_responses()
+        finally:
+            self.connection.close()
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(self.temp_dir)
+
+    def check_responses(self):
+        response, body = self.get("/dailies/2020.03.01.0123456789ab.json",
+                                  {"Accept-Encoding": "gzip, deflate"})
+        self.check(response.getheader("Content-Encoding") == "gzip" and
+                   gzip.decompress(body) == b'{"date": "2020-03-01"}',
+                   "Precompressed files should be served when accepted")
+        self.check("immutable" in response.getheader("Cache-Control"),
+                   "Daily slices should be cached for good")
+        socket = self.connection.sock
+
+        response, body = self.get("/dailies/2020.03.01.0123456789ab.json")
+        self.check(response.getheader("Content-Encoding") is None and
+                   body == b'{"date": "2020-03-01"}',
+                   "Uncompressed files should be served by default")
+        self.check(self.connection.sock is socket,
+                   "Connections should be kept alive")
+
+        response, body = self.get("/dailies/latest.json?nocache=1")
+        self.check(response.getheader("Cache-Control") == "no-cache",
+                   "The latest slice should be revalidated")
+        response, body = self.get("/dailies/latest.json",
+            {"If-None-Match": response.getheader("ETag")})
+        self.check(response.status == 304 and body == b"",
+                   "Unchanged files should get a 304 for their ETag")
+        response, body = self.get("/dailies/latest.json",
+            {"If-Modified-Since": response.getheader("Last-Modified")})
+        self.check(response.status == 304,
+                   "Unchanged files should get a 304 after their date")
+
+        response, body = self.get("/dailies/2020.03.02.json")
+        self.check(response.status == 404, "Missing files should get a 404")
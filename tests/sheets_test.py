@@ -0,0 +1,84 @@
+import base_test
+import configparser
+import sys
+import threading
+
+sys.path.append("scripts")
+import functions
+
+HEADER = ["ID", "latitude", "longitude", "city", "province", "",
+          "date_confirmation"]
+
+# Canned 'values' payloads, by spreadsheet ID and range.
+VALUES = {
+    ("sid1", "Sheet1!A:V"): [
+        HEADER,
+        ["1", "52.52", "13.405", "Berlin", "Berlin", "Germany", "01.03.2020"],
+        ["2", "#REF!", "13.405", "Berlin", "Berlin", "Germany", "01.03.2020"],
+    ],
+    ("sid1", "Sheet2!A:V"): [
+        HEADER,
+        ["3", "48.85", "2.35", "Paris", "Ile-De-France", "France", "02.03.2020"],
+        ["4", "48.85", "2.35", "Paris", "Ile-De-France", "France"],
+    ],
+    ("sid2", "Regional!A:V"): [
+        HEADER,
+        ["5", "35.67", "139.65", "Tokyo", "Tokyo", "Japan",
+         "01.03.2020-03.03.2020"],
+    ],
+}
+
+
+class FakeSheetsService(object):
+    '''
+    Stands in for the Sheets API service, serving canned values.
+    '''
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges):
+        with self.lock:
+            self.requests.append((spreadsheetId, list(ranges)))
+        return self.Request([VALUES[(spreadsheetId, r)] for r in ranges])
+
+    class Request(object):
+        def __init__(self, values):
+            self.values = values
+
+        def execute(self, http=None):
+            return {"valueRanges": [{"values": v} for v in self.values]}
+
+
+class SheetsTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Sheet loading tests"
+
+    def run(self):
+        sheets = [functions.GoogleSheet("sid1", "Sheet1", "ID"),
+                  functions.GoogleSheet("sid1", "Sheet2", "ID"),
+                  functions.GoogleSheet("sid2", "Regional", "ID")]
+        service = FakeSheetsService()
+        dropped = {}
+        df = functions.load_sheets(sheets, configparser.ConfigParser(),
+                                   service=service, dropped=dropped)
+
+        self.check(len(service.requests) == 2,
+                   "There should be one request per spreadsheet")
+        self.check(sorted(service.requests)[0] == ("sid1", ["Sheet1!A:V", "Sheet2!A:V"]),
+                   "Ranges from the same spreadsheet should be batched")
+        self.check(list(df.ID) == ["1", "3", "5"],
+                   "Only rows with valid coordinates and dates should be kept")
+        self.check(dropped == {"length": 0, "coordinates": 1,
+                               "empty date": 1, "date": 0},
+                   "Dropped rows should be counted by reason")
+        self.check("country" in df.columns,
+                   "The unnamed column after 'province' should be 'country'")
@@ -0,0 +1,48 @@
+import base_test
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import functions
+import snapping
+
+class SnappingTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Location snapping tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        in_file = os.path.join(temp_dir, "in.data")
+        out_file = os.path.join(temp_dir, "out.data")
+        with open(in_file, "w") as f:
+            # About 11 meters apart from one another.
+            f.write("52.52|13.405:Berlin,Berlin,DE\n"
+                    "52.5201|13.405:Berlin,Berlin,DE\n"
+                    "52.5202|13.405:Berlin,Berlin,DE\n"
+                    "52.5201|13.4051:Mitte,Berlin,DE\n"
+                    "48.8566|2.3522:Paris,,FR")
+        new_cases = pd.DataFrame(
+            {"52.52|13.405": [1, 0], "52.5201|13.405": [0, 1],
+             "52.5202|13.405": [3, 2], "52.5201|13.4051": [1, 1],
+             "48.8566|2.3522": [2, 0]},
+            index=pd.Index(["2020.03.01", "2020.03.02"], name="date"))
+
+        snapped = snapping.snap(new_cases, in_file, out_file, 15, quiet=True)
+        self.check(list(snapped.columns) ==
+                   ["48.8566|2.3522", "52.5201|13.4051", "52.5202|13.405"],
+                   "Close locations with the same info should be merged, "
+                   "into the one with the most cases")
+        self.check(list(snapped["52.5202|13.405"]) == [4, 3],
+                   "Cases of merged locations should add up")
+        self.check(sorted(functions.read_location_info(out_file)) ==
+                   sorted(snapped.columns),
+                   "Merged locations should be left out of location info")
+
+        snapped = snapping.snap(new_cases, in_file, out_file, 5, quiet=True)
+        self.check(len(snapped.columns) == 5,
+                   "Locations further apart shouldn't be merged")
+        shutil.rmtree(temp_dir)
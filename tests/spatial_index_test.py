@@ -0,0 +1,62 @@
+import base_test
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import functions
+import spatial_index
+
+class SpatialIndexTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Spatial index tests"
+
+    def run(self):
+        geoids = ["52.52|13.405", "52.5|13.4", "48.1351|11.582",
+                  "48.8566|2.3522", "-33.8688|151.2093"]
+        new_cases = pd.DataFrame(
+            {"52.52|13.405": [1, 0], "52.5|13.4": [0, 2],
+             "48.1351|11.582": [3, 1], "48.8566|2.3522": [2, 0],
+             "-33.8688|151.2093": [0, 4]},
+            index=pd.Index(["2020.03.01", "2020.03.02"], name="date"))
+        tile_index = spatial_index.build_tile_index(geoids, [0, 4])
+        self.check(list(tile_index[4]) ==
+                   ["4/8/5", "4/8/5", "4/8/5", "4/8/5", "4/14/9"],
+                   "Geoids should be bucketed in the tile they are in")
+
+        aggregated = spatial_index.aggregate_by_tile(new_cases, tile_index, 4)
+        centers = spatial_index.tile_centers(["4/8/5", "4/14/9"])
+        self.check(sorted(aggregated.columns) == sorted(centers.values),
+                   "Tiles should be named after their center")
+        self.check(list(aggregated[centers["4/8/5"]]) == [6, 3] and
+                   list(aggregated[centers["4/14/9"]]) == [0, 4],
+                   "Tiles should sum the cases of their geoids")
+        self.check(aggregated.values.sum() == new_cases.values.sum(),
+                   "No case should be lost")
+
+        # Other cases in the same tiles shouldn't move their center.
+        more_cases = new_cases * 10
+        more_cases["52.52|13.405"] = [100, 100]
+        self.check(list(spatial_index.aggregate_by_tile(
+                       more_cases, tile_index, 4).columns) ==
+                   list(aggregated.columns),
+                   "Tile centers should only depend on the tiles")
+
+        temp_dir = tempfile.mkdtemp()
+        in_file = os.path.join(temp_dir, "in.data")
+        out_file = os.path.join(temp_dir, "tiles.data")
+        with open(in_file, "w") as f:
+            f.write("52.52|13.405:Berlin,Berlin,DE\n"
+                    "48.1351|11.582:Munich,Bavaria,DE\n"
+                    "48.8566|2.3522:Paris,,FR")
+        spatial_index.write_tile_location_info([in_file], out_file, [0, 4])
+        tiles = functions.read_location_info(out_file)
+        self.check(tiles.get(centers["4/8/5"]) == ["", "", ""] and
+                   tiles.get(spatial_index.tile_centers(["0/0/0"])[0]) == ["", "", ""],
+                   "Tiles across countries shouldn't have a country")
+        self.check(len(tiles) == 2, "Only tiles with locations should have "
+                   "location info")
+        shutil.rmtree(temp_dir)
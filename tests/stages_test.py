@@ -0,0 +1,67 @@
+import base_test
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import stages
+
+class StagesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Pipeline stages tests"
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def pipeline(self, fail=False):
+        def copy(src, dst):
+            def func():
+                self.ran.append(os.path.basename(dst))
+                if fail and dst.endswith("c.txt"):
+                    raise RuntimeError("failed")
+                with open(src) as f_in, open(dst, "w") as f_out:
+                    f_out.write(f_in.read())
+            return func
+        return stages.Pipeline([
+            stages.Stage("b", copy(self.path("a.txt"), self.path("b.txt")),
+                         inputs=[self.path("a.txt")], outputs=[self.path("b.txt")]),
+            stages.Stage("c", copy(self.path("b.txt"), self.path("c.txt")),
+                         inputs=[self.path("b.txt")], outputs=[self.path("c.txt")]),
+        ], state_file=self.path("state.json"), quiet=True)
+
+    def run(self):
+        self.temp_dir = tempfile.mkdtemp()
+        with open(self.path("a.txt"), "w") as f:
+            f.write("1")
+
+        self.ran = []
+        try:
+            self.pipeline(fail=True).run()
+        except RuntimeError:
+            pass
+        self.check(self.ran == ["b.txt", "c.txt"],
+                   "Stages should run in dependency order")
+
+        self.ran = []
+        self.pipeline().run()
+        self.check(self.ran == ["c.txt"],
+                   "A failed run should resume after the last completed stage")
+
+        self.ran = []
+        self.pipeline().run()
+        self.check(self.ran == [],
+                   "Stages that are up to date should be skipped")
+
+        with open(self.path("a.txt"), "w") as f:
+            f.write("2")
+        status = dict(self.pipeline().status())
+        self.check(status["b"] is not None and status["c"] is not None,
+                   "Stages after changed inputs should be reported as stale")
+        self.ran = []
+        self.pipeline().run()
+        self.check(self.ran == ["b.txt", "c.txt"],
+                   "Changed inputs should make stages run again")
+
+        shutil.rmtree(self.temp_dir)
@@ -0,0 +1,103 @@
+import base_test
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+
+sys.path.append("scripts")
+import vector_tiles
+
+def read_varint(data, position):
+    result, shift = 0, 0
+    while True:
+        byte = data[position]
+        result |= (byte & 0x7f) << shift
+        position += 1
+        shift += 7
+        if byte < 0x80:
+            return result, position
+
+def read_message(data):
+    '''
+    Decodes a protocol buffer message into a list of (field, value) pairs,
+    where values are integers or bytes.
+    '''
+    fields, position = [], 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        if key & 0x7 == vector_tiles.VARINT:
+            value, position = read_varint(data, position)
+        else:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        fields.append((key >> 3, value))
+    return fields
+
+def read_packed(data):
+    values, position = [], 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+def decode_points(tile):
+    '''
+    Returns the name of the only layer of a tile, and its points as
+    (x, y, properties) tuples.
+    '''
+    layer = read_message([v for f, v in read_message(tile) if f == 3][0])
+    keys = [v.decode("utf-8") for f, v in layer if f == 3]
+    values = []
+    for f, v in layer:
+        if f == 4:
+            value_field, value = read_message(v)[0]
+            values.append(value.decode("utf-8") if value_field == 1 else value)
+    points = []
+    for f, v in layer:
+        if f != 2:
+            continue
+        feature = dict(read_message(v))
+        tags = read_packed(feature[2])
+        command, x, y = read_packed(feature[4])
+        unzigzag = lambda n: (n >> 1) ^ -(n & 1)
+        points.append((unzigzag(x), unzigzag(y),
+                       {keys[tags[i]]: values[tags[i + 1]]
+                        for i in range(0, len(tags), 2)}))
+    return dict(layer)[1].decode("utf-8"), points
+
+class VectorTilesTest(base_test.BaseTest):
+
+    def display_name(self):
+        return "Vector tiles tests"
+
+    def run(self):
+        temp_dir = tempfile.mkdtemp()
+        # The first two are in the same cell at zoom 0, but not at zoom 4.
+        new_cases = pd.DataFrame(
+            {"52.52|13.405": [1, 0], "52.5201|13.405": [0, 2],
+             "-33.8688|151.2093": [0, 0], "40.7128|-74.006": [3, 0]},
+            index=pd.Index(["2020.03.01", "2020.03.02"], name="date"))
+        vector_tiles.write_vector_tiles(new_cases, temp_dir, [0, 4], quiet=True)
+        tile_path = lambda *parts: os.path.join(
+            temp_dir, vector_tiles.TILES_DIR, *parts)
+
+        with open(tile_path("2020.03.02", "0", "0", "0.pbf"), "rb") as f:
+            name, points = decode_points(f.read())
+        self.check(name == vector_tiles.LAYER_NAME,
+                   "Tiles should have a layer named after cases")
+        properties = sorted([p for _, _, p in points], key=lambda p: p["geoid"])
+        self.check(properties == [
+            {"geoid": "40.7128|-74.006", "total": 3},
+            {"geoid": "52.5201|13.405", "new": 2, "total": 3}],
+            "Close points should be merged, not " + str(properties))
+        x, y, _ = [p for p in points if p[2]["geoid"] == "40.7128|-74.006"][0]
+        self.check((x, y) == (1205, 1540),
+                   "Points should be positioned in their tile")
+
+        self.check(os.path.exists(tile_path("2020.03.02", "4", "8", "5.pbf")),
+                   "Tiles should be written at each zoom level")
+        self.check(not os.path.exists(tile_path("2020.03.02", "4", "14", "9.pbf")),
+                   "Tiles without cases shouldn't be written")
+        shutil.rmtree(temp_dir)